@@ -0,0 +1,454 @@
+"""
+Resumable backfills of long date ranges: the range is split into
+chunks, each chunk is fetched, uploaded and checkpointed on its own,
+and worker processes claim chunks so that none is done twice.
+Author: Maciej Cisowski
+"""
+import os
+import json
+import socket
+import config
+import logging.config
+from config import LOGGING, BACKFILL, FETCH_WORKERS, FETCH_MAX_RPS, \
+    SCHEDULE
+from app import metrics
+from app.collect import iter_scoreboard_data, batch_items
+from app.data import merge_line_score, drop_committed_items
+from app.engine import item_source
+from app.commit import start_engine, dispose_engines, batch_upload, \
+    bulk_upload, plan_incremental, post_monitor_batch, committed_games
+from datetime import date, datetime, timedelta
+from functools import partial
+from multiprocessing import get_context
+from time import time
+from uuid import uuid4
+from sqlalchemy.engine import Engine
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.backfill")
+
+# config.py dicts a run may have changed at runtime, e.g. with
+# update_stats_config(), that worker processes need to see as well
+WORKER_SETTINGS = ("STATS", "CACHE", "SCHEDULE", "THROTTLE", "METRICS")
+
+
+def chunk_ranges(start_date: date, end_date: date, chunk_days: int) -> list:
+    """
+    :param start_date: first date of the range
+    :param end_date: last date of the range, inclusive
+    :param chunk_days: number of days per chunk, the last one may be
+    shorter
+    :return: list of (first date, last date) tuples
+    :rtype: list
+    """
+    chunks = []
+    first = start_date
+    while first <= end_date:
+        last = min(first + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((first, last))
+        first = last + timedelta(days=1)
+    return chunks
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Backfill(object):
+    """
+    A start to end date range split into chunks of <chunk_days>, with
+    its progress kept in a directory under <root> named after the
+    batch, the range and the chunk size, so a restarted backfill picks
+    up where it stopped. A chunk is claimed by creating its lock file
+    in <dir>/claims, which only one process can do, and checkpointed
+    by writing <dir>/done/<chunk>.json once all of its items were
+    committed. A worker touches its claim after every day it fetched
+    (see heartbeat()), and claims of dead processes on the same host,
+    or not touched for <stale_secs>, are taken over. The directory can
+    be shared between hosts, e.g. over NFS.
+    """
+
+    def __init__(self, start_date: date, end_date: date,
+                 chunk_days: int = BACKFILL["CHUNK_DAYS"],
+                 root: str = BACKFILL["DIR"], batch: str = "default",
+                 stale_secs: float = BACKFILL["STALE_CLAIM_SECS"]):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.chunk_days = chunk_days
+        self.batch = batch
+        self.stale_secs = stale_secs
+        self.dir = os.path.join(root, f"{batch}_{start_date:%Y%m%d}_"
+                                      f"{end_date:%Y%m%d}_{chunk_days}d")
+        os.makedirs(os.path.join(self.dir, "claims"), exist_ok=True)
+        os.makedirs(os.path.join(self.dir, "done"), exist_ok=True)
+
+    @staticmethod
+    def chunk_id(chunk: tuple) -> str:
+        return f"{chunk[0]:%Y%m%d}_{chunk[1]:%Y%m%d}"
+
+    def _claim_path(self, chunk: tuple) -> str:
+        return os.path.join(self.dir, "claims", f"{self.chunk_id(chunk)}.lock")
+
+    def _done_path(self, chunk: tuple) -> str:
+        return os.path.join(self.dir, "done", f"{self.chunk_id(chunk)}.json")
+
+    def chunks(self) -> list:
+        """
+        :return: list of (first date, last date) tuples of all chunks
+        :rtype: list
+        """
+        return chunk_ranges(self.start_date, self.end_date, self.chunk_days)
+
+    def checkpoints(self) -> dict:
+        """
+        :return: dict of {chunk id: checkpoint} of the finished chunks
+        :rtype: dict
+        """
+        done = {}
+        for name in os.listdir(os.path.join(self.dir, "done")):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.dir, "done", name)) as f:
+                    done[name[:-len(".json")]] = json.load(f)
+            except (OSError, ValueError):
+                logger.warning(f"Ignoring unreadable checkpoint: {name}")
+        return done
+
+    def pending(self) -> list:
+        """
+        :return: chunks not checkpointed yet, claimed or not
+        :rtype: list
+        """
+        done = self.checkpoints()
+        return [c for c in self.chunks() if self.chunk_id(c) not in done]
+
+    def _stale(self, path: str, seen: os.stat_result) -> bool:
+        try:
+            with open(path) as f:
+                claim = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # a claim being written right now, or a torn one
+            claim = {}
+        if claim.get("host") == socket.gethostname() and \
+                not _pid_alive(claim.get("pid", -1)):
+            return True
+        return time() - seen.st_mtime > self.stale_secs
+
+    def _take_over(self, path: str, seen: os.stat_result) -> bool:
+        """
+        Move a stale claim out of the way with an atomic rename to a
+        unique name, so that of several processes finding the
+        same claim stale only one removes it. A claim that turns out to
+        be a fresh one, made by a process that took over first, is put
+        back.
+        :param path: path of the claim
+        :param seen: os.stat() of the claim found stale
+        :return: True if this process removed the stale claim
+        :rtype: bool
+        """
+        moved = f"{path}.{uuid4().hex}.stale"
+        try:
+            os.rename(path, moved)
+        except FileNotFoundError:
+            return False
+        found = os.stat(moved)
+        # inodes of removed claims are reused, their mtimes tell them apart
+        if (found.st_dev, found.st_ino, found.st_mtime_ns) != \
+                (seen.st_dev, seen.st_ino, seen.st_mtime_ns):
+            try:
+                os.link(moved, path)
+            except FileExistsError:
+                logger.warning(f"Could not put back the claim: {path}")
+            os.remove(moved)
+            return False
+        logger.warning(f"Took over stale claim: {path}")
+        os.remove(moved)
+        return True
+
+    def claim(self, chunk: tuple) -> bool:
+        """
+        Claim a chunk for this process.
+        :param chunk: (first date, last date) tuple
+        :return: True if the chunk is now held by this process
+        :rtype: bool
+        """
+        path = self._claim_path(chunk)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    seen = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if not self._stale(path, seen) or \
+                        not self._take_over(path, seen):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"host": socket.gethostname(), "pid": os.getpid(),
+                           "claimed": datetime.now().isoformat()}, f)
+            return True
+        return False
+
+    def heartbeat(self, chunk: tuple) -> bool:
+        """
+        Touch the claim of a chunk, so that it is not taken over as
+        stale while this process is still working on it.
+        :param chunk: (first date, last date) tuple
+        :return: False if the claim is gone, e.g. taken over
+        :rtype: bool
+        """
+        try:
+            os.utime(self._claim_path(chunk))
+        except FileNotFoundError:
+            logger.warning(f"Lost the claim of chunk {self.chunk_id(chunk)}")
+            return False
+        return True
+
+    def release(self, chunk: tuple):
+        try:
+            os.remove(self._claim_path(chunk))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, chunk: tuple, results: list):
+        """
+        Checkpoint a chunk and release its claim.
+        :param chunk: (first date, last date) tuple
+        :param results: Monitor records of the chunk
+        """
+        path = self._done_path(chunk)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"first": chunk[0].isoformat(),
+                       "last": chunk[1].isoformat(),
+                       "records": len(results),
+                       "host": socket.gethostname(), "pid": os.getpid(),
+                       "finished": datetime.now().isoformat()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.release(chunk)
+
+    def next_chunk(self, skip: set = None) -> tuple:
+        """
+        :param skip: ids of chunks not to claim, e.g. the ones that
+        already failed in this process
+        :return: the first pending chunk this process managed to claim,
+        None once every chunk is done, skipped or claimed by others
+        :rtype: tuple
+        """
+        for chunk in self.pending():
+            if skip and self.chunk_id(chunk) in skip:
+                continue
+            if self.claim(chunk):
+                # it may have been finished between listing and claiming
+                if os.path.exists(self._done_path(chunk)):
+                    self.release(chunk)
+                    continue
+                return chunk
+        return None
+
+
+def uncovered_items(data: dict, results: list, batch_def: list) -> set:
+    """
+    :param data: merged Scoreboard data that was uploaded, see
+    drop_committed_items()
+    :param results: Monitor records of the upload
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :return: set of ("%Y/%m/%d", entry name) tuples of the entries that
+    had rows to write, or whose day failed, but were not committed
+    :rtype: set
+    """
+    committed = {(r.date.strftime("%Y/%m/%d"), r.item)
+                 for r in results if r.success}
+    expected = set()
+    for day, items in data.items():
+        for entry in batch_def:
+            frame = items.get(item_source(entry))
+            if getattr(items, "failed", False) or \
+                    frame is not None and not frame.empty:
+                expected.add((day, entry["name"]))
+    return expected - committed
+
+
+def run_chunk(chunk: tuple, db: Engine, monitor_db: Engine, batch_def: list,
+              mode: str = "batch", heartbeat=None, **fetch_args) -> tuple:
+    """
+    Fetch, merge and upload a single chunk and post its monitor
+    records. Dates are planned against the entries of the batch, so
+    items the monitor db already holds as committed, e.g. from an
+    earlier attempt at the chunk or from a run of another batch, are
+    not uploaded again, and neither are box scores the data db already
+    holds requested again. The chunk is covered once every entry with
+    rows to write on a fetched day was committed; a chunk with nothing
+    left to fetch is covered as well.
+    :param chunk: (first date, last date) tuple
+    :param db: SQLAlchemy Engine of the data db
+    :param monitor_db: SQLAlchemy Engine of the monitor db
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param mode: "bulk" uploads with bulk_upload(), anything else with
+    batch_upload()
+    :param heartbeat: optional callable invoked after every fetched day,
+    e.g. to touch the claim of the chunk
+    :param fetch_args: keyword arguments for iter_scoreboard_data()
+    :return: tuple of a list of Monitor SQLAlchemy objects and whether
+    the chunk is covered
+    :rtype: tuple
+    """
+    days, committed = plan_incremental(monitor_db, *chunk, batch_def)
+    if not days:
+        return [], True
+    fetched = {}
+    for day, items in iter_scoreboard_data(
+            days=days, items=batch_items(batch_def),
+            known_games=committed_games(db, batch_def), **fetch_args):
+        fetched[day] = items
+        if heartbeat is not None:
+            heartbeat()
+    data = drop_committed_items(merge_line_score(fetched), committed,
+                                batch_def)
+    upload = bulk_upload if mode == "bulk" else batch_upload
+    results = upload(data=data, db=db, batch_def=batch_def)
+    post_monitor_batch(db=monitor_db, data=results)
+    missing = uncovered_items(data, results, batch_def)
+    if missing:
+        logger.warning(f"Chunk {chunk[0]} to {chunk[1]} is missing "
+                       f"{len(missing)} items, e.g. {min(missing)}")
+    return results, not missing
+
+
+def backfill_worker(backfill: Backfill, db_url: str, monitor_db_url: str,
+                    batch_def: list, mode: str = "batch",
+                    **fetch_args) -> dict:
+    """
+    Claim and run chunks of a backfill until none is left. A chunk is
+    only checkpointed once run_chunk() found it covered; otherwise
+    its claim is released and it is not claimed again by this worker,
+    so it is left for the next run.
+    :param backfill: the Backfill to work on
+    :param db_url: url of the data db
+    :param monitor_db_url: url of the monitor db
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param mode: upload mode, see run_chunk()
+    :param fetch_args: keyword arguments for iter_scoreboard_data()
+    :return: dict of {"done": [chunk ids], "failed": [chunk ids]}
+    :rtype: dict
+    """
+    db = start_engine(db_url)
+    monitor_db = start_engine(monitor_db_url)
+    outcome = {"done": [], "failed": []}
+    failed = set()
+    chunk = backfill.next_chunk()
+    while chunk is not None:
+        chunk_id = backfill.chunk_id(chunk)
+        logger.info(f"Backfilling chunk {chunk_id} in process {os.getpid()}")
+        try:
+            results, covered = run_chunk(
+                chunk, db, monitor_db, batch_def, mode,
+                heartbeat=partial(backfill.heartbeat, chunk), **fetch_args)
+        except BaseException:
+            backfill.release(chunk)
+            raise
+        if covered:
+            backfill.complete(chunk, results)
+            outcome["done"].append(chunk_id)
+        else:
+            logger.error(f"Chunk {chunk_id} was not fully committed, it is "
+                         f"left for the next run.")
+            backfill.release(chunk)
+            failed.add(chunk_id)
+            outcome["failed"].append(chunk_id)
+        chunk = backfill.next_chunk(skip=failed)
+    return outcome
+
+
+def _process_worker(backfill: Backfill, db_url: str, monitor_db_url: str,
+                    batch_def: list, mode: str = "batch",
+                    settings: dict = None, run_id: str = None,
+                    **fetch_args) -> dict:
+    # a spawned process starts from the defaults of config.py, so the
+    # settings of the parent run are applied first, and the metrics
+    # collected under its run id are stored by the process itself
+    for name, values in (settings or {}).items():
+        getattr(config, name).update(values)
+    if run_id is not None:
+        metrics.start_run(run_id)
+    try:
+        return backfill_worker(backfill, db_url, monitor_db_url, batch_def,
+                               mode, **fetch_args)
+    finally:
+        if run_id is not None:
+            metrics.finish_run(start_engine(monitor_db_url), prom_file=None)
+        dispose_engines()
+
+
+def run_backfill(backfill: Backfill, db_url: str, monitor_db_url: str,
+                 batch_def: list, mode: str = "batch",
+                 processes: int = BACKFILL["PROCESSES"],
+                 workers: int = FETCH_WORKERS,
+                 max_rps: float = FETCH_MAX_RPS,
+                 skip_empty: bool = SCHEDULE["SKIP_EMPTY"]) -> dict:
+    """
+    Run a backfill in this process or in <processes> worker processes
+    sharing its claims. Each process fetches with <workers> threads and
+    its own <max_rps> ceiling, so the rate stays within the limit of
+    NBA.com only if <max_rps> is split accordingly. Worker processes
+    are given the WORKER_SETTINGS of this process and store their
+    metrics in the monitor db under the id of its run, if it has one.
+    :param backfill: the Backfill to run
+    :param db_url: url of the data db
+    :param monitor_db_url: url of the monitor db
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param mode: upload mode, see run_chunk()
+    :param processes: number of worker processes
+    :param workers: number of requests kept in flight per process
+    :param max_rps: ceiling for requests started per second, per process
+    :param skip_empty: do not request dates the season calendar knows
+    to have no games
+    :return: dict of {"done": [chunk ids], "failed": [chunk ids],
+    "pending": number of chunks left}
+    :rtype: dict
+    """
+    chunks = len(backfill.chunks())
+    logger.info(f"Backfilling {backfill.start_date} to {backfill.end_date} "
+                f"in {chunks} chunks of {backfill.chunk_days} days, "
+                f"{chunks - len(backfill.pending())} done already")
+    args = (backfill, db_url, monitor_db_url, batch_def, mode)
+    fetch_args = {"workers": workers, "max_rps": max_rps,
+                  "skip_empty": skip_empty}
+    if processes > 1:
+        # spawned rather than forked, so no engine or thread pool of
+        # this process is shared with its children
+        run = metrics.active_run()
+        worker_args = dict(fetch_args, run_id=run and run.run_id,
+                           settings={name: dict(getattr(config, name))
+                                     for name in WORKER_SETTINGS})
+        with get_context("spawn").Pool(processes) as pool:
+            outcomes = [pool.apply_async(_process_worker, args, worker_args)
+                        for _ in range(processes)]
+            outcomes = [o.get() for o in outcomes]
+    else:
+        outcomes = [backfill_worker(*args, **fetch_args)]
+    outcome = {"done": sorted(c for o in outcomes for c in o["done"]),
+               "failed": sorted(c for o in outcomes for c in o["failed"]),
+               "pending": len(backfill.pending())}
+    logger.info(f"Backfill finished {len(outcome['done'])} chunks, "
+                f"{outcome['pending']} left")
+    return outcome
@@ -0,0 +1,192 @@
+"""
+Per-game box scores of NBA_v2: every GAME_ID of a day's GameHeader is
+fanned out to the BoxScoreTraditionalV2 endpoint of nba-api by Swar
+Patel (swar): https://github.com/swar/nba_api
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING, BOXSCORE, STATS, THROTTLE, request_header
+from app import metrics
+from app.cache import ResponseCache
+from app.source import scoreboard_max_age, raw_response, \
+    endpoint_response
+from app.replay import save_fixture
+from app.throttle import AdaptiveThrottle, raise_for_status
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from pandas import DataFrame
+from nba_api.stats.endpoints import boxscoretraditionalv2
+from nba_api.stats.library.http import NBAStatsHTTP
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.boxscore")
+
+ENDPOINT = "boxscoretraditionalv2"
+# parameters of a request for a whole game, besides its GameID
+PARAMETERS = {"StartPeriod": 0, "EndPeriod": 0, "StartRange": 0,
+              "EndRange": 0, "RangeType": 0}
+# headers of each result set, for days without games
+HEADERS = boxscoretraditionalv2.BoxScoreTraditionalV2.expected_data
+
+
+def boxscore_items(items: set) -> dict:
+    """
+    :param items: names of the items a run needs, e.g. from
+    batch_items(), None for all Scoreboard items
+    :return: dict of {item name: result set name} of the box score
+    items among them, see BOXSCORE in config.py
+    :rtype: dict
+    """
+    if items is None:
+        return {}
+    return {item: result_set for item, result_set in BOXSCORE["ITEMS"].items()
+            if item in items}
+
+
+def game_ids(day_items) -> list:
+    """
+    :param day_items: Scoreboard items of a single day
+    :return: distinct GAME_IDs of the day's GameHeader, in order
+    :rtype: list
+    """
+    if "GameHeader" not in day_items:
+        return []
+    return list(dict.fromkeys(day_items["GameHeader"]["GAME_ID"]))
+
+
+def request_boxscore(game_id: str) -> dict:
+    """
+    Send a single BoxScoreTraditionalV2 request for a game, through the
+    nba-api endpoint or to the server at NBA_STATS_URL in config.py if
+    that is set. Error statuses raise a ResponseError.
+    :param game_id: GAME_ID of the game
+    :return: raw endpoint response
+    :rtype: RawResponse
+    """
+    logger.debug(f"Getting box score for game: {game_id}")
+    if not STATS["NBA_STATS_URL"]:
+        return endpoint_response(boxscoretraditionalv2.BoxScoreTraditionalV2(
+            game_id=game_id, headers=request_header,
+            timeout=THROTTLE["REQUEST_TIMEOUT_SECS"], get_request=False))
+    http = NBAStatsHTTP()
+    http.base_url = STATS["NBA_STATS_URL"].rstrip("/") + "/{endpoint}"
+    response = http.send_api_request(
+        endpoint=ENDPOINT,
+        parameters=dict(PARAMETERS, GameID=game_id),
+        headers=request_header,
+        timeout=THROTTLE["REQUEST_TIMEOUT_SECS"])
+    raise_for_status(response)
+    return raw_response(response)
+
+
+def cached_boxscore_json(game_id: str, day: str, cache: ResponseCache = None,
+                         throttle=None,
+                         adaptive: AdaptiveThrottle = None) -> dict:
+    """
+    Get the raw box score JSON of a game, from the response cache if it
+    holds a fresh copy or from NBA.com otherwise. With NBA_RECORD_DIR
+    set in config.py responses fetched from NBA.com are also saved as
+    replay fixtures, keyed by GAME_ID.
+    :param game_id: GAME_ID of the game
+    :param day: date string of the game formatted as "%Y/%m/%d", sets
+    the cache lifetime
+    :param cache: ResponseCache to consult and fill, None skips caching
+    :param throttle: optional callable invoked right before a request
+    is actually sent to NBA.com
+    :param adaptive: AdaptiveThrottle pacing and retrying the request,
+    used instead of <throttle>
+    :return: raw endpoint response
+    :rtype: dict
+    """
+    key = f"{ENDPOINT}/{game_id}"
+    if cache is not None:
+        t1 = perf_counter()
+        raw = cache.get(key, max_age=scoreboard_max_age(day))
+        if raw is not None:
+            metrics.record("cache", perf_counter() - t1, day=day,
+                           item=ENDPOINT)
+            return raw
+    if adaptive is not None:
+        raw, retries, latency = adaptive.call(request_boxscore, game_id)
+    else:
+        if throttle is not None:
+            throttle()
+        t1 = perf_counter()
+        raw = request_boxscore(game_id)
+        retries, latency = 0, perf_counter() - t1
+    metrics.record("fetch", latency, day=day, item=ENDPOINT,
+                   size_bytes=getattr(raw, "size_bytes", None),
+                   retries=retries)
+    if cache is not None:
+        cache.put(key, raw)
+    if STATS["NBA_RECORD_DIR"]:
+        save_fixture(STATS["NBA_RECORD_DIR"], game_id, raw, ENDPOINT,
+                     dict(PARAMETERS, GameID=game_id))
+    return raw
+
+
+class BoxScoreFanOut(object):
+    """
+    Fetches the box scores of every game of the days it is given on a
+    pool of <workers> threads, sharing the response cache and the
+    throttle of the Scoreboard requests. A game is only requested and
+    attached once, to the first day listing it, however often
+    overlapping days or ranges list it again. Games of finished days
+    that are among <known_games>, e.g. from committed_games() in
+    app/commit.py, are not requested at all, as earlier runs stored
+    them already. Use it as a context manager, or close() it, to shut
+    its pool down.
+    """
+
+    def __init__(self, items: dict, cache: ResponseCache = None,
+                 throttle=None, adaptive: AdaptiveThrottle = None,
+                 workers: int = BOXSCORE["WORKERS"],
+                 known_games: set = None):
+        self.items = items
+        self.fetch_args = {"cache": cache, "throttle": throttle,
+                           "adaptive": adaptive}
+        self.known_games = known_games or set()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._seen = set()
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, day: str, day_items):
+        """
+        Fetch the box scores of a day's games and add them to its
+        items as {item name: pandas DataFrame}.
+        :param day: date string formatted as "%Y/%m/%d"
+        :param day_items: Scoreboard items of that day, updated in place
+        """
+        # box scores of recent days may still change
+        known = self.known_games if scoreboard_max_age(day) is None \
+            else set()
+        with self._lock:
+            games = [g for g in game_ids(day_items)
+                     if g not in self._seen and g not in known]
+            self._seen.update(games)
+        futures = [self._pool.submit(cached_boxscore_json, game, day,
+                                     **self.fetch_args) for game in games]
+        rows = {item: [] for item in self.items}
+        headers = {}
+        for future in futures:
+            for result_set in future.result()["resultSets"]:
+                for item, name in self.items.items():
+                    if result_set["name"] == name:
+                        rows[item].extend(result_set["rowSet"])
+                        headers[item] = result_set["headers"]
+        for item, name in self.items.items():
+            day_items[item] = DataFrame(
+                rows[item], columns=headers.get(item, HEADERS[name]))
+        logger.debug(f"Fetched {len(games)} box scores for {day}")
+
+    def close(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,214 @@
+"""
+Persistent on-disk cache for raw responses from NBA.com.
+Author: Maciej Cisowski
+"""
+import os
+import gzip
+import json
+import atexit
+import hashlib
+import logging.config
+from config import LOGGING, CACHE
+from threading import RLock
+from time import time
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.cache")
+
+# shared instances, one per cache directory
+_caches = {}
+
+
+class ResponseCache(object):
+    """
+    Content-addressed store for raw JSON responses. Payloads are saved
+    once per sha256 digest under <path>/objects and an index maps cache
+    keys (e.g. "scoreboardv2/2019/12/02") to digests along with their
+    size and store/access times. The total size of the stored payloads
+    is kept under <max_bytes> by evicting the least recently used keys.
+    """
+
+    INDEX = "index.json"
+    # number of stored payloads after which the index is saved
+    FLUSH_EVERY = 32
+
+    def __init__(self, path: str = CACHE["NBA_CACHE_DIR"],
+                 max_bytes: int = CACHE["MAX_BYTES"],
+                 compress: bool = CACHE["COMPRESS"]):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = RLock()
+        self._unsaved = 0
+        # keys evicted since the last flush, with the time of eviction
+        self._evicted = {}
+        os.makedirs(os.path.join(self.path, "objects"), exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(os.path.join(self.path, self.INDEX)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.debug(f"Starting a new cache index in: {self.path}")
+            return {}
+
+    def _blob_path(self, digest: str, compressed: bool) -> str:
+        name = digest + (".json.gz" if compressed else ".json")
+        return os.path.join(self.path, "objects", digest[:2], name)
+
+    @staticmethod
+    def _write_atomic(path: str, content: bytes):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """
+        Persist the index, including access times, to disk, merged with
+        what other processes sharing the cache may have written there in
+        the meantime. The most recently stored entry of a key wins.
+        """
+        with self._lock:
+            merged = self._load_index()
+            for key, evicted in self._evicted.items():
+                if key in merged and merged[key]["stored"] <= evicted:
+                    merged.pop(key)
+            for key, entry in self._index.items():
+                other = merged.get(key)
+                if other is None or other["stored"] <= entry["stored"]:
+                    merged[key] = entry
+                else:
+                    other["accessed"] = max(other["accessed"],
+                                            entry["accessed"])
+            self._index = merged
+            self._evict()
+            self._evicted = {}
+            content = json.dumps(self._index).encode("utf-8")
+            self._write_atomic(os.path.join(self.path, self.INDEX), content)
+            self._unsaved = 0
+
+    def size(self) -> int:
+        """
+        :return: total number of bytes taken up by stored payloads
+        :rtype: int
+        """
+        with self._lock:
+            blobs = {(v["digest"], v["compressed"]): v["size"]
+                     for v in self._index.values()}
+            return sum(blobs.values())
+
+    def entries(self, prefix: str = "") -> dict:
+        """
+        :param prefix: only list keys starting with it
+        :return: dict of {key: time stored} of the cached payloads
+        :rtype: dict
+        """
+        with self._lock:
+            return {key: entry["stored"] for key, entry in self._index.items()
+                    if key.startswith(prefix)}
+
+    def get(self, key: str, max_age: float = None):
+        """
+        Look up a payload by key.
+        :param key: cache key
+        :param max_age: seconds after which a stored payload is stale,
+        None means it never expires
+        :return: the stored payload or None on a miss or stale entry
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if max_age is not None and time() - entry["stored"] > max_age:
+                logger.debug(f"Cache entry for {key} is stale.")
+                return None
+            entry["accessed"] = time()
+        path = self._blob_path(entry["digest"], entry["compressed"])
+        try:
+            if entry["compressed"]:
+                with gzip.open(path, "rb") as f:
+                    content = f.read()
+            else:
+                with open(path, "rb") as f:
+                    content = f.read()
+        except OSError:
+            logger.warning(f"Cache object for {key} is missing, dropping it.")
+            with self._lock:
+                self._index.pop(key, None)
+            return None
+        logger.debug(f"Cache hit for: {key}")
+        return json.loads(content.decode("utf-8"))
+
+    def put(self, key: str, payload) -> str:
+        """
+        Store a JSON-serializable payload under a key and evict least
+        recently used entries if the cache grew over its size cap.
+        :param key: cache key
+        :param payload: JSON-serializable object
+        :return: sha256 digest of the stored payload
+        :rtype: str
+        """
+        content = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest, self.compress)
+        if self.compress:
+            content = gzip.compress(content)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._write_atomic(path, content)
+            now = time()
+            self._index[key] = {"digest": digest,
+                                "size": len(content),
+                                "compressed": self.compress,
+                                "stored": now,
+                                "accessed": now}
+            self._evict()
+            self._unsaved += 1
+            if self._unsaved >= self.FLUSH_EVERY:
+                self.flush()
+        return digest
+
+    def _evict(self):
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._index,
+                          key=lambda k: self._index[k]["accessed"]):
+            if total <= self.max_bytes:
+                break
+            entry = self._index.pop(key)
+            self._evicted[key] = time()
+            # the payload may still be referenced by another key
+            if any((e["digest"], e["compressed"]) ==
+                   (entry["digest"], entry["compressed"])
+                   for e in self._index.values()):
+                continue
+            total -= entry["size"]
+            try:
+                os.remove(self._blob_path(entry["digest"],
+                                          entry["compressed"]))
+            except OSError:
+                pass
+            logger.debug(f"Evicted cache entry: {key}")
+
+
+def default_cache():
+    """
+    Return the shared cache for the directory set in config.py or
+    None if caching is disabled there.
+    :return: ResponseCache instance or None
+    """
+    if not CACHE["ENABLED"]:
+        return None
+    path = CACHE["NBA_CACHE_DIR"]
+    if path not in _caches:
+        _caches[path] = ResponseCache(path=path,
+                                      max_bytes=CACHE["MAX_BYTES"],
+                                      compress=CACHE["COMPRESS"])
+        atexit.register(_caches[path].flush)
+    return _caches[path]
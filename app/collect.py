@@ -4,10 +4,23 @@ using nba-api by Swar Patel (swar): https://github.com/swar/nba_api
 Auhtor: Maciej Cisowski
 """
 import logging.config
-from config import LOGGING, TIMEOUT_INTERVAL, TIMEOUT_SECS, request_header
-from pandas import date_range
+from config import LOGGING, TIMEOUT_INTERVAL, TIMEOUT_SECS, request_header, \
+    FETCH_WORKERS, FETCH_MAX_RPS, STATS, THROTTLE, SCHEDULE
+from app.common import RateLimiter
+from app.throttle import AdaptiveThrottle, adaptive_limiter, failure_kind
+from app.cache import ResponseCache, default_cache
+from app.schedule import SeasonCalendar, default_calendar
+from app.boxscore import BoxScoreFanOut, boxscore_items
+from app.source import cached_scoreboard_json, request_scoreboard, \
+    endpoint_response, MERGE_ITEMS
+from app.engine import item_source
+from pandas import date_range, DataFrame
 from time import sleep
 from datetime import date, timedelta
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from nba_api.stats.endpoints import scoreboardv2
 
 
@@ -15,11 +28,317 @@ from nba_api.stats.endpoints import scoreboardv2
 logging.config.dictConfig(LOGGING)
 logger = logging.getLogger("nba_v2.collect")
 
+# headers of each result set, for days without a response
+HEADERS = scoreboardv2.ScoreboardV2.expected_data
+
+
+def request_endpoint(day: str) -> dict:
+    """
+    Send a single ScoreboardV2 request through the nba-api endpoint.
+    The endpoint cannot be pointed elsewhere, so when NBA_STATS_URL is
+    set in config.py the request is sent by request_scoreboard(). Error
+    statuses raise a ResponseError.
+    :param day: date string formatted as "%Y/%m/%d"
+    :return: raw endpoint response
+    :rtype: dict
+    """
+    if STATS["NBA_STATS_URL"]:
+        return request_scoreboard(day)
+    logger.debug(f"Getting scoreboard data for date: {day}")
+    endpoint = scoreboardv2.ScoreboardV2(
+        game_date=day, headers=request_header,
+        timeout=THROTTLE["REQUEST_TIMEOUT_SECS"], get_request=False)
+    return endpoint_response(endpoint)
+
+
+def fetch_scoreboard_json(day: str, cache: ResponseCache = None,
+                          throttle=None,
+                          adaptive: AdaptiveThrottle = None,
+                          calendar: SeasonCalendar = None) -> dict:
+    """
+    Get the raw Scoreboard JSON for a single day, from the response
+    cache if it holds a fresh copy or from NBA.com otherwise.
+    :param day: date string formatted as "%Y/%m/%d"
+    :param cache: ResponseCache to consult and fill, None skips caching
+    :param throttle: optional callable invoked right before a request
+    is actually sent to NBA.com
+    :param adaptive: AdaptiveThrottle pacing and retrying the request,
+    used instead of <throttle>
+    :param calendar: SeasonCalendar to record the games of a response
+    fetched from NBA.com in
+    :return: raw endpoint response
+    :rtype: dict
+    """
+    return cached_scoreboard_json(day, cache, throttle, request_endpoint,
+                                  adaptive, calendar)
+
+
+class ScoreboardDay(MutableMapping):
+    """
+    Dict-like holder of the Scoreboard items for a single day. It keeps
+    the raw result sets of the response and only builds the pandas
+    DataFrame of an item the first time it is looked up, dropping the
+    raw rows afterwards. Items added later on, e.g. mergedLineScore,
+    are stored as they are. Iterating over it does not build anything.
+    A day whose request failed for good holds empty items and has
+    <failed> set, see empty_day().
+    """
+
+    def __init__(self, result_sets: list, failed: bool = False):
+        self._raw = {r["name"]: r for r in result_sets}
+        self._frames = {}
+        self.failed = failed
+
+    def __getitem__(self, item: str) -> DataFrame:
+        if item not in self._frames:
+            raw = self._raw.pop(item)
+            self._frames[item] = DataFrame(raw["rowSet"],
+                                           columns=raw["headers"])
+        return self._frames[item]
+
+    def __setitem__(self, item: str, value):
+        self._raw.pop(item, None)
+        self._frames[item] = value
+
+    def __delitem__(self, item: str):
+        if item in self._frames:
+            del self._frames[item]
+        else:
+            del self._raw[item]
+
+    def __contains__(self, item) -> bool:
+        return item in self._frames or item in self._raw
+
+    def __iter__(self):
+        return iter(list(self._frames) + list(self._raw))
+
+    def __len__(self) -> int:
+        return len(self._frames) + len(self._raw)
+
+    def materialized(self) -> list:
+        """
+        :return: names of the items already built as DataFrames
+        :rtype: list
+        """
+        return list(self._frames)
+
+
+def batch_items(batch_def: list) -> set:
+    """
+    Names of the Scoreboard items a batch definition needs, including
+    the ones needed to tell empty days apart and to merge line scores.
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :return: set of item names
+    :rtype: set
+    """
+    return {item_source(entry) for entry in batch_def} | set(MERGE_ITEMS)
+
+
+def scoreboard_frames(raw: dict, items: set = None) -> ScoreboardDay:
+    """
+    Pack the result sets of a raw Scoreboard response into a lazy
+    dict-like ScoreboardDay of {itemName: pandas DataFrame}.
+    :param raw: raw endpoint response
+    :param items: names of the items to keep, None keeps all of them
+    :return: Scoreboard items
+    :rtype: ScoreboardDay
+    """
+    result_sets = raw["resultSets"]
+    if items is not None:
+        result_sets = [r for r in result_sets if r["name"] in items]
+    return ScoreboardDay(result_sets)
+
+
+def empty_day(items: set = None, failed: bool = False) -> ScoreboardDay:
+    """
+    Scoreboard items without any rows, e.g. for a day whose request
+    failed for good.
+    :param items: names of the items to keep, None keeps all of them
+    :param failed: mark the day as failed, so that its uploads are
+    recorded as failed
+    :return: Scoreboard items with the headers of ScoreboardV2
+    :rtype: ScoreboardDay
+    """
+    result_sets = [{"name": name, "headers": headers, "rowSet": []}
+                   for name, headers in HEADERS.items()
+                   if items is None or name in items]
+    return ScoreboardDay(result_sets, failed=failed)
+
+
+def fetch_scoreboard_day(day: str, cache: ResponseCache = None,
+                         throttle=None, items: set = None,
+                         adaptive: AdaptiveThrottle = None,
+                         calendar: SeasonCalendar = None,
+                         boxscores: BoxScoreFanOut = None) -> ScoreboardDay:
+    """
+    Get the Scoreboard items for a single day and pack them into a
+    dict-like ScoreboardDay of {itemName: pandas DataFrame}.
+    :param day: date string formatted as "%Y/%m/%d"
+    :param cache: ResponseCache to consult and fill, None skips caching
+    :param throttle: optional callable invoked before a network request
+    :param items: names of the items to keep, None keeps all of them
+    :param adaptive: AdaptiveThrottle pacing and retrying the request,
+    used instead of <throttle>
+    :param calendar: SeasonCalendar to record the games of a response
+    fetched from NBA.com in
+    :param boxscores: BoxScoreFanOut adding the box scores of the day's
+    games to its items
+    :return: Scoreboard items for that day
+    :rtype: ScoreboardDay
+    """
+    day_items = scoreboard_frames(
+        fetch_scoreboard_json(day, cache, throttle, adaptive, calendar),
+        items)
+    if boxscores is not None:
+        boxscores.attach(day, day_items)
+    return day_items
+
+
+def iter_scoreboard_data(start_date: date = date.today() - timedelta(days=1),
+                         end_date: date = date.today() - timedelta(days=1),
+                         timeout_days: int = TIMEOUT_INTERVAL,
+                         timeout_secs: int = TIMEOUT_SECS,
+                         workers: int = FETCH_WORKERS,
+                         max_rps: float = FETCH_MAX_RPS,
+                         cache: ResponseCache = None,
+                         days: list = None,
+                         items: set = None,
+                         adaptive: bool = THROTTLE["ADAPTIVE"],
+                         calendar: SeasonCalendar = None,
+                         skip_empty: bool = SCHEDULE["SKIP_EMPTY"],
+                         known_games: set = None):
+    """
+    Generator version of fetch_scoreboard_data(). Yields (date, items)
+    tuples in date order as soon as each day is available, so callers
+    can process and drop a day before the rest of the range is fetched.
+    With more than one worker at most 2 * <workers> days are requested
+    ahead of the consumer, which keeps memory bounded regardless of the
+    length of the range.
+
+    :param start_date: datetime.date object representing start date,
+    defaults to yesterday
+    :param end_date: datetime.date object representing end date,
+    defaults to yesterday
+    :param timeout_days: number of days in a request interval
+    :param timeout_secs: int for number of seconds to wait between
+    request intervals
+    :param workers: number of requests kept in flight at once
+    :param max_rps: ceiling for requests started per second
+    :param cache: ResponseCache to use, defaults to the one set up in
+    config.py
+    :param days: explicit list of "%Y/%m/%d" date strings to fetch
+    instead of the start to end date range
+    :param items: names of the Scoreboard items to keep, e.g. from
+    batch_items(), None keeps all of them
+    :param adaptive: pace requests with an AdaptiveThrottle and retry
+    failed ones instead of the fixed sleeps and rate
+    :param calendar: SeasonCalendar to use, defaults to the one set up
+    in config.py
+    :param skip_empty: do not request dates the calendar knows to have
+    no games, they are yielded with empty items; False scans the whole
+    range
+    :param known_games: GAME_IDs whose box scores are already stored,
+    e.g. from committed_games(), see BoxScoreFanOut
+    :return: generator of (date string, ScoreboardDay) tuples
+    """
+    if days is None:
+        d_range = date_range(start=start_date, end=end_date).to_pydatetime()
+        days = [d.strftime("%Y/%m/%d") for d in d_range]
+    if cache is None:
+        cache = default_cache()
+    if calendar is None:
+        calendar = default_calendar()
+    skipped = set()
+    if skip_empty and calendar is not None:
+        skipped = set(days) - set(calendar.days_to_fetch(days))
+    logger.info(f"Looping through {len(days)} dates for scoreboard data")
+
+    if adaptive:
+        throttle = AdaptiveThrottle(adaptive_limiter(max_rps))
+        logger.info(f"Fetching with {workers} workers, adapting the rate "
+                    f"from {throttle.limiter.rate} up to {max_rps} "
+                    f"requests per second")
+        fetch_args = {"adaptive": throttle}
+    elif workers > 1:
+        logger.info(f"Fetching with {workers} workers capped at {max_rps} "
+                    f"requests per second")
+        fetch_args = {"throttle": RateLimiter(max_rps).wait}
+    else:
+        requests_sent = [0]
+
+        def sleep_on_interval():
+            # sleep for <timeout_secs> upon hitting the <timeout_days> count
+            requests_sent[0] += 1
+            if requests_sent[0] % timeout_days == 0:
+                logger.debug(f"Sleeping for: {timeout_secs} secs")
+                sleep(timeout_secs)
+                logger.debug("Resuming execution")
+
+        fetch_args = {"throttle": sleep_on_interval}
+
+    boxscores = None
+    if boxscore_items(items):
+        # box score requests share the cache and the throttle
+        boxscores = BoxScoreFanOut(boxscore_items(items), cache=cache,
+                                   known_games=known_games, **fetch_args)
+    fetch_day = partial(fetch_scoreboard_day, cache=cache, items=items,
+                        calendar=calendar, boxscores=boxscores, **fetch_args)
+
+    def fetch(day):
+        if day in skipped:
+            return empty_day(items)
+        # a day failing for good is recorded, the rest of the range goes on
+        try:
+            return fetch_day(day)
+        except Exception as error:
+            if failure_kind(error) is None:
+                raise
+            logger.error(f"Giving up on scoreboard data for {day}: {error}")
+            return empty_day(items, failed=True)
+
+    try:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for day in days:
+                    pending.append((day, pool.submit(fetch, day)))
+                    # keep a bounded window of requests ahead of the consumer
+                    if len(pending) >= 2 * workers:
+                        ready_day, future = pending.popleft()
+                        yield ready_day, future.result()
+                while pending:
+                    ready_day, future = pending.popleft()
+                    yield ready_day, future.result()
+        else:
+            for day in days:
+                yield day, fetch(day)
+        if adaptive and throttle.retries:
+            logger.info(f"Retried {throttle.retries} requests, the circuit "
+                        f"breaker tripped {throttle.breaker.trips} times")
+    finally:
+        if boxscores is not None:
+            boxscores.close()
+        # keep what was fetched so far even if the run is aborted
+        if cache is not None:
+            cache.flush()
+        if calendar is not None:
+            calendar.save()
+
 
 def fetch_scoreboard_data(start_date: date = date.today() - timedelta(days=1),
                           end_date: date = date.today() - timedelta(days=1),
                           timeout_days: int = TIMEOUT_INTERVAL,
-                          timeout_secs: int = TIMEOUT_SECS) -> dict:
+                          timeout_secs: int = TIMEOUT_SECS,
+                          workers: int = FETCH_WORKERS,
+                          max_rps: float = FETCH_MAX_RPS,
+                          cache: ResponseCache = None,
+                          days: list = None,
+                          items: set = None,
+                          adaptive: bool = THROTTLE["ADAPTIVE"],
+                          calendar: SeasonCalendar = None,
+                          skip_empty: bool = SCHEDULE["SKIP_EMPTY"],
+                          known_games: set = None) -> dict:
     """
     Uses nba-api Scoreboard endpoint to retrieve a dict of all
     Scoreboard items as pandas Data Frames. Scoreboard items are:
@@ -35,9 +354,31 @@ def fetch_scoreboard_data(start_date: date = date.today() - timedelta(days=1),
             ...
         }
     }
-    It breaks up the requests into batches of <timeout_days> and
-    waits <timeout_secs> between the batches to avoid throttling
-    on the server end. This defaults to config values.
+    With more than one worker the days are requested concurrently by a
+    pool of <workers> threads. By default (<adaptive>, see THROTTLE in
+    config.py) requests are paced by an AdaptiveThrottle shared by all
+    workers: the rate starts at START_FACTOR * <max_rps>, backs off on
+    slow answers, 429s, 5xx errors and timeouts and grows while answers
+    are quick, up to <max_rps>.
+    Failed days are retried with backoff in place, so the rest of the
+    range is not fetched again, and a circuit breaker pauses all
+    workers when requests keep failing. A day that still fails is
+    logged and output with empty items marked as failed (see
+    empty_day()), which the uploads record as failed. Without
+    <adaptive>, a single worker breaks up the requests into batches of
+    <timeout_days> and waits <timeout_secs> between the batches, and
+    more workers are capped at <max_rps> requests per second across
+    the pool.
+    Either way the output is keyed in date order.
+    Days found in the response cache are not requested and do not
+    count towards any throttle, and with <skip_empty> neither are days
+    the season calendar knows to have no games, which are still output
+    with empty items (see empty_day()), as every requested day is.
+    Each day's items are built into DataFrames only once they are
+    looked up, and passing <items> drops the other ones right away.
+    If <items> name box score items (see BOXSCORE in config.py), the
+    games of every day are fanned out to the box score endpoint, except
+    for <known_games> of finished days, see BoxScoreFanOut.
 
     :param timeout_secs: int for number of seconds to wait between
     request intervals
@@ -46,28 +387,41 @@ def fetch_scoreboard_data(start_date: date = date.today() - timedelta(days=1),
     defaults to yesterday
     :param end_date: datetime.date object representing end date,
     defaults to yesterday
+    :param workers: number of requests kept in flight at once
+    :param max_rps: ceiling for requests started per second
+    :param cache: ResponseCache to use, defaults to the one set up in
+    config.py
+    :param days: explicit list of "%Y/%m/%d" date strings to fetch
+    instead of the start to end date range
+    :param items: names of the Scoreboard items to keep, e.g. from
+    batch_items(), None keeps all of them
+    :param adaptive: pace requests with an AdaptiveThrottle and retry
+    failed ones instead of the fixed sleeps and rate
+    :param calendar: SeasonCalendar to use, defaults to the one set up
+    in config.py
+    :param skip_empty: do not request dates the calendar knows to have
+    no games; False scans the whole range
+    :param known_games: GAME_IDs whose box scores are already stored,
+    e.g. from committed_games(), see BoxScoreFanOut
     :return: period_out dict of daily dicts with DataFrame objects
     :rtype: dict
     """
     period_out = {}
-    logger.info("Looping through dates for scoreboard data")
-    d_range = date_range(start=start_date, end=end_date).to_pydatetime()
-    for d in d_range:
-        # sleep for <timeout_secs> upon hitting the <timeout_days> count
-        if (d_range.tolist().index(d) + 1) % timeout_days == 0:
-            logger.debug(f"Sleeping for: {timeout_secs} secs")
-            sleep(timeout_secs)
-            logger.debug("Resuming execution")
-
-        day = d.strftime("%Y/%m/%d")
-        logger.debug(f"Getting scoreboard data for date: {day}")
-        endpoint = scoreboardv2.ScoreboardV2(game_date=day,
-                                             headers=request_header,
-                                             timeout=300)
-        headers = endpoint.get_available_data()
-        frames = endpoint.get_data_frames()
-        logger.debug(f"Packing output for {d} into dict")
-        period_out[day] = {k: v for k, v in zip(headers, frames)}
+    for day, items in iter_scoreboard_data(start_date=start_date,
+                                           end_date=end_date,
+                                           timeout_days=timeout_days,
+                                           timeout_secs=timeout_secs,
+                                           workers=workers,
+                                           max_rps=max_rps,
+                                           cache=cache,
+                                           days=days,
+                                           items=items,
+                                           adaptive=adaptive,
+                                           calendar=calendar,
+                                           skip_empty=skip_empty,
+                                           known_games=known_games):
+        logger.debug(f"Packing output for {day} into dict")
+        period_out[day] = items
     logger.info(f"Found {len(period_out)} items after looping through"
                 f" scoreboard data.")
     return period_out
@@ -2,31 +2,99 @@
 Database connection setup for the NBA_v2 app.
 Author: Maciej Cisowski
 """
-from pandas import DataFrame
-from config import DB, LOGGING, DbActions
+from config import DB, LOGGING, DbActions, BULK, ENGINE, BOXSCORE
 from models.monitor import Monitor, metadata
-from datetime import datetime
-from sqlalchemy import create_engine
+from models.scoreboard import declared_table
+from app import metrics
+from app.engine import copy_insert, insert_records, existing_keys, \
+    latest_snapshots, batch_targets, item_source, key_of, write_action
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import TYPE_CHECKING
+import atexit
+from sqlalchemy import create_engine, select, and_, table, column
 from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from sqlalchemy.exc import SQLAlchemyError
+from time import perf_counter
 import logging.config
 
+# pandas is only imported where DataFrames are concatenated, so that
+# nba_lite.py can share the engines, offsets and monitor records of
+# this module without it
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
 
 # create logger for this module and configure it
 logging.config.dictConfig(LOGGING)
 logger = logging.getLogger("nba_v2.commit")
 
 
-def start_engine(url: str = DB["NBA_DB_URL"]) -> Engine:
+# engine registry, one pooled engine per url and echo setting
+_engines = {}
+_engines_lock = Lock()
+
+
+def engine_options(url: str, echo: bool) -> dict:
+    """
+    Keyword arguments for create_engine() based on the ENGINE config.
+    In-memory SQLite gets a single shared connection, so that every
+    thread sees the same db; file based SQLite keeps SQLAlchemy's
+    defaults and everything else gets a sized, pre-pinged pool.
+    :param url: db url
+    :param echo: whether to log all SQL statements
+    :return: dict of create_engine() options
+    :rtype: dict
+    """
+    options = {"echo": echo}
+    parsed = make_url(url)
+    if parsed.drivername.startswith("sqlite"):
+        if parsed.database in (None, "", ":memory:"):
+            options["poolclass"] = StaticPool
+            options["connect_args"] = {"check_same_thread": False}
+        return options
+    options.update({"pool_size": ENGINE["POOL_SIZE"],
+                    "max_overflow": ENGINE["MAX_OVERFLOW"],
+                    "pool_pre_ping": ENGINE["POOL_PRE_PING"],
+                    "pool_recycle": ENGINE["POOL_RECYCLE"]})
+    return options
+
+
+def start_engine(url: str = DB["NBA_DB_URL"],
+                 echo: bool = ENGINE["ECHO"]) -> Engine:
     """
-    Creates an SQLAlchemy engine using the given url.
+    Returns the SQLAlchemy engine for the given url, creating it on
+    first use. Engines are kept in a registry for the lifetime of the
+    process, so every caller shares one connection pool per url.
     :param url: like sqlite:// or postgres://<yourURL>, defaults to
     the NBA_DB_URL value in config.py
+    :param echo: whether to log all SQL statements, off by default
     :return: SQLAlchemy Engine instance
     """
-    logger.info(f"Establishing db engine for: {url}")
-    return create_engine(url, echo=True)
+    with _engines_lock:
+        if (url, echo) not in _engines:
+            logger.info(f"Establishing db engine for: {url}")
+            _engines[(url, echo)] = create_engine(
+                url, **engine_options(url, echo))
+        return _engines[(url, echo)]
+
+
+def dispose_engines():
+    """
+    Close the connection pools of all registered engines and empty the
+    registry. Registered to run at interpreter exit.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+    logger.debug("Disposed of all db engines.")
+
+
+atexit.register(dispose_engines)
 
 
 def get_db_table_offset(db_engine: Engine, table: str) -> int:
@@ -64,121 +132,708 @@ def post_monitor_data(db: Engine, data: Monitor) -> bool:
         metadata.create_all(bind=db,
                             tables=[data.__table__],
                             checkfirst=True)
-    except OperationalError or SQLAlchemyError:
+    except SQLAlchemyError:
         logger.error("Could not create db table for monitor stats.")
         return False
     # create session for issuing commands to the db
     Session = sessionmaker(bind=db, expire_on_commit=True)
     session = Session()
     success = False
+    t1 = perf_counter()
     try:
         logger.info('Attempting to add and commit monitor stats...')
         session.add(data)
         session.commit()
         success = True
-    except OperationalError or SQLAlchemyError:
+    except SQLAlchemyError:
         logger.error("Errored out while trying to commit monitor stats.")
         return False
     finally:
         session.close()
+        metrics.record("monitor", perf_counter() - t1,
+                       rows=1 if success else 0)
     return success
 
 
+def insert_method(db: Engine, method=None):
+    """
+    Pick the to_sql insertion method for an engine: COPY for
+    PostgreSQL (unless disabled in config.py), the requested method
+    for anything else.
+    :param db: SQLAlchemy engine the data will be written with
+    :param method: requested to_sql method, None or "multi"
+    :return: to_sql method argument
+    """
+    if db.dialect.name == "postgresql" and BULK["POSTGRES_COPY"] \
+            and method in (None, "multi"):
+        return copy_insert
+    return method
+
+
+def multi_row_chunksize(db: Engine, data: "DataFrame",
+                        chunksize: int) -> int:
+    """
+    Cap the number of rows per multi-row INSERT so that a single
+    statement stays under SQLite's limit of bound parameters.
+    :param db: SQLAlchemy engine the data will be written with
+    :param data: DataFrame to be written, index included
+    :param chunksize: requested number of rows per statement
+    :return: number of rows per statement
+    :rtype: int
+    """
+    if db.dialect.name == "sqlite":
+        columns = len(data.columns) + 1
+        return max(1, min(chunksize, BULK["SQLITE_MAX_VARIABLES"] // columns))
+    return chunksize
+
+
+def get_monitor_history(db: Engine, start_date: date, end_date: date,
+                        items: set = None) -> dict:
+    """
+    Read the monitor table for a date range and group the recorded
+    items by date and outcome.
+    :param db: SQLAlchemy Engine of the monitor db
+    :param start_date: first date of the range
+    :param end_date: last date of the range, inclusive
+    :param items: only read the records of these item names, all of
+    them if not given
+    :return: dict of {"%Y/%m/%d": {"success": set, "failed": set}}
+    :rtype: dict
+    """
+    history = {}
+    if not db.has_table(Monitor.__tablename__):
+        logger.info("No monitor table found, nothing was committed yet.")
+        return history
+    condition = and_(Monitor.date >= start_date, Monitor.date <= end_date)
+    if items is not None:
+        condition = and_(condition, Monitor.item.in_(sorted(items)))
+    query = select([Monitor.date, Monitor.item, Monitor.success]).where(
+        condition)
+    for row_date, item, success in db.execute(query):
+        day = history.setdefault(row_date.strftime("%Y/%m/%d"),
+                                 {"success": set(), "failed": set()})
+        day["success" if success else "failed"].add(item)
+    return history
+
+
+def plan_incremental(db: Engine, start_date: date, end_date: date,
+                     batch_def: list = None) -> tuple:
+    """
+    Use the monitor table as a high-water mark for a date range. A date
+    needs fetching when nothing was committed for it yet, or when one
+    of its items failed and has not succeeded since. With a batch
+    definition, a date needs fetching unless every entry of the batch
+    was committed for it, so that switching to a batch with more items
+    fills them in for dates loaded by another batch. Dates with no
+    games never get a monitor record, so they are always fetched again
+    (which is cheap, given the response cache).
+    :param db: SQLAlchemy Engine of the monitor db
+    :param start_date: first date of the range
+    :param end_date: last date of the range, inclusive
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :return: tuple of a list of "%Y/%m/%d" dates to fetch and a dict of
+    {date: set of item names} already committed for those dates
+    :rtype: tuple
+    """
+    names = {entry["name"] for entry in batch_def} \
+        if batch_def is not None else None
+    history = get_monitor_history(db, start_date, end_date, names)
+    days, committed = [], {}
+    day = start_date
+    while day <= end_date:
+        key = day.strftime("%Y/%m/%d")
+        record = history.get(key)
+        if names is not None:
+            missing = record is None or not names <= record["success"]
+        else:
+            missing = record is None or not record["success"] or \
+                record["failed"] - record["success"]
+        if missing:
+            days.append(key)
+            if record is not None:
+                committed[key] = set(record["success"])
+        day += timedelta(days=1)
+    logger.info(f"Incremental run: {len(days)} of "
+                f"{(end_date - start_date).days + 1} dates need fetching.")
+    return days, committed
+
+
+def committed_games(db: Engine, batch_def: list) -> set:
+    """
+    GAME_IDs whose box scores are already in every box score table of a
+    batch (see BOXSCORE in config.py), so that later runs do not
+    request them again, see BoxScoreFanOut.
+    :param db: SQLAlchemy Engine of the data db
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :return: set of GAME_IDs, empty if the batch has no box score items
+    or one of their tables is missing
+    :rtype: set
+    """
+    games = None
+    for entry in batch_def:
+        if item_source(entry) not in BOXSCORE["ITEMS"]:
+            continue
+        with db.connect() as connection:
+            if not db.dialect.has_table(connection, entry["table"]):
+                return set()
+            stored = table(entry["table"], column("GAME_ID"))
+            found = {row[0] for row in connection.execute(
+                select([stored.c.GAME_ID]).distinct())}
+        games = found if games is None else games & found
+    logger.debug(f"Found {len(games or ())} games with committed box scores.")
+    return games or set()
+
+
+def _insert_monitor_rows(db: Engine, rows: list) -> int:
+    # all rows go in one executemany within one transaction; when that
+    # fails, the slice is split in halves and each half retried, so only
+    # the failing rows end up being dropped
+    try:
+        with db.begin() as connection:
+            connection.execute(Monitor.__table__.insert(), rows)
+        return len(rows)
+    except SQLAlchemyError:
+        if len(rows) == 1:
+            logger.error(f"Could not commit monitor stats: {rows[0]}")
+            return 0
+        logger.warning(f"Retrying failed slice of {len(rows)} monitor rows.")
+        middle = len(rows) // 2
+        return _insert_monitor_rows(db, rows[:middle]) + \
+            _insert_monitor_rows(db, rows[middle:])
+
+
+def post_monitor_batch(db: Engine, data: list) -> int:
+    """
+    Posts a whole list of monitoring data, e.g. the output of
+    batch_upload(), to a monitor db. The table is checked for once and
+    all rows are inserted in a single bulk statement and transaction.
+    If that fails, only the failing slice is retried, by halves, down to
+    single rows.
+    :param db: SQLAlchemy Engine for the connection
+    :param data: list of Monitor instances
+    :return: number of records committed
+    :rtype: int
+    """
+    if not data:
+        return 0
+    try:
+        metadata.create_all(bind=db,
+                            tables=[Monitor.__table__],
+                            checkfirst=True)
+    except SQLAlchemyError:
+        logger.error("Could not create db table for monitor stats.")
+        return 0
+    columns = [c.name for c in Monitor.__table__.columns if c.name != "id"]
+    rows = [{c: getattr(m, c) for c in columns} for m in data]
+    logger.info(f"Attempting to commit {len(rows)} monitor stats...")
+    t1 = perf_counter()
+    committed = _insert_monitor_rows(db, rows)
+    metrics.record("monitor", perf_counter() - t1, rows=committed)
+    logger.info(f"Committed {committed} out of {len(rows)} monitor stats.")
+    return committed
+
+
 def post_data(db: Engine,
-              data: DataFrame,
+              data: "DataFrame",
               table: str,
-              if_exists=DbActions) -> dict:
+              if_exists=DbActions,
+              chunksize: int = None,
+              method: str = None) -> dict:
     """
     Attempts to post data to a SQL database using an SQLAlchemy
-    engine. Returns a dict pair of {table: DataFrame size} that
-    was processed.
+    engine. Returns a dict pair of {table: rows written} that
+    was processed. Tables declared in models/scoreboard.py are written
+    with their declared schema, without the DataFrame index, by
+    insert_records(); any other table is left to pandas' to_sql().
     :param db: SQLAlchemy engine to call
     :param data: single pandas DataFrame to be posted
     :param table: the table name to use
     :param if_exists one of the DB_ACTIONS enum values for modifying
     how an existing db table should be treated
-    :return: a dict pair of {table: DataFrame size}
+    :param chunksize: number of rows written per batch, None writes
+    all rows at once
+    :param method: pandas to_sql insertion method, "multi" passes
+    multiple rows in a single INSERT statement; on PostgreSQL rows are
+    sent with COPY instead
+    :return: a dict pair of {table: rows written}, as reported by the
+    insert where available and the DataFrame size otherwise
     :rtype: dict
     """
     logger.info(f"Posting data to table: {table}.")
+    declared = declared_table(table)
+    if declared is not None:
+        records = data.astype(object).where(data.notna(), None)\
+            .to_dict("records")
+        try:
+            return {table: insert_records(db, declared, records, if_exists)}
+        except (SQLAlchemyError, ValueError) as error:
+            logger.warning(f"Error while posting data to table: {table}: "
+                           f"{error}")
+            return {table: 0}
+    if if_exists in (DbActions.UPSERT, DbActions.DELTA):
+        raise ValueError(f"{if_exists.value} needs a declared table, "
+                         f"{table} is not in models/scoreboard.py.")
+    method = insert_method(db, method)
+    if method == "multi" and chunksize:
+        chunksize = multi_row_chunksize(db, data, chunksize)
     try:
-        data.to_sql(name=table, con=db, schema=None, if_exists=if_exists.value,
-                    index=True)
-    except OperationalError or SQLAlchemyError:
+        affected = data.to_sql(name=table, con=db, schema=None,
+                               if_exists=if_exists.value, index=True,
+                               chunksize=chunksize, method=method)
+    except SQLAlchemyError:
         logger.warning(f"Error while posting data to table: {table}")
         return {table: 0}
+    # pandas >= 1.4 reports the rows affected by the insert, older
+    # versions (and drivers without a rowcount) only tell us it worked
+    if isinstance(affected, int) and affected >= 0:
+        return {table: affected}
     return {table: len(data.index)}
 
 
-def batch_upload(data: dict, db: Engine, batch_def: list) -> list:
+class OffsetTracker(object):
+    """
+    Keeps track of table offsets (row counts) for the length of a run.
+    Each table is queried with COUNT(*) at most once; afterwards its
+    offset is moved by the number of rows the writes report as
+    affected. This assumes no other writer touches the tracked tables
+    during the run. A table whose write failed is forgotten, so that
+    its next offset is read from the db again.
+    """
+
+    def __init__(self, db: Engine):
+        self.db = db
+        self._offsets = {}
+        self._lock = Lock()
+
+    def get(self, table: str) -> int:
+        """
+        :param table: name of the table
+        :return: current offset of the table
+        :rtype: int
+        """
+        with self._lock:
+            if table not in self._offsets:
+                self._offsets[table] = get_db_table_offset(self.db, table)
+            return self._offsets[table]
+
+    def advance(self, table: str, rows: int) -> int:
+        """
+        Move the offset of a table after rows were appended to it.
+        :param table: name of the table
+        :param rows: number of rows appended
+        :return: the new offset
+        :rtype: int
+        """
+        with self._lock:
+            self._offsets[table] = self._offsets.get(table, 0) + rows
+            return self._offsets[table]
+
+    def reset(self, table: str, rows: int) -> int:
+        """
+        Set the offset of a table after it was replaced.
+        :param table: name of the table
+        :param rows: number of rows the table now holds
+        :return: the new offset
+        :rtype: int
+        """
+        with self._lock:
+            self._offsets[table] = rows
+            return rows
+
+    def forget(self, table: str):
+        with self._lock:
+            self._offsets.pop(table, None)
+
+
+def failed_day_monitors(date_object: date, batch_def: list,
+                        tracker: OffsetTracker) -> list:
+    """
+    Monitor records of a day whose Scoreboard request failed for good,
+    see empty_day() in app/collect.py. Every entry of the batch is
+    recorded as failed, so that incremental and backfill runs fetch the
+    day again.
+    :param date_object: the failed date
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param tracker: OffsetTracker of the run
+    :return: list of Monitor SQLAlchemy objects
+    :rtype: list
+    """
+    logger.warning(f"No scoreboard data for {date_object}, recording "
+                   f"{len(batch_def)} failed items.")
+    return [Monitor(date=date_object, item=str(entry["name"]),
+                    pre_offset=int(tracker.get(entry["table"])),
+                    post_offset=int(tracker.get(entry["table"])),
+                    size=0, success=False)
+            for entry in batch_def]
+
+
+def _write_frame(db: Engine, frame: "DataFrame", table: str,
+                 action: DbActions) -> dict:
+    return post_data(db=db, data=frame, table=table, if_exists=action)
+
+
+def batch_upload(data: dict, db: Engine, batch_def: list,
+                 tracker: OffsetTracker = None, sink=None) -> list:
     """
     Takes the output of fetch_scoreboard_data() as it's input, along
     with a SQLAlchemy Engine instance and a definition of what items
     are to be uploaded to the db.
     It will get the current offset in the target db, extract the item
     to be uploaded, attempt to upload it to the db and then validate
-    the process with another fetch of the db offset. The result is a
-    dict of the "before" and "after" offsets, indexed by upload item,
-    and a "success" boolean, if the difference between offsets is
-    equal to the size of the uploaded item.
+    the process using the number of rows the write reported as
+    affected. Offsets come from an OffsetTracker, so every table is
+    counted only once per run. The result is a Monitor of the "before"
+    and "after" offsets for each date and upload item, and a "success"
+    boolean, if the number of rows written is equal to the size of the
+    uploaded item. Entries are written with their "keyed_action" where
+    the table allows it, see write_action(). Items written with the
+    DELTA action only have their
+    last date written; the earlier dates are recorded as successful
+    without touching the db, as their snapshots are superseded. An item
+    read by several entries (see "source" in config.py) is written to
+    each of their tables, with a Monitor per entry name. A day whose
+    request failed for good gets a failed Monitor per entry. The write
+    loop is shared with lite_upload(), see upload_days().
 
     :param batch_def: a dict picking the items from Scoreboard that
     need to be uploaded
     :param data: Scoreboard data from fetch_scoreboard_data(),
     indexed by date, dict
     :param db: SQLAlchemy instance of Engine
+    :param tracker: OffsetTracker shared across calls within a run,
+    a new one is made if not given
+    :param sink: extra output every date and item is also written to,
+    e.g. a ParquetSink; it does not affect the Monitor records
     :return: list of Monitor SQLAlchemy objects
     :rtype: list
     """
 
-    # reverse mapping for ease of access
-    named = {i["name"]: i for i in batch_def}
-    # output
-    batch_upload_results = []
+    return upload_days(data=data, db=db, batch_def=batch_def,
+                       writer=_write_frame,
+                       size=lambda frame: len(frame.index), tracker=tracker,
+                       sink=sink)
+
+
+def upload_days(data: dict, db: Engine, batch_def: list, writer, size,
+                tracker: OffsetTracker = None, sink=None,
+                actions: dict = None, latest: dict = None) -> list:
+    """
+    The write loop shared by batch_upload() and lite_upload() in
+    app/lite.py: every entry of the batch is written for every date
+    with <writer> and recorded in a Monitor, see batch_upload().
+    :param data: Scoreboard items indexed by date, e.g. DataFrames or
+    RowSets; a day with <failed> set gets a failed Monitor per entry
+    :param db: SQLAlchemy instance of Engine
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param writer: callable writing the rows of an item, called with
+    the db, the rows, the table and the action, e.g. post_rows();
+    returns {table: rows written} as post_data() does
+    :param size: callable returning the number of rows of an item
+    :param tracker: OffsetTracker shared across calls within a run,
+    a new one is made if not given
+    :param sink: extra output every date and item is also written to,
+    e.g. a ParquetSink; it does not affect the Monitor records
+    :param actions: dict of {entry name: action} resolved once for a
+    run, see write_action(); resolved here if not given
+    :param latest: dict of {entry name: date} of the DELTA snapshots
+    to write, see latest_snapshots(); found in <data> if not given
+    :return: list of Monitor SQLAlchemy objects
+    :rtype: list
+    """
+    # reverse mapping for ease of access, an item can have many tables
+    targets = batch_targets(batch_def)
+    if actions is None:
+        actions = {entry["name"]: write_action(db, entry)
+                   for entry in batch_def}
+    if latest is None:
+        latest = latest_snapshots(data, batch_def, actions)
+    if tracker is None:
+        tracker = OffsetTracker(db)
+    results = []
 
     for date_item in data:
         # cast the date string into a date object for db compliance
         date_object = datetime.strptime(date_item, "%Y/%m/%d").date()
+        if getattr(data[date_item], "failed", False):
+            results.extend(
+                failed_day_monitors(date_object, batch_def, tracker))
+            continue
 
-        logger.info(f"Batch processing: looping through date items in {date_item}.")
+        logger.info(f"Batch processing: looping through date items in "
+                    f"{date_item}.")
         for item in data[date_item]:
-            logger.info(f"Looping through items...")
-            if item in named and not data[date_item][item].empty:
-                logger.debug(f"Getting item details...")
-                pre_offset = get_db_table_offset(db, named[item]["table"])
+            if item not in targets or data[date_item][item].empty:
+                logger.debug(f"Item: {item} not found in {list(targets)}")
+                continue
+            rows = data[date_item][item]
+            for entry in targets[item]:
+                name = entry["name"]
+                table = entry["table"]
+                pre_offset = tracker.get(table)
                 post_offset = 0
                 success = False
-                size = data[date_item][item].count()[0]
-                action = named[item]["action"]
-                validate = True if action is not DbActions.REPLACE else False
+                rows_size = size(rows)
+                action = actions[name]
+                if sink is not None:
+                    sink.write_frame(date_item, table, rows)
+                if action is DbActions.DELTA and \
+                        latest.get(name) != date_item:
+                    # a later date of this run holds the snapshot to write
+                    logger.debug(f"Skipping superseded {name} snapshot.")
+                    results.append(Monitor(
+                        date=date_object, item=str(name),
+                        pre_offset=int(pre_offset),
+                        post_offset=int(pre_offset),
+                        size=int(rows_size), success=True))
+                    continue
+                t1 = perf_counter()
                 try:
-                    logger.debug(f"Attempting db upload for {item}.")
-                    post_data(db=db,
-                              data=data[date_item][item],
-                              table=named[item]["table"],
-                              if_exists=action)
-                    logger.debug(f"Getting post offset for {item}.")
-                    post_offset = get_db_table_offset(
-                        db, named[item]["table"])
-                    logger.debug("Establishing success.")
-                    success = False if \
-                        validate and not (post_offset - pre_offset == size) \
-                        else True
-                except OperationalError or SQLAlchemyError:
+                    logger.debug(f"Attempting db upload for {name}.")
+                    written = writer(db, rows, table, action)[table]
+                    if action in (DbActions.REPLACE, DbActions.DELTA):
+                        post_offset = tracker.reset(table, written)
+                    else:
+                        # upserts only grow the table by the new rows
+                        post_offset = tracker.advance(
+                            table, getattr(written, "inserted", written))
+                    success = written == rows_size
+                except SQLAlchemyError:
                     logger.error("Errored out while performing batch upload. "
                                  "See logs.")
                     success = False
                 finally:
-                    logger.info("Packing monitor data...")
-                    monitor = Monitor(
+                    if not success:
+                        tracker.forget(table)
+                    metrics.record("write", perf_counter() - t1,
+                                   day=date_object, item=str(name),
+                                   rows=int(rows_size) if success else 0)
+                    results.append(Monitor(
                         date=date_object,
-                        item=str(item),
+                        item=str(name),
                         pre_offset=int(pre_offset),
                         post_offset=int(post_offset),
-                        size=int(size),
+                        size=int(rows_size),
                         success=bool(success)
-                    )
-                    batch_upload_results.append(monitor)
-            else:
-                logger.debug(f"Item: {item} not found in {named}")
-    return batch_upload_results
+                    ))
+    return results
+
+
+def new_rows_per_frame(db: Engine, table: str, frames: list) -> list:
+    """
+    Count the rows of each frame an upsert would add to a declared
+    table rather than update, in order: keys already in the table or
+    in an earlier frame do not count.
+    :param db: SQLAlchemy engine of the db holding the table
+    :param table: name of a table declared in models/scoreboard.py
+    :param frames: list of DataFrames about to be upserted
+    :return: list of row counts, one per frame
+    :rtype: list
+    """
+    declared = declared_table(table)
+    key = [c.name for c in declared.primary_key]
+    keys = [[key_of(declared, r) for r in frame[key].to_dict("records")]
+            for frame in frames]
+    known = existing_keys(db, declared, [k for ks in keys for k in ks]) \
+        if db.has_table(table) else set()
+    growth = []
+    for frame_keys in keys:
+        new = set(frame_keys) - known
+        known |= new
+        growth.append(len(new))
+    return growth
+
+
+def bulk_upload(data: dict, db: Engine, batch_def: list,
+                chunksize: int = BULK["CHUNKSIZE"],
+                tracker: OffsetTracker = None, sink=None) -> list:
+    """
+    Bulk version of batch_upload(). Items with the APPEND or UPSERT
+    action are concatenated across all dates in <data> and written to
+    their table in one chunked, multi-row insert (or upsert) instead of
+    one write per date per item. One Monitor record is still produced
+    per date and item, with offsets derived from the row counts of the
+    single days; for upserts only the rows whose key was not in the
+    table yet move the offset. Items with other actions are handed
+    over to batch_upload() unchanged. Days whose request failed for
+    good are recorded as in batch_upload().
+
+    :param data: Scoreboard data from fetch_scoreboard_data(),
+    indexed by date, dict
+    :param db: SQLAlchemy instance of Engine
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param chunksize: rows per INSERT statement
+    :param tracker: OffsetTracker shared across calls within a run,
+    a new one is made if not given
+    :param sink: extra output every date and item is also written to,
+    e.g. a ParquetSink
+    :return: list of Monitor SQLAlchemy objects, in date order
+    :rtype: list
+    """
+    from pandas import concat
+
+    if tracker is None:
+        tracker = OffsetTracker(db)
+    results = []
+    for date_item in data:
+        if getattr(data[date_item], "failed", False):
+            results.extend(failed_day_monitors(
+                datetime.strptime(date_item, "%Y/%m/%d").date(), batch_def,
+                tracker))
+    for entry in batch_def:
+        item, table, action = item_source(entry), entry["table"], \
+            write_action(db, entry)
+        if action not in (DbActions.APPEND, DbActions.UPSERT):
+            per_date = {d: {item: data[d][item]} for d in data
+                        if item in data[d]}
+            results.extend(batch_upload(data=per_date, db=db,
+                                        batch_def=[entry], tracker=tracker,
+                                        sink=sink))
+            continue
+        frames = [(d, data[d][item]) for d in data
+                  if item in data[d] and not data[d][item].empty]
+        if not frames:
+            logger.debug(f"Nothing to bulk upload for item: {item}")
+            continue
+        total = sum(len(frame.index) for _, frame in frames)
+        logger.info(f"Bulk uploading {total} rows of {item} from "
+                    f"{len(frames)} dates to table: {table}")
+        pre_offset = tracker.get(table)
+        growth = [len(frame.index) for _, frame in frames]
+        success = False
+        t1 = perf_counter()
+        try:
+            if action is DbActions.UPSERT:
+                growth = new_rows_per_frame(db, table,
+                                            [f for _, f in frames])
+            written = post_data(db=db,
+                                data=concat([f for _, f in frames]),
+                                table=table,
+                                if_exists=action,
+                                chunksize=chunksize,
+                                method="multi")[table]
+            success = written == total
+        except SQLAlchemyError:
+            logger.error(f"Errored out while bulk uploading {item}.")
+        if success:
+            tracker.advance(table, sum(growth))
+        else:
+            tracker.forget(table)
+        metrics.record("write", perf_counter() - t1, item=str(entry["name"]),
+                       day=frames[0][0] if len(frames) == 1 else None,
+                       rows=total if success else 0)
+        if sink is not None:
+            for date_item, frame in frames:
+                sink.write_frame(date_item, table, frame)
+        logger.info("Packing monitor data...")
+        offset = pre_offset
+        for (date_item, frame), grown in zip(frames, growth):
+            results.append(Monitor(
+                date=datetime.strptime(date_item, "%Y/%m/%d").date(),
+                item=str(entry["name"]),
+                pre_offset=int(offset),
+                post_offset=int(offset + grown) if success else int(offset),
+                size=int(len(frame.index)),
+                success=bool(success)
+            ))
+            offset += grown
+    return sorted(results, key=lambda m: m.date)
+
+
+class StreamUploader(object):
+    """
+    Uploads the days of a stream one at a time, as batch_upload() would
+    upload them all at once: the write actions are resolved once, and
+    entries written with the DELTA action are held back, so that only
+    the last snapshot seen is written, by finish(), and the snapshots
+    it supersedes are recorded as successful without touching the db.
+    """
+
+    def __init__(self, db: Engine, batch_def: list, sink=None):
+        self.db = db
+        self.batch_def = batch_def
+        self.sink = sink
+        self.tracker = OffsetTracker(db)
+        self.actions = {entry["name"]: write_action(db, entry)
+                        for entry in batch_def}
+        self.delta = [entry for entry in batch_def
+                      if self.actions[entry["name"]] is DbActions.DELTA]
+        self.others = [entry for entry in batch_def
+                       if entry not in self.delta]
+        # entry name: (date, rows) of the last snapshot seen
+        self.held = {}
+
+    def _upload(self, day: str, items, batch_def: list,
+                latest: dict = None) -> list:
+        return upload_days(data={day: items}, db=self.db,
+                           batch_def=batch_def,
+                           writer=_write_frame,
+                           size=lambda frame: len(frame.index),
+                           tracker=self.tracker, sink=self.sink,
+                           actions=self.actions, latest=latest or {})
+
+    def upload(self, day: str, items) -> list:
+        """
+        :param day: date string formatted as "%Y/%m/%d"
+        :param items: Scoreboard items of the day
+        :return: list of Monitor SQLAlchemy objects of the entries
+        written, and of the snapshots this day supersedes
+        :rtype: list
+        """
+        if getattr(items, "failed", False):
+            return self._upload(day, items, self.batch_def)
+        results = self._upload(day, items, self.others)
+        for entry in self.delta:
+            item, name = item_source(entry), entry["name"]
+            if item not in items or items[item].empty:
+                continue
+            if name in self.held:
+                held_day, rows = self.held[name]
+                results.extend(self._upload(held_day, {item: rows}, [entry]))
+            self.held[name] = (day, items[item])
+        return results
+
+    def finish(self) -> list:
+        """
+        Write the last snapshot seen of every DELTA entry.
+        :return: list of Monitor SQLAlchemy objects
+        :rtype: list
+        """
+        results = []
+        for entry in self.delta:
+            if entry["name"] in self.held:
+                day, rows = self.held.pop(entry["name"])
+                results.extend(self._upload(day, {item_source(entry): rows},
+                                            [entry], {entry["name"]: day}))
+        return results
+
+
+def stream_upload(scoreboard_stream, db: Engine, batch_def: list,
+                  sink=None) -> list:
+    """
+    Streaming version of batch_upload(). Uploads each (date, items)
+    tuple from the iterable as soon as it arrives, so data lands in the
+    db while later days are still being fetched and only one day is
+    held in memory at a time. Standings written as deltas are only
+    written once, from the last day of the stream, see StreamUploader.
+    :param scoreboard_stream: iterable of (date string, items dict),
+    e.g. from stream_merge_line_score()
+    :param db: SQLAlchemy instance of Engine
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param sink: extra output every day is also written to, e.g. a
+    ParquetSink
+    :return: list of Monitor SQLAlchemy objects
+    :rtype: list
+    """
+    results = []
+    uploader = StreamUploader(db, batch_def, sink)
+    for date_key, items in scoreboard_stream:
+        logger.info(f"Streaming upload for date: {date_key}")
+        results.extend(uploader.upload(date_key, items))
+    results.extend(uploader.finish())
+    return results
@@ -4,8 +4,10 @@ Author: Maciej Cisowski
 """
 import os
 import logging.config
-from config import LOGGING, NBA_APP_NAME, DB
+from config import LOGGING, NBA_APP_NAME, DB, STATS
 from sys import argv
+from threading import Lock
+from time import monotonic, sleep
 
 # create logger for this module and configure it
 logging.config.dictConfig(LOGGING)
@@ -43,6 +45,24 @@ def update_config_with_env_vars(app_name: str = NBA_APP_NAME) -> dict:
     return db_out
 
 
+def update_stats_config(args: dict, env_vars: dict) -> dict:
+    """
+    Set where Scoreboard requests are sent and recorded (STATS in
+    config.py) from the runtime parameters or, failing those, the env
+    vars of the same name, e.g. --NBA_STATS_URL=http://127.0.0.1:8765/stats
+    :param args: output of get_argv()
+    :param env_vars: output of update_config_with_env_vars()
+    :return: the updated STATS dict
+    :rtype: dict
+    """
+    for key in STATS:
+        value = args.get(key, env_vars.get(key))
+        if value:
+            STATS[key] = value
+            logger.info(f"Using {key}: {value}")
+    return STATS
+
+
 def get_argv(app_name: str = NBA_APP_NAME) -> dict:
     """
     Gets the runtime parameters, filters for ones starting with
@@ -65,3 +85,43 @@ def get_argv(app_name: str = NBA_APP_NAME) -> dict:
     dicted = {k: v for k, v in filtered}
     logger.debug(f"Filtered out: {dicted}")
     return dicted
+
+
+def is_flag_set(args: dict, name: str) -> bool:
+    """
+    Check whether a boolean runtime parameter, e.g. --NBA_INCREMENTAL=true,
+    is switched on.
+    :param args: output of get_argv()
+    :param name: name of the parameter
+    :return: True for values like "true", "yes", "on" or "1"
+    :rtype: bool
+    """
+    return str(args.get(name, "")).lower() in ("1", "true", "yes", "on")
+
+
+class RateLimiter(object):
+    """
+    Thread-safe limiter spacing out calls so that no more than
+    <max_rate> calls per second are started across all threads
+    sharing the instance. A falsy <max_rate> disables the limit.
+    """
+
+    def __init__(self, max_rate: float = None):
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+        self._lock = Lock()
+        self._next_slot = monotonic()
+
+    def wait(self) -> float:
+        """
+        Block until the caller is allowed to make the next call.
+        :return: number of seconds spent waiting
+        :rtype: float
+        """
+        with self._lock:
+            now = monotonic()
+            delay = max(0.0, self._next_slot - now)
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay:
+            logger.debug(f"Rate limited, waiting for: {delay:.3f} secs")
+            sleep(delay)
+        return delay
@@ -5,7 +5,10 @@ Author: Maciej Cisowski
 import pandas as pd
 import logging.config
 from config import LOGGING
+from app import metrics
+from app.engine import batch_targets
 from datetime import date, timedelta
+from time import perf_counter
 
 # create logger for this module and configure it
 logging.config.dictConfig(LOGGING)
@@ -29,32 +32,119 @@ def is_empty(scoreboard_data: dict,
 
 def merge_line_score(scoreboard_data: dict) -> dict:
     """
-    Loop through the output of the collect function
-    fetch_scoreboard_data() and return a DataFrame merged on the game
-    sequence value.
+    Take the output of the collect function fetch_scoreboard_data()
+    and add a <mergedLineScore> DataFrame to every date, holding one
+    row per game with the away and home team line scores side by side.
+    The columns match a merge of the away and home rows on the game
+    sequence value, e.g. GAME_SEQUENCE, TEAM_ID_away, TEAM_ID_home.
+
+    All dates are processed in one go: the LineScore rows of every date
+    are concatenated, joined with the GameHeader rows on GAME_ID and
+    told apart as away or home by VISITOR_TEAM_ID and HOME_TEAM_ID,
+    rather than by their position. The merged frame is then split back
+    out per date. Dates with no games get an empty DataFrame.
     :param scoreboard_data: dict with items containing <line_score>
     members
     :return: scoreboard_data dict with <merged_line_score> output
     :rtype: dict
     """
-    date_keys = list(scoreboard_data.keys())
-
-    for date_key in date_keys:
+    t1 = perf_counter()
+    game_days = []
+    for date_key in scoreboard_data:
         if is_empty(scoreboard_data, date_key):
             logger.debug(f"Skipping merging for date: {date_key}")
             scoreboard_data[date_key]["mergedLineScore"] = pd.DataFrame.\
                 from_dict({})
         else:
-            logging.debug(f"Performing merging for date: {date_key}")
-            line_score = scoreboard_data[date_key].get("LineScore")
-            away = line_score[line_score.index % 2 == 0]
-            home = line_score[line_score.index % 2 != 0]
-            # merge the home and away records on GAME_SEQUENCE,
-            # set the suffixes
-            scoreboard_data[date_key]["mergedLineScore"] = pd.merge(
-                left=away,
-                right=home,
-                on="GAME_SEQUENCE",
-                suffixes=("_away", "_home")
-            )
+            game_days.append(date_key)
+    if not game_days:
+        return scoreboard_data
+    logger.debug(f"Performing merging for {len(game_days)} dates.")
+
+    line_score = pd.concat(
+        [scoreboard_data[d]["LineScore"] for d in game_days],
+        keys=game_days, names=["_date", "_row"]).reset_index()
+    games = pd.concat(
+        [scoreboard_data[d]["GameHeader"] for d in game_days],
+        keys=game_days, names=["_date", "_row"]
+    ).reset_index(level="_date")[
+        ["_date", "GAME_ID", "HOME_TEAM_ID", "VISITOR_TEAM_ID"]
+    ].drop_duplicates(["_date", "GAME_ID"])
+    joined = line_score.merge(games, on=["_date", "GAME_ID"], how="inner")
+
+    columns = [c for c in scoreboard_data[game_days[0]]["LineScore"].columns]
+    away = joined[joined["TEAM_ID"] == joined["VISITOR_TEAM_ID"]][
+        ["_date", "_row"] + columns].rename(
+        columns={c: f"{c}_away" for c in columns if c != "GAME_SEQUENCE"})
+    home = joined[joined["TEAM_ID"] == joined["HOME_TEAM_ID"]][
+        ["_date"] + columns].rename(
+        columns={c: f"{c}_home" for c in columns})
+    merged = away.merge(home, left_on=["_date", "GAME_ID_away"],
+                        right_on=["_date", "GAME_ID_home"], how="inner")
+    # same column layout as merging the away and home rows on
+    # GAME_SEQUENCE: away columns first, then home ones
+    layout = [c if c == "GAME_SEQUENCE" else f"{c}_away" for c in columns] + \
+             [f"{c}_home" for c in columns if c != "GAME_SEQUENCE"]
+    merged = merged.sort_values(["_date", "_row"], kind="mergesort")
+    groups = merged.groupby("_date", sort=False).indices
+    merged = merged[layout]
+
+    # concatenating dates may have widened some dtypes, e.g. an
+    # all-empty overtime column; those get restored per date below
+    concat_types = dict(zip(line_score.columns, line_score.dtypes))
+    for date_key, rows in groups.items():
+        frame = merged.take(rows).reset_index(drop=True)
+        day_types = scoreboard_data[date_key]["LineScore"].dtypes
+        restore = {}
+        for column, day_type in zip(columns, day_types):
+            if day_type != concat_types[column]:
+                restore[f"{column}_away"] = day_type
+                restore[f"{column}_home"] = day_type
+        restore.pop("GAME_SEQUENCE_away", None)
+        restore.pop("GAME_SEQUENCE_home", None)
+        scoreboard_data[date_key]["mergedLineScore"] = \
+            frame.astype(restore) if restore else frame
+    for date_key in game_days:
+        if date_key not in groups:
+            logger.warning(f"No line scores matched games on: {date_key}")
+            scoreboard_data[date_key]["mergedLineScore"] = pd.DataFrame(
+                columns=layout)
+    metrics.record("merge", perf_counter() - t1, item="mergedLineScore",
+                   day=game_days[0] if len(scoreboard_data) == 1 else None,
+                   rows=len(merged.index))
+    return scoreboard_data
+
+
+def stream_merge_line_score(scoreboard_stream):
+    """
+    Streaming version of merge_line_score(). Takes an iterable of
+    (date, items) tuples, e.g. from iter_scoreboard_data(), and yields
+    them one by one with the <mergedLineScore> item added.
+    :param scoreboard_stream: iterable of (date string, items dict)
+    :return: generator of (date string, items dict) tuples
+    """
+    for date_key, items in scoreboard_stream:
+        yield date_key, merge_line_score({date_key: items})[date_key]
+
+
+def drop_committed_items(scoreboard_data: dict, committed: dict,
+                         batch_def: list = None) -> dict:
+    """
+    Remove items that were already committed from the output of
+    merge_line_score(), so an incremental run only uploads what is
+    missing.
+    :param scoreboard_data: dict of daily dicts with DataFrame objects
+    :param committed: dict of {date: set of item names} to drop
+    :param batch_def: batch definition of the run; when given, an item
+    read by several entries is only dropped once all of them committed
+    :return: scoreboard_data without the committed items
+    :rtype: dict
+    """
+    targets = batch_targets(batch_def or [])
+    for date_key, done in committed.items():
+        if date_key in scoreboard_data:
+            for item in done | set(targets):
+                names = {e["name"] for e in targets.get(item, [])} or {item}
+                if names <= done:
+                    scoreboard_data[date_key].pop(item, None)
     return scoreboard_data
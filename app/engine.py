@@ -0,0 +1,413 @@
+"""
+SQLAlchemy Core writes of the declared data tables for NBA_v2: plain
+inserts, COPY, upserts and delta writes of standings, shared by the
+DataFrame path in app/commit.py and the lightweight one in app/lite.py.
+Kept free of pandas, so the lightweight ingestion path can use it.
+Author: Maciej Cisowski
+"""
+import csv
+import hashlib
+import logging.config
+from config import LOGGING, BULK, DbActions
+from models.scoreboard import declared_table, coerce_value
+from io import StringIO
+from sqlalchemy import MetaData, Table, Column, select, inspect, \
+    and_, or_, exists, bindparam
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.engine")
+
+
+def copy_insert(table, conn, keys: list, data_iter) -> int:
+    """
+    Insertion method for DataFrame.to_sql() streaming the rows as CSV
+    into PostgreSQL's COPY ... FROM STDIN instead of issuing INSERT
+    statements. Missing values are sent as \\N so they are told apart
+    from empty strings.
+    :param table: pandas SQLTable being written to
+    :param conn: SQLAlchemy connection from to_sql()
+    :param keys: column names, in the order of the row values
+    :param data_iter: iterable of row tuples
+    :return: number of rows copied
+    :rtype: int
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(tuple("\\N" if v is None else v for v in row)
+                     for row in data_iter)
+    buffer.seek(0)
+    columns = ", ".join(f'"{k}"' for k in keys)
+    name = f'"{table.schema}"."{table.name}"' if table.schema \
+        else f'"{table.name}"'
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            sql=f"COPY {name} ({columns}) FROM STDIN WITH CSV NULL '\\N'",
+            file=buffer)
+        return cursor.rowcount
+
+
+class UpsertCount(int):
+    """
+    Number of rows an upsert wrote, i.e. rows inserted plus rows
+    updated, which also carries the two parts separately.
+    """
+
+    def __new__(cls, inserted: int, updated: int):
+        count = super().__new__(cls, inserted + updated)
+        count.inserted = inserted
+        count.updated = updated
+        return count
+
+
+class DeltaCount(int):
+    """
+    Number of rows a delta write left matching the new snapshot, with
+    the rows inserted, updated, left unchanged and deleted to get there.
+    """
+
+    def __new__(cls, inserted: int, updated: int, unchanged: int,
+                deleted: int):
+        count = super().__new__(cls, inserted + updated + unchanged)
+        count.inserted = inserted
+        count.updated = updated
+        count.unchanged = unchanged
+        count.deleted = deleted
+        return count
+
+
+def column_value(column: Column, value):
+    """
+    Cast a value the way a declared column binds it, so that e.g. date
+    strings compare equal to the dates read back from the db.
+    :param column: column of a declared SQLAlchemy Table
+    :param value: value to cast
+    :return: the cast value
+    """
+    value = coerce_value(column.type, value)
+    if isinstance(column.type, TypeDecorator):
+        return column.type.process_bind_param(value, None)
+    return value
+
+
+def key_of(table: Table, record: dict) -> tuple:
+    """
+    :param table: declared SQLAlchemy Table
+    :param record: {column: value} dict holding the primary key columns
+    :return: primary key values of the record, as read from the db
+    :rtype: tuple
+    """
+    return tuple(column_value(c, record[c.name]) for c in table.primary_key)
+
+
+def existing_keys(connection, table: Table, keys: list,
+                  chunk: int = 500) -> set:
+    """
+    Look up which of the given primary keys are already in a table.
+    :param connection: SQLAlchemy connection or engine
+    :param table: declared SQLAlchemy Table
+    :param keys: list of primary key tuples, see key_of()
+    :param chunk: number of keys looked up per query
+    :return: set of the key tuples found in the table
+    :rtype: set
+    """
+    key = list(table.primary_key)
+    found = set()
+    for start in range(0, len(keys), chunk):
+        part = keys[start:start + chunk]
+        if len(key) == 1:
+            match = key[0].in_([k[0] for k in part])
+        else:
+            match = or_(*[and_(*[c == v for c, v in zip(key, k)])
+                          for k in part])
+        found.update(tuple(row) for row in
+                     connection.execute(select(key).where(match)))
+    return found
+
+
+def bound_rows(connection, columns: list, rows: list) -> list:
+    # run the column types' bind processing by hand, for statements
+    # that do not get it from SQLAlchemy, such as COPY or textual SQL
+    dialect = connection.dialect
+    processors = [c.type.dialect_impl(dialect).bind_processor(dialect)
+                  for c in columns]
+    return [tuple(p(r[c.name]) if p else r[c.name]
+                  for c, p in zip(columns, processors)) for r in rows]
+
+
+def upsert_on_conflict(connection, table: Table, columns: list, rows: list):
+    """
+    Insert rows, updating the ones whose primary key is already taken,
+    with INSERT ... ON CONFLICT DO UPDATE (PostgreSQL, SQLite 3.24+).
+    :param connection: SQLAlchemy connection within a transaction
+    :param table: declared SQLAlchemy Table
+    :param columns: columns of the table the rows hold
+    :param rows: list of {column: value} dicts
+    """
+    key = [c.name for c in table.primary_key]
+    update = [c.name for c in columns if c.name not in key]
+    if connection.dialect.name == "postgresql":
+        statement = postgresql.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=key,
+            set_={n: statement.excluded[n] for n in update})
+        connection.execute(statement, rows)
+        return
+    # SQLAlchemy 1.3 has no SQLite flavour of the statement, so it is
+    # spelled out and the values are bound by hand
+    quote = connection.dialect.identifier_preparer.quote
+    names = [c.name for c in columns]
+    action = "DO UPDATE SET " + ", ".join(
+        f"{quote(n)} = excluded.{quote(n)}" for n in update) \
+        if update else "DO NOTHING"
+    sql = f"INSERT INTO {quote(table.name)} " \
+          f"({', '.join(quote(n) for n in names)}) " \
+          f"VALUES ({', '.join('?' for _ in names)}) " \
+          f"ON CONFLICT ({', '.join(quote(n) for n in key)}) {action}"
+    connection.execute(sql, bound_rows(connection, columns, rows))
+
+
+def upsert_by_staging(connection, table: Table, columns: list, rows: list):
+    """
+    Insert rows, replacing the ones whose primary key is already taken,
+    for dbs without ON CONFLICT: the rows are loaded into a temporary
+    staging table, the matching rows deleted from the target and the
+    staged ones inserted in their place.
+    :param connection: SQLAlchemy connection within a transaction
+    :param table: declared SQLAlchemy Table
+    :param columns: columns of the table the rows hold
+    :param rows: list of {column: value} dicts
+    """
+    staging = Table(f"{table.name}_staging", MetaData(),
+                    *[Column(c.name, c.type) for c in columns],
+                    prefixes=["TEMPORARY"])
+    staging.create(connection)
+    try:
+        connection.execute(staging.insert(), rows)
+        match = and_(*[c == staging.c[c.name] for c in table.primary_key])
+        connection.execute(table.delete().where(
+            exists(select([staging.c[c.name] for c in table.primary_key])
+                   .where(match))))
+        connection.execute(table.insert().from_select(
+            [c.name for c in columns], select(list(staging.columns))))
+    finally:
+        staging.drop(connection)
+
+
+def row_hash(values: tuple) -> str:
+    """
+    :param values: row values, as read from the db
+    :return: sha1 digest of the row
+    :rtype: str
+    """
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+
+def apply_delta(connection, table: Table, columns: list,
+                rows: list) -> DeltaCount:
+    """
+    Turn the content of a table into the given snapshot by changing
+    only what differs: rows with a new key are inserted, rows whose
+    hash changed are updated and rows whose key is not in the snapshot
+    are deleted. Run within a transaction, readers never see the table
+    half written or empty.
+    :param connection: SQLAlchemy connection within a transaction
+    :param table: declared SQLAlchemy Table
+    :param columns: columns of the table the rows hold
+    :param rows: list of {column: value} dicts, the whole snapshot
+    :return: counts of the rows inserted, updated, unchanged, deleted
+    :rtype: DeltaCount
+    """
+    key = list(table.primary_key)
+    values = [c for c in columns if not c.primary_key]
+
+    def comparable(row):
+        return tuple(column_value(c, row[c.name]) for c in columns)
+
+    current = {tuple(r[c.name] for c in key):
+               row_hash(tuple(r[c.name] for c in columns))
+               for r in connection.execute(select(columns))}
+    snapshot = {key_of(table, r): r for r in rows}
+    inserts = [r for k, r in snapshot.items() if k not in current]
+    updates = [r for k, r in snapshot.items()
+               if k in current and current[k] != row_hash(comparable(r))]
+    deletes = [k for k in current if k not in snapshot]
+    match = and_(*[c == bindparam(f"key_{c.name}") for c in key])
+    if deletes:
+        connection.execute(table.delete().where(match),
+                           [{f"key_{c.name}": v for c, v in zip(key, k)}
+                            for k in deletes])
+    if updates and values:
+        connection.execute(
+            table.update().where(match).values(
+                {c.name: bindparam(f"new_{c.name}") for c in values}),
+            [dict({f"key_{c.name}": r[c.name] for c in key},
+                  **{f"new_{c.name}": r[c.name] for c in values})
+             for r in updates])
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    logger.info(f"Delta for table {table.name}: {len(inserts)} inserted, "
+                f"{len(updates)} updated, {len(deletes)} deleted.")
+    return DeltaCount(len(inserts), len(updates),
+                      len(snapshot) - len(inserts) - len(updates),
+                      len(deletes))
+
+
+def item_source(entry: dict) -> str:
+    """
+    :param entry: batch definition entry, see DB in config.py
+    :return: name of the Scoreboard item the entry writes, which is the
+    entry's own name unless it reads another item through "source"
+    :rtype: str
+    """
+    return entry.get("source", entry["name"])
+
+
+def batch_targets(batch_def: list) -> dict:
+    """
+    Group the entries of a batch definition by the Scoreboard item they
+    read, as one item can be written to more than one table.
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :return: dict of {item name: list of entries}
+    :rtype: dict
+    """
+    targets = {}
+    for entry in batch_def:
+        targets.setdefault(item_source(entry), []).append(entry)
+    return targets
+
+
+def has_declared_key(connection, table: Table) -> bool:
+    """
+    :param connection: SQLAlchemy connection or engine
+    :param table: declared SQLAlchemy Table that exists in the db
+    :return: True if the table in the db has the declared primary key,
+    False for tables older versions created without keys
+    :rtype: bool
+    """
+    key = inspect(connection).get_pk_constraint(table.name)
+    return sorted(key["constrained_columns"]) == \
+        sorted(c.name for c in table.primary_key)
+
+
+def write_action(db: Engine, entry: dict) -> DbActions:
+    """
+    Pick the action a batch entry is written with: its "keyed_action"
+    if it has one and its table is missing or has the declared primary
+    key, its plain "action" otherwise. Tables older versions created
+    without keys are thus written as before until they are migrated,
+    see app/migrate.py.
+    :param db: SQLAlchemy engine of the data db
+    :param entry: entry of a batch definition from config.py
+    :return: one of the DbActions enum values
+    """
+    keyed = entry.get("keyed_action")
+    table = declared_table(entry["table"])
+    if keyed is None or table is None:
+        return entry["action"]
+    with db.connect() as connection:
+        if not db.dialect.has_table(connection, table.name) or \
+                has_declared_key(connection, table):
+            return keyed
+    logger.warning(f"Table {table.name} lacks its declared key, writing "
+                   f"it with {entry['action'].name} instead of "
+                   f"{keyed.name} until it is migrated.")
+    return entry["action"]
+
+
+def latest_snapshots(data: dict, batch_def: list,
+                     actions: dict = None) -> dict:
+    """
+    Find the last date holding each item written with the DELTA action.
+    Only that date's snapshot needs writing, the earlier ones would be
+    overwritten within the same run anyway.
+    :param data: Scoreboard items indexed by date
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param actions: dict of {entry name: action} from write_action(),
+    the plain "action" of the entries is used if not given
+    :return: dict of {entry name: date}
+    :rtype: dict
+    """
+    actions = actions or {}
+    delta = [e for e in batch_def
+             if actions.get(e["name"], e["action"]) is DbActions.DELTA]
+    latest = {}
+    for date_item, items in data.items():
+        for entry in delta:
+            item, name = item_source(entry), entry["name"]
+            if item in items and not items[item].empty:
+                latest[name] = max(latest.get(name, date_item), date_item)
+    return latest
+
+
+def insert_records(db: Engine, table: Table, records: list,
+                   if_exists: DbActions = DbActions.APPEND) -> int:
+    """
+    Write a list of {column: value} records into a declared table, in a
+    single transaction. The table is created when missing, emptied
+    first on REPLACE (its schema is kept) and FAIL raises a ValueError
+    if it exists. UPSERT merges the records on the table's primary key,
+    with ON CONFLICT where the db has it and a staging table otherwise,
+    and returns an UpsertCount; on a table created without the primary
+    key it always goes through the staging table. DELTA treats the records as the new
+    content of the table and only writes the differences, see
+    apply_delta(); it raises a ValueError on a table created without
+    the primary key, which has to be migrated first. Values are cast to the column types and
+    keys that are not columns of the table are left out. Rows are sent
+    with COPY on PostgreSQL (unless disabled in config.py) and with one
+    executemany otherwise.
+    :param db: SQLAlchemy engine to call
+    :param table: declared SQLAlchemy Table
+    :param records: list of dicts, one per row
+    :param if_exists: one of the DbActions enum values
+    :return: number of rows written
+    :rtype: int
+    """
+    names = set(records[0]) if records else set()
+    columns = [c for c in table.columns if c.name in names]
+    extra = names - {c.name for c in columns}
+    if extra:
+        logger.warning(f"Leaving out columns missing from table "
+                       f"{table.name}: {sorted(extra)}")
+    rows = [{c.name: coerce_value(c.type, r.get(c.name)) for c in columns}
+            for r in records]
+    with db.begin() as connection:
+        present = db.dialect.has_table(connection, table.name)
+        if present and if_exists is DbActions.FAIL:
+            raise ValueError(f"Table '{table.name}' already exists.")
+        keyed = not present or has_declared_key(connection, table)
+        if not keyed and if_exists is DbActions.DELTA:
+            raise ValueError(f"Table '{table.name}' lacks its declared key, "
+                             f"migrate it before writing deltas.")
+        if not present:
+            table.create(connection)
+        elif if_exists is DbActions.REPLACE:
+            connection.execute(table.delete())
+        if if_exists is DbActions.DELTA:
+            return apply_delta(connection, table, columns, rows)
+        if not rows:
+            return 0
+        if if_exists is DbActions.UPSERT:
+            # the last record of a key wins, as it would in a re-run
+            rows = list({key_of(table, r): r for r in rows}.values())
+            found = existing_keys(connection, table,
+                                  [key_of(table, r) for r in rows]) \
+                if present else set()
+            if keyed and db.dialect.name in ("postgresql", "sqlite"):
+                upsert_on_conflict(connection, table, columns, rows)
+            else:
+                upsert_by_staging(connection, table, columns, rows)
+            return UpsertCount(len(rows) - len(found), len(found))
+        if db.dialect.name == "postgresql" and BULK["POSTGRES_COPY"]:
+            return copy_insert(table, connection, [c.name for c in columns],
+                               bound_rows(connection, columns, rows))
+        affected = connection.execute(table.insert(), rows).rowcount
+    if affected is not None and affected >= 0:
+        return affected
+    return len(rows)
@@ -0,0 +1,267 @@
+"""
+Lightweight ingestion path for NBA_v2 that goes straight from the raw
+Scoreboard JSON rows to SQLAlchemy Core executemany, without pandas.
+It writes the same tables as post_data() and merge_line_score().
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING, DbActions
+from app import metrics
+from app.commit import OffsetTracker, upload_days
+from app.engine import insert_records
+from models.scoreboard import declared_table
+from app.source import MERGE_ITEMS
+from time import perf_counter
+from sqlalchemy import MetaData, Table, Column, BigInteger, Float, Text, \
+    Boolean
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.lite")
+
+
+class RowSet(object):
+    """
+    A Scoreboard item as plain Python rows: column names, one SQLAlchemy
+    type per column and a list of row tuples. Types and values follow
+    what a pandas DataFrame built from the same rows would hold, so
+    that written tables are identical to the ones to_sql() creates:
+    integer columns with gaps become floats, columns with no values at
+    all become text.
+    """
+
+    def __init__(self, columns: list, types: list, rows: list):
+        self.columns = columns
+        self.types = types
+        self.rows = rows
+
+    @classmethod
+    def from_result_set(cls, result_set: dict):
+        """
+        :param result_set: a single entry of the response's resultSets
+        :return: typed rows of that result set
+        :rtype: RowSet
+        """
+        columns = list(result_set["headers"])
+        rows = [tuple(row) for row in result_set["rowSet"]]
+        types = [column_type([row[i] for row in rows])
+                 for i in range(len(columns))]
+        return cls(columns, types, cast_rows(rows, types))
+
+    @property
+    def empty(self) -> bool:
+        return not self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class LiteDay(dict):
+    """
+    Scoreboard items of a single day, as {itemName: RowSet}. A day
+    whose request failed for good holds no items and has <failed> set,
+    so that its uploads are recorded as failed, as for ScoreboardDay.
+    """
+
+    def __init__(self, items=(), failed: bool = False):
+        super().__init__(items)
+        self.failed = failed
+
+
+def column_type(values: list):
+    """
+    Pick the SQLAlchemy type pandas would map a column with these
+    values to.
+    :param values: all values of one column
+    :return: SQLAlchemy type class or instance
+    """
+    present = [v for v in values if v is not None]
+    if not present:
+        return Text
+    if all(isinstance(v, bool) for v in present):
+        return Boolean
+    if any(isinstance(v, bool) for v in present):
+        return Text
+    if all(isinstance(v, int) for v in present) and \
+            len(present) == len(values):
+        return BigInteger
+    if all(isinstance(v, (int, float)) for v in present):
+        return Float(precision=53)
+    return Text
+
+
+def cast_rows(rows: list, types: list) -> list:
+    """
+    Cast the integers of float columns to floats, as pandas does.
+    :param rows: list of row tuples
+    :param types: SQLAlchemy type per column
+    :return: list of row tuples
+    :rtype: list
+    """
+    floats = [i for i, t in enumerate(types) if isinstance(t, Float)]
+    if not floats:
+        return rows
+    out = []
+    for row in rows:
+        row = list(row)
+        for i in floats:
+            if row[i] is not None:
+                row[i] = float(row[i])
+        out.append(tuple(row))
+    return out
+
+
+def merge_line_score_rows(line_score: RowSet, game_header: RowSet) -> RowSet:
+    """
+    Put the away and home LineScore rows of each game side by side,
+    the same way merge_line_score() does: away and home are told apart
+    by VISITOR_TEAM_ID and HOME_TEAM_ID of the game in GameHeader and
+    the columns are GAME_SEQUENCE, <column>_away..., <column>_home...
+    :param line_score: LineScore rows of a single day
+    :param game_header: GameHeader rows of the same day
+    :return: merged rows, one per game, in the order of the away rows
+    :rtype: RowSet
+    """
+    columns = line_score.columns
+    header = {c: i for i, c in enumerate(game_header.columns)}
+    teams = {}
+    for game in game_header.rows:
+        teams.setdefault(game[header["GAME_ID"]],
+                         (game[header["VISITOR_TEAM_ID"]],
+                          game[header["HOME_TEAM_ID"]]))
+    game_id = columns.index("GAME_ID")
+    team_id = columns.index("TEAM_ID")
+    away, home = [], {}
+    for row in line_score.rows:
+        if row[game_id] not in teams:
+            continue
+        visitor, host = teams[row[game_id]]
+        if row[team_id] == visitor:
+            away.append(row)
+        if row[team_id] == host:
+            home.setdefault(row[game_id], []).append(row)
+
+    sequence = columns.index("GAME_SEQUENCE")
+    home_columns = [i for i in range(len(columns)) if i != sequence]
+    merged_columns = \
+        [c if c == "GAME_SEQUENCE" else f"{c}_away" for c in columns] + \
+        [f"{columns[i]}_home" for i in home_columns]
+    merged_types = line_score.types + \
+        [line_score.types[i] for i in home_columns]
+    rows = []
+    for row in away:
+        for match in home.get(row[game_id], []):
+            rows.append(row + tuple(match[i] for i in home_columns))
+    return RowSet(merged_columns, merged_types, rows)
+
+
+def lite_scoreboard_day(raw: dict, items: set = None) -> LiteDay:
+    """
+    Turn a raw Scoreboard response into a dict of {itemName: RowSet},
+    with a <mergedLineScore> item added as in merge_line_score().
+    :param raw: raw endpoint response
+    :param items: names of the items to keep, None keeps all of them
+    :return: dict of Scoreboard items for a single day
+    :rtype: LiteDay
+    """
+    t1 = perf_counter()
+    day = LiteDay((r["name"], RowSet.from_result_set(r))
+                  for r in raw["resultSets"]
+                  if items is None or r["name"] in items
+                  or r["name"] in MERGE_ITEMS)
+    if day["Available"].empty:
+        day["mergedLineScore"] = RowSet([], [], [])
+    else:
+        day["mergedLineScore"] = merge_line_score_rows(day["LineScore"],
+                                                       day["GameHeader"])
+    metrics.record("merge", perf_counter() - t1, item="mergedLineScore",
+                   rows=len(day["mergedLineScore"]))
+    return day
+
+
+def rows_table(rows: RowSet, table: str) -> Table:
+    """
+    :param rows: the rows to be written
+    :param table: name of the table
+    :return: SQLAlchemy Table matching what to_sql() would create,
+    including the "index" column and its index
+    :rtype: Table
+    """
+    return Table(table, MetaData(),
+                 Column("index", BigInteger, index=True),
+                 *[Column(c, t) for c, t in zip(rows.columns, rows.types)])
+
+
+def post_rows(db: Engine, rows: RowSet, table: str,
+              if_exists: DbActions = DbActions.APPEND) -> dict:
+    """
+    Counterpart of post_data() for a RowSet. Tables declared in
+    models/scoreboard.py are written by insert_records(). Any other
+    table is created as to_sql() would when missing (or dropped and
+    recreated on REPLACE) and the rows are sent with a single
+    executemany, all in one transaction.
+    :param db: SQLAlchemy engine to call
+    :param rows: RowSet to be posted
+    :param table: the table name to use
+    :param if_exists: one of the DbActions enum values for modifying
+    how an existing db table should be treated
+    :return: a dict pair of {table: rows written}
+    :rtype: dict
+    """
+    logger.info(f"Posting rows to table: {table}.")
+    declared = declared_table(table)
+    if declared is not None:
+        records = [dict(zip(rows.columns, row)) for row in rows.rows]
+        try:
+            return {table: insert_records(db, declared, records, if_exists)}
+        except (SQLAlchemyError, ValueError) as error:
+            logger.warning(f"Error while posting rows to table: {table}: "
+                           f"{error}")
+            return {table: 0}
+    if if_exists in (DbActions.UPSERT, DbActions.DELTA):
+        raise ValueError(f"{if_exists.value} needs a declared table, "
+                         f"{table} is not in models/scoreboard.py.")
+    target = rows_table(rows, table)
+    records = [dict(zip(["index"] + rows.columns, (n,) + row))
+               for n, row in enumerate(rows.rows)]
+    try:
+        with db.begin() as connection:
+            exists = db.dialect.has_table(connection, table)
+            if exists and if_exists is DbActions.FAIL:
+                raise ValueError(f"Table '{table}' already exists.")
+            if exists and if_exists is DbActions.REPLACE:
+                target.drop(connection)
+                exists = False
+            if not exists:
+                target.create(connection)
+            affected = connection.execute(target.insert(), records).rowcount
+    except SQLAlchemyError:
+        logger.warning(f"Error while posting rows to table: {table}")
+        return {table: 0}
+    if affected is not None and affected >= 0:
+        return {table: affected}
+    return {table: len(records)}
+
+
+def lite_upload(data: dict, db: Engine, batch_def: list,
+                tracker: OffsetTracker = None) -> list:
+    """
+    Counterpart of batch_upload() for the output of
+    lite_scoreboard_day(), indexed by date. It shares the write loop of
+    batch_upload(), see upload_days(), so it produces the same Monitor
+    records, superseded DELTA snapshots included.
+    :param data: dict of {date: LiteDay}, failed days are recorded as
+    failed for every entry of the batch
+    :param db: SQLAlchemy instance of Engine
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param tracker: OffsetTracker shared across calls within a run,
+    a new one is made if not given
+    :return: list of Monitor SQLAlchemy objects
+    :rtype: list
+    """
+    return upload_days(data=data, db=db, batch_def=batch_def,
+                       writer=post_rows, size=len, tracker=tracker)
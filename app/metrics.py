@@ -0,0 +1,257 @@
+"""
+Per-stage timings of an NBA_v2 run: request latency and size, merge,
+write and monitor times and rows per second, by date and item. They
+are kept in the monitor db and can be exported for Prometheus.
+Author: Maciej Cisowski
+"""
+import os
+import logging.config
+from config import LOGGING, METRICS
+from models.monitor import RunMetric, metadata
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from time import time
+from uuid import uuid4
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.metrics")
+
+# the collector of the run in progress, None when metrics are off
+_active = None
+
+
+class RunMetrics(object):
+    """
+    Thread-safe collector of the RunMetric records of a single run.
+    Stages are "fetch" (requests sent to the API), "cache" (responses
+    served from the response cache), "merge", "write" and "monitor".
+    """
+
+    def __init__(self, run_id: str = None):
+        self.run_id = run_id or \
+            f"{datetime.now():%Y%m%dT%H%M%S}-{uuid4().hex[:8]}"
+        self.started = time()
+        self.records = []
+        self._lock = Lock()
+
+    def record(self, stage: str, secs: float, day=None, item: str = None,
+               rows: int = None, size_bytes: int = None,
+               retries: int = 0) -> RunMetric:
+        """
+        :param stage: name of the stage
+        :param secs: seconds the stage took
+        :param day: date the record is for, as a date or a "%Y/%m/%d"
+        string, None if it covers several dates
+        :param item: Scoreboard item the record is for, if any
+        :param rows: number of rows processed
+        :param size_bytes: size of the response, for requests
+        :param retries: number of requests retried
+        :return: the stored record
+        :rtype: RunMetric
+        """
+        if isinstance(day, str):
+            day = datetime.strptime(day, "%Y/%m/%d").date()
+        metric = RunMetric(run_id=self.run_id, stage=stage, date=day,
+                           item=item, secs=float(secs), rows=rows,
+                           size_bytes=size_bytes, retries=retries,
+                           rows_per_sec=rows / secs
+                           if rows is not None and secs > 0 else None)
+        with self._lock:
+            self.records.append(metric)
+        return metric
+
+    def totals(self) -> dict:
+        """
+        :return: dict of {(stage, item): {"secs", "rows", "bytes",
+        "retries", "count"}} summed over all dates
+        :rtype: dict
+        """
+        totals = defaultdict(lambda: {"secs": 0.0, "rows": 0, "bytes": 0,
+                                      "retries": 0, "count": 0})
+        with self._lock:
+            records = list(self.records)
+        for m in records:
+            total = totals[(m.stage, m.item)]
+            total["secs"] += m.secs
+            total["rows"] += m.rows or 0
+            total["bytes"] += m.size_bytes or 0
+            total["retries"] += m.retries or 0
+            total["count"] += 1
+        return dict(totals)
+
+
+def start_run(run_id: str = None) -> RunMetrics:
+    """
+    Start collecting metrics for a new run.
+    :param run_id: id of the run, one is made up if not given
+    :return: the collector of the run
+    :rtype: RunMetrics
+    """
+    global _active
+    _active = RunMetrics(run_id)
+    logger.info(f"Collecting metrics for run: {_active.run_id}")
+    return _active
+
+
+def stop_run() -> RunMetrics:
+    """
+    Stop collecting metrics.
+    :return: the collector of the run that was in progress, if any
+    :rtype: RunMetrics
+    """
+    global _active
+    finished, _active = _active, None
+    return finished
+
+
+def active_run() -> RunMetrics:
+    """
+    :return: the collector of the run in progress, None if there is none
+    :rtype: RunMetrics
+    """
+    return _active
+
+
+def enabled() -> bool:
+    """
+    :return: True if a run is collecting metrics
+    :rtype: bool
+    """
+    return _active is not None
+
+
+def record(stage: str, secs: float, **kwargs):
+    """
+    Add a record to the run in progress, see RunMetrics.record(). Does
+    nothing if no run is collecting metrics.
+    """
+    collector = _active
+    if collector is not None:
+        collector.record(stage, secs, **kwargs)
+
+
+def post_run_metrics(db: Engine, metrics: RunMetrics) -> int:
+    """
+    Store the records of a run in the run_metrics table of the monitor
+    db, in a single transaction.
+    :param db: SQLAlchemy Engine of the monitor db
+    :param metrics: collector of the run
+    :return: number of records stored
+    :rtype: int
+    """
+    if metrics is None or not metrics.records:
+        return 0
+    columns = [c.name for c in RunMetric.__table__.columns if c.name != "id"]
+    rows = [{c: getattr(m, c) for c in columns} for m in metrics.records]
+    try:
+        metadata.create_all(bind=db, tables=[RunMetric.__table__],
+                            checkfirst=True)
+        with db.begin() as connection:
+            connection.execute(RunMetric.__table__.insert(), rows)
+    except SQLAlchemyError:
+        logger.error("Could not store the run metrics.")
+        return 0
+    logger.info(f"Stored {len(rows)} run metrics of run: {metrics.run_id}")
+    return len(rows)
+
+
+def _labels(**labels) -> str:
+    text = ",".join(f'{k}="{v}"' for k, v in labels.items() if v is not None)
+    return f"{{{text}}}" if text else ""
+
+
+def prometheus_text(metrics: RunMetrics, prefix: str = "nba") -> str:
+    """
+    Render the totals of a run in the Prometheus text format, as
+    gauges labelled by stage and item.
+    :param metrics: collector of the run
+    :param prefix: prefix of the metric names
+    :return: the exposition text
+    :rtype: str
+    """
+    totals = metrics.totals()
+    latencies = sorted(m.secs for m in metrics.records if m.stage == "fetch")
+    gauges = [
+        ("stage_seconds", "Seconds spent in each stage in the last run.",
+         lambda t: t["secs"]),
+        ("stage_rows", "Rows processed by each stage in the last run.",
+         lambda t: t["rows"]),
+        ("stage_rows_per_second", "Rows per second of each stage in the "
+         "last run.", lambda t: t["rows"] / t["secs"] if t["secs"] else 0),
+        ("stage_calls", "Number of calls of each stage in the last run.",
+         lambda t: t["count"]),
+        ("response_bytes", "Bytes of the responses received in the last "
+         "run.", lambda t: t["bytes"]),
+        ("request_retries", "Requests retried in the last run.",
+         lambda t: t["retries"])
+    ]
+    lines = []
+    for name, text, value in gauges:
+        lines += [f"# HELP {prefix}_{name} {text}",
+                  f"# TYPE {prefix}_{name} gauge"]
+        lines += [f"{prefix}_{name}{_labels(stage=stage, item=item)} "
+                  f"{float(value(total)):g}"
+                  for (stage, item), total in sorted(
+                      totals.items(), key=lambda kv: (kv[0][0],
+                                                      kv[0][1] or ""))]
+    lines += [f"# HELP {prefix}_request_latency_seconds Latency of the "
+              f"API requests in the last run.",
+              f"# TYPE {prefix}_request_latency_seconds summary"]
+    for quantile in (0.5, 0.9, 0.99):
+        value = latencies[min(len(latencies) - 1,
+                              int(quantile * len(latencies)))] \
+            if latencies else 0.0
+        lines.append(f"{prefix}_request_latency_seconds"
+                     f"{_labels(quantile=quantile)} {value:g}")
+    lines += [f"{prefix}_request_latency_seconds_sum {sum(latencies):g}",
+              f"{prefix}_request_latency_seconds_count {len(latencies)}",
+              f"# HELP {prefix}_last_run_timestamp_seconds Start of the "
+              f"last run.",
+              f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+              f"{prefix}_last_run_timestamp_seconds {metrics.started:.0f}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, metrics: RunMetrics) -> str:
+    """
+    Write the totals of a run to a *.prom file for node-exporter's
+    textfile collector. The file is replaced in one go, so the
+    collector never reads it half written.
+    :param path: path of the file, e.g.
+    /var/lib/node_exporter/textfile/nba.prom
+    :param metrics: collector of the run
+    :return: the path written
+    :rtype: str
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(prometheus_text(metrics))
+    os.replace(tmp, path)
+    logger.info(f"Wrote run metrics for Prometheus to: {path}")
+    return path
+
+
+def finish_run(db: Engine, prom_file: str = METRICS["PROM_FILE"]) -> RunMetrics:
+    """
+    Stop collecting metrics, store them in the monitor db and write
+    them to <prom_file> if one is given.
+    :param db: SQLAlchemy Engine of the monitor db
+    :param prom_file: path of the *.prom file, None skips the export
+    :return: the collector of the finished run, None if there was none
+    :rtype: RunMetrics
+    """
+    finished = stop_run()
+    if finished is None:
+        return None
+    post_run_metrics(db, finished)
+    if prom_file:
+        try:
+            write_prometheus(prom_file, finished)
+        except OSError:
+            logger.error(f"Could not write run metrics to: {prom_file}")
+    return finished
@@ -0,0 +1,166 @@
+"""
+Migration of data tables created by pandas' type inference to the
+schemas declared in models/scoreboard.py.
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING, DB
+from models.scoreboard import declared_table, coerce_value, GameDateTime, \
+    StandingsDate
+from app.engine import has_declared_key
+from sqlalchemy import MetaData, Table, text
+from sqlalchemy.engine import Engine
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.migrate")
+
+# rows copied per INSERT while migrating
+CHUNK_ROWS = 1000
+
+# order in which the rows of the append-only tables pandas created were
+# uploaded, per dialect
+INSERTION_ORDER = {"sqlite": "rowid", "postgresql": "ctid"}
+
+
+def needs_migration(db: Engine, table: str) -> bool:
+    """
+    A table needs migrating if it exists but lacks the primary key of
+    its declared schema, e.g. because pandas created it.
+    :param db: SQLAlchemy engine to inspect
+    :param table: name of a declared table
+    :return: True if the table should be migrated
+    :rtype: bool
+    """
+    declared = declared_table(table)
+    if declared is None:
+        return False
+    with db.connect() as connection:
+        if not db.dialect.has_table(connection, table):
+            return False
+        return not has_declared_key(connection, declared)
+
+
+def legacy_name(connection, table: str) -> str:
+    """
+    :param connection: SQLAlchemy connection to the db holding the table
+    :param table: name of the table to be migrated
+    :return: <table>_legacy, or <table>_legacy_<n> for the first <n>
+    not taken by the old table of an earlier migration
+    :rtype: str
+    """
+    name, n = f"{table}_legacy", 1
+    while connection.dialect.has_table(connection, name):
+        n += 1
+        name = f"{table}_legacy_{n}"
+    return name
+
+
+def upload_order(db: Engine, legacy: Table, declared: Table) -> list:
+    """
+    :param db: SQLAlchemy engine of the db holding the table
+    :param legacy: reflected table created by pandas
+    :param declared: declared table it is migrated to
+    :return: ORDER BY clauses listing its rows oldest upload first: the
+    row order where the dialect has one, the date columns otherwise
+    :rtype: list
+    """
+    if db.dialect.name in INSERTION_ORDER:
+        return [text(INSERTION_ORDER[db.dialect.name])]
+    return [legacy.columns[c.name] for c in declared.columns
+            if isinstance(c.type, (GameDateTime, StandingsDate))
+            and c.name in legacy.columns]
+
+
+def migrate_table(db: Engine, table: str, keep_legacy: bool = True) -> int:
+    """
+    Move an existing table over to its declared schema. The old table
+    is renamed to <table>_legacy (see legacy_name()), the declared one is created with its
+    keys and indexes and the rows are copied over, cast to the declared
+    column types. Columns the declared schema does not have (such as
+    pandas' "index") are dropped and rows repeating a primary key keep
+    the version uploaded last. Everything runs in one transaction.
+    :param db: SQLAlchemy engine of the db holding the table
+    :param table: name of a table declared in models/scoreboard.py
+    :param keep_legacy: keep the renamed old table, rows deduplicated
+    away included, instead of dropping it at the end
+    :return: number of rows copied into the declared table
+    :rtype: int
+    """
+    if not needs_migration(db, table):
+        logger.info(f"Table {table} does not need migrating.")
+        return 0
+    declared = declared_table(table)
+    preparer = db.dialect.identifier_preparer
+    logger.info(f"Migrating table {table} to its declared schema.")
+    with db.begin() as connection:
+        renamed = legacy_name(connection, table)
+        connection.execute(f"ALTER TABLE {preparer.quote(table)} "
+                           f"RENAME TO {preparer.quote(renamed)}")
+        legacy = Table(renamed, MetaData(), autoload_with=connection)
+        declared.create(connection)
+        columns = [c for c in declared.columns if c.name in legacy.columns]
+        key = [c.name for c in declared.primary_key]
+        rows = {}
+        query = legacy.select().order_by(
+            *upload_order(db, legacy, declared))
+        for row in connection.execute(query):
+            record = {c.name: coerce_value(c.type, row[c.name])
+                      for c in columns}
+            rows[tuple(record[k] for k in key)] = record
+        records = list(rows.values())
+        for start in range(0, len(records), CHUNK_ROWS):
+            connection.execute(declared.insert(),
+                               records[start:start + CHUNK_ROWS])
+        if not keep_legacy:
+            legacy.drop(connection)
+    logger.info(f"Migrated {len(records)} rows into table {table}.")
+    if keep_legacy:
+        logger.info(f"The old table is kept as {renamed}.")
+    return len(records)
+
+
+def legacy_tables(db: Engine, batch_def: list) -> list:
+    """
+    :param db: SQLAlchemy engine of the data db
+    :param batch_def: batch definition from BATCHES in config.py
+    :return: names of the tables the batch writes to that still lack
+    the keys of their declared schema
+    :rtype: list
+    """
+    return [entry["table"] for entry in batch_def
+            if needs_migration(db, entry["table"])]
+
+
+def migrate_batch(db: Engine, batch_def: list,
+                  keep_legacy: bool = True) -> dict:
+    """
+    Migrate the tables a batch writes to that still lack the keys of
+    their declared schema, so that its UPSERT and DELTA writes work.
+    :param db: SQLAlchemy engine of the data db
+    :param batch_def: batch definition from BATCHES in config.py
+    :param keep_legacy: keep the renamed old tables
+    :return: dict of {table: rows copied} of the migrated tables
+    :rtype: dict
+    """
+    migrated = {table: migrate_table(db, table, keep_legacy)
+                for table in legacy_tables(db, batch_def)}
+    if migrated:
+        logger.warning(f"Migrated tables without their declared keys: "
+                       f"{migrated}")
+    return migrated
+
+
+def migrate_all(db: Engine, keep_legacy: bool = True) -> dict:
+    """
+    Migrate every table of the db mapping in config.py that has a
+    declared schema.
+    :param db: SQLAlchemy engine of the data db
+    :param keep_legacy: keep the renamed old tables
+    :return: dict of {table: rows copied}
+    :rtype: dict
+    """
+    return {entry["table"]: migrate_table(db, entry["table"], keep_legacy)
+            for entry in DB["NBA_DB_MAPPING"].values()
+            if declared_table(entry["table"]) is not None}
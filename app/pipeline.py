@@ -0,0 +1,208 @@
+"""
+Staged pipeline running the fetch, transform and commit steps of
+NBA_v2 concurrently, connected by bounded queues.
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING, PIPELINE
+from app.collect import iter_scoreboard_data
+from app.data import merge_line_score, drop_committed_items
+from app.commit import StreamUploader
+from queue import Queue, Full, Empty
+from threading import Thread, Event, Lock
+from time import monotonic
+from sqlalchemy.engine import Engine
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.pipeline")
+
+# marks the end of the stream on a queue
+_DONE = object()
+
+
+class StageStats(object):
+    """
+    Counters for a single pipeline stage: number of days processed,
+    time spent working (as opposed to waiting on queues) and the depth
+    of the queue feeding the next stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_secs = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.started = None
+        self.finished = None
+        self._lock = Lock()
+
+    def record(self, busy_secs: float, queue_depth: int):
+        with self._lock:
+            self.items += 1
+            self.busy_secs += busy_secs
+            self.queue_depth = queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def throughput(self) -> float:
+        """
+        :return: days processed per second of wall-clock time
+        :rtype: float
+        """
+        end = self.finished or monotonic()
+        elapsed = end - self.started if self.started else 0.0
+        return self.items / elapsed if elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {"items": self.items,
+                "busy_secs": round(self.busy_secs, 3),
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "throughput": round(self.throughput(), 3)}
+
+
+def _put(queue: Queue, item, stop: Event) -> bool:
+    # blocks while the queue is full, which is what applies backpressure
+    # to the upstream stage; gives up if another stage failed
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _get(queue: Queue, stop: Event):
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(db: Engine,
+                 batch_def: list,
+                 queue_size: int = PIPELINE["QUEUE_SIZE"],
+                 report_secs: float = PIPELINE["REPORT_SECS"],
+                 committed: dict = None,
+                 sink=None,
+                 **fetch_args) -> tuple:
+    """
+    Run fetch -> merge_line_score -> upload as three overlapping
+    stages, each in its own thread. Days are uploaded by a
+    StreamUploader, so standings written as deltas are only written
+    once, from the last day. The stages are connected by queues
+    holding at most <queue_size> days, so a slow db stalls the merge
+    stage, which in turn stalls the fetch workers, instead of letting
+    fetched days pile up in memory. Per-stage queue depth and
+    throughput are logged every <report_secs> seconds.
+
+    :param db: SQLAlchemy instance of Engine used by the commit stage
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be uploaded
+    :param queue_size: max number of days waiting between two stages
+    :param report_secs: interval between progress reports
+    :param committed: dict of {date: set of item names} that are
+    already in the db and should not be uploaded again
+    :param sink: extra output the commit stage also writes every day
+    to, e.g. a ParquetSink
+    :param fetch_args: keyword arguments for iter_scoreboard_data()
+    :return: tuple of a list of Monitor objects and a dict of stage
+    stats, indexed by stage name
+    :rtype: tuple
+    """
+    fetched = Queue(maxsize=queue_size)
+    merged = Queue(maxsize=queue_size)
+    stop = Event()
+    errors = []
+    results = []
+    stats = {name: StageStats(name) for name in ("fetch", "transform",
+                                                 "commit")}
+
+    def fetch_stage():
+        stage = stats["fetch"]
+        stream = iter_scoreboard_data(**fetch_args)
+        try:
+            while True:
+                t = monotonic()
+                try:
+                    day, items = next(stream)
+                except StopIteration:
+                    break
+                stage.record(monotonic() - t, fetched.qsize())
+                if not _put(fetched, (day, items), stop):
+                    break
+        finally:
+            stream.close()
+
+    def transform_stage():
+        stage = stats["transform"]
+        while True:
+            item = _get(fetched, stop)
+            if item is _DONE:
+                break
+            day, items = item
+            t = monotonic()
+            merged_day = merge_line_score({day: items})
+            items = drop_committed_items(merged_day, committed or {},
+                                         batch_def)[day]
+            stage.record(monotonic() - t, merged.qsize())
+            if not _put(merged, (day, items), stop):
+                break
+
+    def commit_stage():
+        stage = stats["commit"]
+        uploader = StreamUploader(db, batch_def, sink)
+        while True:
+            item = _get(merged, stop)
+            if item is _DONE:
+                break
+            day, items = item
+            t = monotonic()
+            results.extend(uploader.upload(day, items))
+            stage.record(monotonic() - t, 0)
+        if not stop.is_set():
+            # the snapshots held back until the last day was seen
+            results.extend(uploader.finish())
+
+    def run_stage(name, target, downstream):
+        stats[name].started = monotonic()
+        try:
+            target()
+        except Exception as e:
+            logger.exception(f"Pipeline stage {name} failed.")
+            errors.append(e)
+            stop.set()
+        finally:
+            stats[name].finished = monotonic()
+            if downstream is not None:
+                _put(downstream, _DONE, stop)
+
+    threads = [
+        Thread(target=run_stage, args=("fetch", fetch_stage, fetched),
+               name="nba-fetch", daemon=True),
+        Thread(target=run_stage, args=("transform", transform_stage, merged),
+               name="nba-transform", daemon=True),
+        Thread(target=run_stage, args=("commit", commit_stage, None),
+               name="nba-commit", daemon=True),
+    ]
+    logger.info(f"Starting pipeline with queues of {queue_size} days.")
+    for thread in threads:
+        thread.start()
+    while threads[-1].is_alive():
+        threads[-1].join(timeout=report_secs)
+        report = {name: s.as_dict() for name, s in stats.items()}
+        report["fetch"]["queue_depth"] = fetched.qsize()
+        report["transform"]["queue_depth"] = merged.qsize()
+        logger.info(f"Pipeline progress: {report}")
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    report = {name: s.as_dict() for name, s in stats.items()}
+    logger.info(f"Pipeline finished: {report}")
+    return results, report
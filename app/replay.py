@@ -0,0 +1,257 @@
+"""
+Recorded NBA.com responses and a local stand-in for stats.nba.com
+serving them, so that runs, tests and load tests work offline.
+Author: Maciej Cisowski
+"""
+import os
+import json
+import random
+import logging.config
+from config import LOGGING, REPLAY, request_header
+from app.common import get_argv
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.replay")
+
+# query parameter telling the fixtures of an endpoint apart: the date
+# for Scoreboard days, the game for the per-game box scores
+FIXTURE_KEYS = ("GameDate", "GameID")
+
+
+def fixture_path(fixtures_dir: str, key: str,
+                 endpoint: str = "scoreboardv2") -> str:
+    """
+    :param fixtures_dir: root directory of the fixtures
+    :param key: date string formatted as "%Y/%m/%d", or the GAME_ID for
+    per-game endpoints
+    :param endpoint: name of the stats.nba.com endpoint
+    :return: path of the fixture of that endpoint and day or game
+    :rtype: str
+    """
+    return os.path.join(fixtures_dir, endpoint.lower(),
+                        f"{key.replace('/', '-')}.json")
+
+
+def save_fixture(fixtures_dir: str, key: str, raw: dict,
+                 endpoint: str = "scoreboardv2",
+                 parameters: dict = None) -> str:
+    """
+    Save a response as a replay fixture, along with the parameters and
+    the request_header set it was requested with.
+    :param fixtures_dir: root directory of the fixtures
+    :param key: date string formatted as "%Y/%m/%d", or the GAME_ID for
+    per-game endpoints
+    :param raw: raw endpoint response
+    :param endpoint: name of the stats.nba.com endpoint
+    :param parameters: parameters of the request, those of a Scoreboard
+    request for the day <key> if not given
+    :return: path of the saved fixture
+    :rtype: str
+    """
+    path = fixture_path(fixtures_dir, key, endpoint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fixture = {"endpoint": endpoint,
+               "parameters": parameters or {"DayOffset": 0, "GameDate": key,
+                                            "LeagueID": "00"},
+               "headers": request_header,
+               "response": raw}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(fixture, f)
+    os.replace(tmp, path)
+    logger.debug(f"Recorded {endpoint} for {key} to: {path}")
+    return path
+
+
+def load_fixture(fixtures_dir: str, key: str,
+                 endpoint: str = "scoreboardv2") -> dict:
+    """
+    :param fixtures_dir: root directory of the fixtures
+    :param key: date string formatted as "%Y/%m/%d", or the GAME_ID for
+    per-game endpoints
+    :param endpoint: name of the stats.nba.com endpoint
+    :return: the saved fixture, None if there is none for that key
+    :rtype: dict
+    """
+    try:
+        with open(fixture_path(fixtures_dir, key, endpoint)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        replay = self.server.replay
+        url = urlparse(self.path)
+        endpoint = url.path.rstrip("/").rsplit("/", 1)[-1]
+        query = parse_qs(url.query)
+        key = next((query[name][0] for name in FIXTURE_KEYS
+                    if name in query), "")
+        fault = replay.fault()
+        if fault == "timeout":
+            # never answer, the client has to time out
+            sleep(replay.hang_secs)
+            self.close_connection = True
+            return
+        sleep(replay.delay())
+        if fault == "error":
+            self._reply(429, b'{"Message":"Too Many Requests"}',
+                        {"Retry-After": "1"})
+            return
+        fixture = load_fixture(replay.fixtures_dir, key, endpoint) \
+            if key else None
+        if fixture is None:
+            replay.count("missing")
+            self._reply(404, b'{"Message":"No fixture."}')
+            return
+        replay.count("ok")
+        self._reply(200, json.dumps(fixture["response"]).encode("utf-8"))
+
+    def _reply(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class ReplayServer(object):
+    """
+    Local HTTP server standing in for stats.nba.com. It answers
+    /stats/<endpoint>?GameDate=... with the recorded fixture of that
+    day, and /stats/<endpoint>?GameID=... with the one of that game,
+    after <latency> seconds give or take <jitter>. A share of the
+    requests (<error_rate>) gets a 429 and another (<timeout_rate>) no
+    answer at all for <hang_secs>, drawn from a seeded generator so
+    load tests are reproducible. Port 0 picks a free port. What was
+    served is counted in <served>.
+    """
+
+    def __init__(self, fixtures_dir: str = REPLAY["FIXTURES_DIR"],
+                 host: str = REPLAY["HOST"], port: int = REPLAY["PORT"],
+                 latency: float = REPLAY["LATENCY_SECS"],
+                 jitter: float = REPLAY["JITTER_SECS"],
+                 error_rate: float = REPLAY["ERROR_RATE"],
+                 timeout_rate: float = REPLAY["TIMEOUT_RATE"],
+                 hang_secs: float = REPLAY["HANG_SECS"],
+                 seed: int = None):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_secs = hang_secs
+        self.served = Counter()
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._thread = None
+        self._httpd = ThreadingHTTPServer((host, port), _ReplayHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.replay = self
+
+    @property
+    def url(self) -> str:
+        """
+        :return: base url to set as NBA_STATS_URL
+        :rtype: str
+        """
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/stats"
+
+    def count(self, outcome: str):
+        with self._lock:
+            self.served[outcome] += 1
+
+    def fault(self) -> str:
+        """
+        :return: "error", "timeout" or None for a regular answer
+        :rtype: str
+        """
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.error_rate:
+            outcome = "error"
+        elif draw < self.error_rate + self.timeout_rate:
+            outcome = "timeout"
+        else:
+            return None
+        self.count(outcome)
+        return outcome
+
+    def delay(self) -> float:
+        """
+        :return: seconds to wait before answering
+        :rtype: float
+        """
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency + spread)
+
+    def start(self):
+        """
+        Serve in a background thread.
+        :return: the server itself
+        :rtype: ReplayServer
+        """
+        self._thread = Thread(target=self._httpd.serve_forever,
+                              name="replay-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Replaying fixtures from {self.fixtures_dir} "
+                    f"at: {self.url}")
+        return self
+
+    def serve_forever(self):
+        logger.info(f"Replaying fixtures from {self.fixtures_dir} "
+                    f"at: {self.url}")
+        self._httpd.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+        logger.info(f"Replay server stopped, served: {dict(self.served)}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    args = get_argv()
+    server = ReplayServer(
+        fixtures_dir=args.get("NBA_FIXTURES_DIR", REPLAY["FIXTURES_DIR"]),
+        host=args.get("NBA_REPLAY_HOST", REPLAY["HOST"]),
+        port=int(args.get("NBA_REPLAY_PORT", REPLAY["PORT"])),
+        latency=float(args.get("NBA_REPLAY_LATENCY",
+                               REPLAY["LATENCY_SECS"])),
+        jitter=float(args.get("NBA_REPLAY_JITTER", REPLAY["JITTER_SECS"])),
+        error_rate=float(args.get("NBA_REPLAY_ERROR_RATE",
+                                  REPLAY["ERROR_RATE"])),
+        timeout_rate=float(args.get("NBA_REPLAY_TIMEOUT_RATE",
+                                    REPLAY["TIMEOUT_RATE"])))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
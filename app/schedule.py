@@ -0,0 +1,269 @@
+"""
+Season calendar of NBA_v2: which dates have games, learned from the
+Scoreboard responses fetched or cached so far, along with the
+off-seasons following the NBA Finals they show, so that dates without
+games are not requested at all.
+Author: Maciej Cisowski
+"""
+import os
+import json
+import logging.config
+from config import LOGGING, SCHEDULE, CACHE
+from app.cache import ResponseCache
+from app.common import get_argv
+from collections import Counter
+from bisect import bisect_right
+from datetime import date, timedelta
+from threading import Lock
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.schedule")
+
+_calendars = {}
+
+
+def season_of(day: date) -> str:
+    """
+    :param day: a date of the season
+    :return: NBA season of the date, e.g. "2019-20"; seasons roll over
+    in August
+    :rtype: str
+    """
+    start = day.year if day.month > 7 else day.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def game_count(raw: dict) -> int:
+    """
+    :param raw: raw Scoreboard response
+    :return: number of games listed in its GameHeader, None if it has
+    no GameHeader
+    :rtype: int
+    """
+    for result_set in raw.get("resultSets", []):
+        if result_set.get("name") == "GameHeader":
+            return len({row[result_set["headers"].index("GAME_ID")]
+                        for row in result_set["rowSet"]})
+    return None
+
+
+def finals_over(raw: dict) -> bool:
+    """
+    :param raw: raw Scoreboard response
+    :return: True if the response shows the end of the NBA Finals, i.e.
+    a game of the fourth playoff round (GAME_ID "004YY004SG") after
+    which one of the teams has won four games of the series
+    :rtype: bool
+    """
+    for result_set in raw.get("resultSets", []):
+        if result_set.get("name") != "SeriesStandings":
+            continue
+        headers = result_set["headers"]
+        for row in result_set["rowSet"]:
+            series = dict(zip(headers, row))
+            game_id = str(series.get("GAME_ID") or "")
+            if game_id.startswith("004") and game_id[7:8] == "4" and \
+                    4 in (series.get("HOME_TEAM_WINS"),
+                          series.get("HOME_TEAM_LOSSES")):
+                return True
+    return False
+
+
+class SeasonCalendar(object):
+    """
+    Index of the dates known to have games, or known to have none,
+    persisted as JSON at <path>. A date is known to have no games if a
+    response fetched after the date was over listed no games; a
+    response fetched earlier is not trusted, as games can be
+    rescheduled onto an empty date. The <off_season_days> following a
+    date on which the NBA Finals ended (see finals_over()) are known to
+    have no games as well, up to the next date observed with games.
+    All other dates are unknown and have to be requested.
+    """
+
+    def __init__(self, path: str = SCHEDULE["PATH"],
+                 off_season_days: int = SCHEDULE["OFF_SEASON_DAYS"]):
+        self.path = path
+        self.off_season_days = off_season_days
+        self._lock = Lock()
+        self._days = self._load()
+        self._off_seasons = None
+        self._changed = False
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.debug(f"Starting a new season calendar at: {self.path}")
+            return {}
+
+    def observe(self, day: str, raw: dict, checked: date = None):
+        """
+        Record the number of games in a fetched Scoreboard response.
+        :param day: date string formatted as "%Y/%m/%d"
+        :param raw: raw Scoreboard response
+        :param checked: date the response was fetched on, today unless
+        given
+        """
+        games = game_count(raw)
+        if games is None:
+            return
+        checked = (checked or date.today()).isoformat()
+        key = day.replace("/", "-")
+        observed = {"games": games, "checked": checked}
+        if games and finals_over(raw):
+            observed["finals"] = True
+        with self._lock:
+            known = self._days.get(key)
+            if known is None or known["checked"] <= checked:
+                self._days[key] = observed
+                self._off_seasons = None
+                self._changed = True
+
+    def off_seasons(self) -> list:
+        """
+        :return: list of (first, last) date ranges known to have no
+        games: the <off_season_days> after the end of each NBA Finals
+        observed, cut short by the first later date observed with games
+        :rtype: list
+        """
+        with self._lock:
+            if self._off_seasons is None:
+                game_days = sorted(key for key, known in self._days.items()
+                                   if known["games"])
+                ranges = []
+                for key, known in sorted(self._days.items()):
+                    if not known.get("finals"):
+                        continue
+                    first = date.fromisoformat(key) + timedelta(days=1)
+                    last = first + timedelta(days=self.off_season_days - 1)
+                    later = bisect_right(game_days, key)
+                    if later < len(game_days):
+                        last = min(last, date.fromisoformat(
+                            game_days[later]) - timedelta(days=1))
+                    ranges.append((first, last))
+                self._off_seasons = ranges
+            return self._off_seasons
+
+    def has_games(self, day: str):
+        """
+        :param day: date string formatted as "%Y/%m/%d"
+        :return: True or False if it is known whether the date has
+        games, None if it is not
+        """
+        key = day.replace("/", "-")
+        with self._lock:
+            known = self._days.get(key)
+        if known is not None:
+            if known["games"]:
+                return True
+            if known["checked"] > key:
+                return False
+        as_date = date.fromisoformat(key)
+        if any(first <= as_date <= last
+               for first, last in self.off_seasons()):
+            return False
+        return None
+
+    def days_to_fetch(self, days: list) -> list:
+        """
+        :param days: list of "%Y/%m/%d" date strings
+        :return: the dates not known to have no games, in order
+        :rtype: list
+        """
+        fetch = [day for day in days if self.has_games(day) is not False]
+        if len(fetch) < len(days):
+            logger.info(f"Skipping {len(days) - len(fetch)} of {len(days)} "
+                        f"dates known to have no games.")
+        return fetch
+
+    def learn_from_cache(self, cache: ResponseCache) -> int:
+        """
+        Observe every Scoreboard response held by a response cache, as
+        of the time it was stored.
+        :param cache: ResponseCache to read
+        :return: number of responses observed
+        :rtype: int
+        """
+        learned = 0
+        for key, stored in cache.entries("scoreboardv2/").items():
+            raw = cache.get(key)
+            if raw is not None:
+                self.observe(key[len("scoreboardv2/"):], raw,
+                             checked=date.fromtimestamp(stored))
+                learned += 1
+        logger.info(f"Learned {learned} dates from the cache: {cache.path}")
+        return learned
+
+    def seasons(self) -> dict:
+        """
+        :return: dict of {season: {"game_days": int, "empty_days": int}}
+        over the dates observed so far
+        :rtype: dict
+        """
+        summary = {}
+        with self._lock:
+            days = dict(self._days)
+        for key, known in sorted(days.items()):
+            season = summary.setdefault(season_of(date.fromisoformat(key)),
+                                        Counter())
+            season["game_days" if known["games"] else "empty_days"] += 1
+        return {season: dict(counts) for season, counts in summary.items()}
+
+    def save(self):
+        """
+        Write the calendar to disk, merged with what other processes
+        may have written there in the meantime.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            merged = self._load()
+            for key, known in self._days.items():
+                if key not in merged or \
+                        merged[key]["checked"] <= known["checked"]:
+                    merged[key] = known
+            self._days = merged
+            self._off_seasons = None
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(merged, f, sort_keys=True)
+            os.replace(tmp, self.path)
+            self._changed = False
+        logger.debug(f"Saved the season calendar to: {self.path}")
+
+
+def default_calendar():
+    """
+    Return the shared calendar for the path set in config.py or None if
+    it is not set or the calendar is disabled, in which case every date
+    is requested.
+    :return: SeasonCalendar instance or None
+    """
+    if not SCHEDULE["ENABLED"] or not SCHEDULE["PATH"]:
+        return None
+    path = SCHEDULE["PATH"]
+    if path not in _calendars:
+        _calendars[path] = SeasonCalendar(path=path)
+    return _calendars[path]
+
+
+def main():
+    args = get_argv()
+    calendar = SeasonCalendar(args.get("NBA_CALENDAR", SCHEDULE["PATH"]))
+    calendar.learn_from_cache(ResponseCache(
+        args.get("NBA_CACHE_DIR", CACHE["NBA_CACHE_DIR"])))
+    calendar.save()
+    for season, counts in calendar.seasons().items():
+        logger.info(f"{season}: {counts.get('game_days', 0)} dates with "
+                    f"games, {counts.get('empty_days', 0)} without")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Columnar output for NBA_v2: batch items written as Parquet files,
+partitioned by season and date, next to or instead of the db.
+Author: Maciej Cisowski
+"""
+import os
+import logging.config
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import LOGGING, PARQUET
+from models.monitor import Monitor
+from models.scoreboard import declared_table
+from app.engine import column_value, batch_targets
+from app.schedule import season_of
+from datetime import date, datetime
+from pandas import DataFrame
+from sqlalchemy import Integer, SmallInteger, Float, String, Boolean, \
+    Date, DateTime
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.sink")
+
+# Arrow types of the declared column types, most specific first
+ARROW_TYPES = [(SmallInteger, pa.int16()), (Integer, pa.int64()),
+               (Float, pa.float64()), (Boolean, pa.bool_()),
+               (DateTime, pa.timestamp("ms")), (Date, pa.date32()),
+               (String, pa.string())]
+
+
+def arrow_type(column_type):
+    """
+    :param column_type: SQLAlchemy type of a declared column
+    :return: matching Arrow type, None to let Arrow infer it
+    """
+    impl = getattr(column_type, "impl", column_type)
+    impl = impl() if isinstance(impl, type) else impl
+    for sql_type, arrow in ARROW_TYPES:
+        if isinstance(impl, sql_type):
+            return arrow
+    return None
+
+
+class ParquetSink(object):
+    """
+    Writes batch items as Parquet files under
+    <root>/<table>/season=<season>/date=<date>/, one file per date, so
+    season-wide scans read a few compact columnar files instead of
+    querying the db. Tables declared in models/scoreboard.py keep their
+    declared column types in every partition and string columns named
+    after teams and conferences are dictionary encoded. Writing a date
+    again replaces its file, so reruns do not duplicate rows.
+    """
+
+    FILE = "part-0.parquet"
+
+    def __init__(self, root: str = PARQUET["ROOT"],
+                 compression: str = PARQUET["COMPRESSION"],
+                 dictionary: tuple = PARQUET["DICTIONARY_COLUMNS"]):
+        self.root = root
+        self.compression = compression
+        self.dictionary = dictionary
+
+    def partition(self, table: str, day: date) -> str:
+        """
+        :param table: name of the table the rows belong to
+        :param day: date of the rows
+        :return: directory holding the rows of that table and date
+        :rtype: str
+        """
+        return os.path.join(self.root, table, f"season={season_of(day)}",
+                            f"date={day.isoformat()}")
+
+    def arrow_table(self, table: str, columns: list, rows: list) -> pa.Table:
+        """
+        :param table: name of the table the rows belong to
+        :param columns: column names
+        :param rows: list of row tuples, in column order
+        :return: the rows as an Arrow Table
+        :rtype: pyarrow.Table
+        """
+        declared = declared_table(table)
+        arrays = []
+        for n, name in enumerate(columns):
+            values = [row[n] for row in rows]
+            column = declared.columns.get(name) \
+                if declared is not None else None
+            if column is not None:
+                values = [column_value(column, v) for v in values]
+            array = pa.array(values, from_pandas=True,
+                             type=arrow_type(column.type)
+                             if column is not None else None)
+            if pa.types.is_string(array.type) and \
+                    any(d in name for d in self.dictionary):
+                array = array.dictionary_encode()
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, names=list(columns))
+
+    def write(self, date_item: str, table: str, columns: list,
+              rows: list) -> int:
+        """
+        Write the rows of one date into the table's partition for it,
+        replacing what an earlier run wrote there.
+        :param date_item: date string formatted as "%Y/%m/%d"
+        :param table: name of the table the rows belong to
+        :param columns: column names
+        :param rows: list of row tuples, in column order
+        :return: number of rows written, 0 if the write failed
+        :rtype: int
+        """
+        day = datetime.strptime(date_item, "%Y/%m/%d").date()
+        path = self.partition(table, day)
+        # written next to the target and moved in place; readers skip
+        # hidden files, so they never see a half-written one
+        tmp = os.path.join(path, f".{self.FILE}.{os.getpid()}.tmp")
+        try:
+            data = self.arrow_table(table, columns, rows)
+            os.makedirs(path, exist_ok=True)
+            pq.write_table(data, tmp, compression=self.compression)
+            os.replace(tmp, os.path.join(path, self.FILE))
+        except (OSError, pa.ArrowException):
+            logger.warning(f"Error while writing {table} for {date_item} "
+                           f"to: {path}")
+            return 0
+        logger.debug(f"Wrote {data.num_rows} rows of {table} to: {path}")
+        return data.num_rows
+
+    def write_frame(self, date_item: str, table: str,
+                    data: DataFrame) -> int:
+        """
+        DataFrame counterpart of write(), the index is left out.
+        :param date_item: date string formatted as "%Y/%m/%d"
+        :param table: name of the table the rows belong to
+        :param data: single pandas DataFrame to be written
+        :return: number of rows written, 0 if the write failed
+        :rtype: int
+        """
+        rows = data.astype(object).where(data.notna(), None)\
+            .itertuples(index=False, name=None)
+        return self.write(date_item, table, list(data.columns), list(rows))
+
+    def read(self, table: str, season: str = None,
+             columns: list = None) -> pa.Table:
+        """
+        Read a table back, memory-mapped, for one season or all of them.
+        The partition keys come back as "season" and "date" columns.
+        :param table: name of the table to read
+        :param season: season to read, e.g. "2019-20", None for all
+        :param columns: columns to read, None for all
+        :return: the rows as an Arrow Table, use to_pandas() for a
+        DataFrame
+        :rtype: pyarrow.Table
+        """
+        filters = [("season", "=", season)] if season else None
+        return pq.read_table(os.path.join(self.root, table),
+                             columns=columns, filters=filters,
+                             memory_map=True)
+
+
+def sink_upload(data: dict, batch_def: list, sink: ParquetSink) -> list:
+    """
+    Write the output of merge_line_score() to a sink only, instead of
+    the db. Produces a Monitor per date and entry like batch_upload(),
+    with offsets counting the rows of the date's partition.
+    :param data: Scoreboard data indexed by date, dict
+    :param batch_def: a dict picking the items from Scoreboard that
+    need to be written
+    :param sink: ParquetSink to write to
+    :return: list of Monitor SQLAlchemy objects
+    :rtype: list
+    """
+    targets = batch_targets(batch_def)
+    results = []
+    for date_item, items in data.items():
+        date_object = datetime.strptime(date_item, "%Y/%m/%d").date()
+        for item in items:
+            if item not in targets or items[item].empty:
+                continue
+            size = len(items[item].index)
+            for entry in targets[item]:
+                written = sink.write_frame(date_item, entry["table"],
+                                           items[item])
+                results.append(Monitor(date=date_object,
+                                       item=str(entry["name"]),
+                                       pre_offset=0,
+                                       post_offset=int(written),
+                                       size=int(size),
+                                       success=written == size))
+    return results
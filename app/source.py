@@ -0,0 +1,169 @@
+"""
+Raw Scoreboard requests to NBA.com, without pandas, using the HTTP
+layer of nba-api by Swar Patel (swar): https://github.com/swar/nba_api
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING, CACHE, STATS, THROTTLE, request_header
+from app import metrics
+from app.cache import ResponseCache
+from app.replay import save_fixture
+from app.schedule import SeasonCalendar
+from app.throttle import AdaptiveThrottle, raise_for_status
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from nba_api.stats.library.http import NBAStatsHTTP
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.source")
+
+# Scoreboard items needed by is_empty() and merge_line_score() no
+# matter which items a batch uploads
+MERGE_ITEMS = ("Available", "GameHeader", "LineScore")
+
+
+class RawResponse(dict):
+    """
+    Raw endpoint response that also carries the size in bytes of the
+    response body it was parsed from, so that it is not serialized
+    again only to be measured.
+    """
+
+    def __init__(self, raw: dict, size_bytes: int = None):
+        super().__init__(raw)
+        self.size_bytes = size_bytes
+
+
+def raw_response(response) -> RawResponse:
+    """
+    :param response: nba-api NBAStatsResponse, e.g. the nba_response of
+    an endpoint
+    :return: the parsed response along with the size of its body in
+    UTF-8 bytes, which the decoded text under-reports for non-ASCII
+    names
+    :rtype: RawResponse
+    """
+    body = response.get_response()
+    return RawResponse(response.get_dict(),
+                       len(body.encode("utf-8")) if body is not None
+                       else None)
+
+
+def endpoint_response(endpoint) -> RawResponse:
+    """
+    Send the request of an nba-api endpoint built with get_request=False.
+    Error statuses raise a ResponseError, also when the body could not
+    be parsed, e.g. the HTML page some throttled requests are answered
+    with.
+    :param endpoint: nba-api endpoint, e.g. ScoreboardV2
+    :return: raw endpoint response
+    :rtype: RawResponse
+    """
+    try:
+        endpoint.get_request()
+    except (KeyError, ValueError):
+        raise_for_status(getattr(endpoint, "nba_response", None))
+        raise
+    raise_for_status(endpoint.nba_response)
+    return raw_response(endpoint.nba_response)
+
+
+def date_strings(start_date: date, end_date: date) -> list:
+    """
+    :param start_date: first date of the range
+    :param end_date: last date of the range, inclusive
+    :return: list of "%Y/%m/%d" date strings
+    :rtype: list
+    """
+    return [(start_date + timedelta(days=n)).strftime("%Y/%m/%d")
+            for n in range((end_date - start_date).days + 1)]
+
+
+def scoreboard_max_age(day: str):
+    """
+    Cache lifetime for a Scoreboard day. Box scores for finished
+    dates never change, so only the most recent days (and any future
+    ones) are given a TTL.
+    :param day: date string formatted as "%Y/%m/%d"
+    :return: number of seconds or None if the entry never expires
+    """
+    recent = date.today() - timedelta(days=CACHE["RECENT_DAYS"])
+    if datetime.strptime(day, "%Y/%m/%d").date() >= recent:
+        return CACHE["RECENT_TTL_SECS"]
+    return None
+
+
+def request_scoreboard(day: str, base_url: str = None) -> dict:
+    """
+    Send a single ScoreboardV2 request to NBA.com, or to the stand-in
+    server at NBA_STATS_URL in config.py if that is set. Error statuses
+    raise a ResponseError.
+    :param day: date string formatted as "%Y/%m/%d"
+    :param base_url: url to send the request to instead, e.g.
+    "http://127.0.0.1:8765/stats"
+    :return: raw endpoint response
+    :rtype: RawResponse
+    """
+    logger.debug(f"Getting scoreboard data for date: {day}")
+    http = NBAStatsHTTP()
+    base_url = base_url or STATS["NBA_STATS_URL"]
+    if base_url:
+        http.base_url = base_url.rstrip("/") + "/{endpoint}"
+    response = http.send_api_request(
+        endpoint="scoreboardv2",
+        parameters={"DayOffset": 0, "GameDate": day, "LeagueID": "00"},
+        headers=request_header,
+        timeout=THROTTLE["REQUEST_TIMEOUT_SECS"])
+    raise_for_status(response)
+    return raw_response(response)
+
+
+def cached_scoreboard_json(day: str, cache: ResponseCache = None,
+                           throttle=None, request=None,
+                           adaptive: AdaptiveThrottle = None,
+                           calendar: SeasonCalendar = None) -> dict:
+    """
+    Get the raw Scoreboard JSON for a single day, from the response
+    cache if it holds a fresh copy or from NBA.com otherwise.
+    :param day: date string formatted as "%Y/%m/%d"
+    :param cache: ResponseCache to consult and fill, None skips caching
+    :param throttle: optional callable invoked right before a request
+    is actually sent to NBA.com
+    :param request: callable sending the request for a day, defaults
+    to request_scoreboard(); with NBA_RECORD_DIR set in config.py its
+    responses are saved as replay fixtures
+    :param adaptive: AdaptiveThrottle pacing and retrying the request,
+    used instead of <throttle>
+    :param calendar: SeasonCalendar to record the games of a response
+    fetched from NBA.com in
+    :return: raw endpoint response
+    :rtype: dict
+    """
+    key = f"scoreboardv2/{day}"
+    if cache is not None:
+        t1 = perf_counter()
+        raw = cache.get(key, max_age=scoreboard_max_age(day))
+        if raw is not None:
+            metrics.record("cache", perf_counter() - t1, day=day)
+            return raw
+    if adaptive is not None:
+        raw, retries, latency = adaptive.call(request or request_scoreboard,
+                                              day)
+    else:
+        if throttle is not None:
+            throttle()
+        t1 = perf_counter()
+        raw = (request or request_scoreboard)(day)
+        retries, latency = 0, perf_counter() - t1
+    metrics.record("fetch", latency, day=day,
+                   size_bytes=getattr(raw, "size_bytes", None),
+                   retries=retries)
+    if cache is not None:
+        cache.put(key, raw)
+    if calendar is not None:
+        calendar.observe(day, raw)
+    if STATS["NBA_RECORD_DIR"]:
+        save_fixture(STATS["NBA_RECORD_DIR"], day, raw)
+    return raw
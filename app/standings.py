@@ -0,0 +1,54 @@
+"""
+Point-in-time queries on the conference standings history tables.
+Author: Maciej Cisowski
+"""
+import logging.config
+from config import LOGGING
+from models.scoreboard import declared_table
+from datetime import date
+from sqlalchemy import select, func
+from sqlalchemy.engine import Engine
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.standings")
+
+
+def snapshot_date(db: Engine, table: str, day: date = None) -> date:
+    """
+    :param db: SQLAlchemy engine of the data db
+    :param table: name of a standings history table
+    :param day: date the standings are wanted for, None for the latest
+    :return: date of the last snapshot taken on or before <day>, None
+    if there is none
+    :rtype: date
+    """
+    history = declared_table(table)
+    query = select([func.max(history.c.STANDINGSDATE)])
+    if day is not None:
+        query = query.where(history.c.STANDINGSDATE <= day)
+    return db.execute(query).scalar()
+
+
+def standings_as_of(db: Engine, table: str, day: date = None) -> list:
+    """
+    Conference standings as they were on a date, read from a history
+    table instead of requesting that date from NBA.com again. Days
+    without a snapshot get the last one before them.
+    :param db: SQLAlchemy engine of the data db
+    :param table: name of a standings history table, e.g.
+    "east_conference_standings_history"
+    :param day: date the standings are wanted for, None for the latest
+    :return: list of rows, best record first
+    :rtype: list
+    """
+    history = declared_table(table)
+    taken = snapshot_date(db, table, day)
+    if taken is None:
+        logger.info(f"No standings in table {table} up to {day}.")
+        return []
+    return db.execute(select([history])
+                      .where(history.c.STANDINGSDATE == taken)
+                      .order_by(history.c.W_PCT.desc(),
+                                history.c.TEAM_ID)).fetchall()
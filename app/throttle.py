@@ -0,0 +1,302 @@
+"""
+Adaptive throttling of NBA.com requests: an AIMD rate limiter, retries
+with exponential backoff and a circuit breaker shared by all workers.
+Author: Maciej Cisowski
+"""
+import random
+import socket
+import logging.config
+import requests
+from config import LOGGING, THROTTLE
+from app.common import RateLimiter
+from threading import Condition, Lock
+from time import monotonic, sleep
+
+
+# create logger for this module and configure it
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger("nba_v2.throttle")
+
+
+class ResponseError(Exception):
+    """
+    Raised for a response with an error status, e.g. a 429 or a 503.
+    """
+
+    def __init__(self, status: int, url: str = None):
+        super().__init__(f"HTTP {status} from: {url}")
+        self.status = status
+
+
+def raise_for_status(response):
+    """
+    Raise a ResponseError if a response has an error status.
+    :param response: nba-api NBAStatsResponse, e.g. the nba_response of
+    an endpoint
+    """
+    # nba-api keeps the status but has no accessor for it
+    status = getattr(response, "_status_code", None)
+    if status is not None and status >= 400:
+        raise ResponseError(status, response.get_url())
+
+
+def failure_kind(error: Exception) -> str:
+    """
+    Tell apart the failures worth retrying: throttling, server errors,
+    timeouts, dropped connections and malformed bodies (stats.nba.com
+    answers some throttled requests with an HTML page). The status of
+    a ResponseError or of the response of a requests HTTPError tells
+    throttling and server errors apart.
+    :param error: exception raised by a request
+    :return: "throttled", "server", "timeout", "connection" or
+    "malformed", None if the request should not be retried
+    :rtype: str
+    """
+    status = None
+    if isinstance(error, ResponseError):
+        status = error.status
+    elif isinstance(error, requests.exceptions.HTTPError):
+        status = getattr(error.response, "status_code", None)
+    if status is not None:
+        if status == 429:
+            return "throttled"
+        return "server" if status >= 500 else None
+    if isinstance(error, (requests.exceptions.Timeout, socket.timeout)):
+        return "timeout"
+    if isinstance(error, (requests.exceptions.ConnectionError,
+                          ConnectionError)):
+        return "connection"
+    if isinstance(error, (KeyError, ValueError)):
+        return "malformed"
+    return None
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    RateLimiter whose rate follows the server: additive increase by
+    <increase> requests per second after each answer within
+    <target_latency> seconds, multiplicative decrease by <decrease> on
+    slow answers and failures. The rate stays within <min_rate> and
+    <max_rate>. Without a <rate> calls are not spaced out until the
+    first decrease, which starts from <fallback_rate>.
+    """
+
+    def __init__(self, rate: float = None, max_rate: float = None,
+                 min_rate: float = THROTTLE["MIN_RPS"],
+                 increase: float = THROTTLE["INCREASE_RPS"],
+                 decrease: float = THROTTLE["DECREASE_FACTOR"],
+                 target_latency: float = THROTTLE["TARGET_LATENCY_SECS"],
+                 fallback_rate: float = THROTTLE["FALLBACK_RPS"]):
+        if rate and max_rate:
+            rate = min(rate, max_rate)
+        super().__init__(rate)
+        self.rate = rate or None
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.fallback_rate = fallback_rate
+
+    def _set_rate(self, rate: float):
+        # called with the lock held
+        self.rate = rate
+        self.interval = 1.0 / rate
+
+    def on_success(self, latency: float) -> float:
+        """
+        :param latency: seconds the request took
+        :return: the new rate, None if unlimited
+        :rtype: float
+        """
+        if latency > self.target_latency:
+            return self.on_failure()
+        with self._lock:
+            if self.rate is not None:
+                rate = self.rate + self.increase
+                self._set_rate(min(rate, self.max_rate)
+                               if self.max_rate else rate)
+            return self.rate
+
+    def on_failure(self) -> float:
+        """
+        :return: the new rate
+        :rtype: float
+        """
+        with self._lock:
+            rate = (self.rate or self.fallback_rate) * self.decrease
+            self._set_rate(max(rate, self.min_rate))
+            logger.debug(f"Backing off to {self.rate:.3f} requests per sec")
+            return self.rate
+
+
+def adaptive_limiter(max_rps: float = None) -> AdaptiveRateLimiter:
+    """
+    :param max_rps: hard cap of the rate, None for no cap
+    :return: AdaptiveRateLimiter starting at START_FACTOR in config.py
+    times <max_rps>, so that it can grow up to <max_rps> while the
+    server keeps up
+    :rtype: AdaptiveRateLimiter
+    """
+    if not max_rps:
+        return AdaptiveRateLimiter()
+    return AdaptiveRateLimiter(rate=THROTTLE["START_FACTOR"] * max_rps,
+                               max_rate=max_rps)
+
+
+class CircuitBreaker(object):
+    """
+    Stops all workers once <threshold> requests failed in a row, e.g.
+    during an outage: wait() blocks until <cooldown> seconds after the
+    last trip. The breaker is then half-open: a single caller of wait()
+    is let through as a probe while the others keep waiting. The probe
+    closes the breaker if it succeeds and trips it again if it fails;
+    release() lets the next caller probe instead, e.g. after an error
+    that says nothing about the server.
+    """
+
+    def __init__(self, threshold: int = THROTTLE["BREAKER_FAILURES"],
+                 cooldown: float = THROTTLE["BREAKER_COOLDOWN_SECS"]):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.trips = 0
+        self._open_until = 0.0
+        self._half_open = False
+        self._probing = False
+        self._lock = Condition()
+
+    @property
+    def is_open(self) -> bool:
+        return monotonic() < self._open_until
+
+    def _trip(self):
+        # called with the lock held
+        self._open_until = monotonic() + self.cooldown
+        self._half_open = True
+        self._probing = False
+        self.trips += 1
+        self._lock.notify_all()
+
+    def wait(self) -> float:
+        """
+        Block while the breaker is open, or while another caller is
+        probing the half-open breaker.
+        :return: number of seconds spent waiting
+        :rtype: float
+        """
+        t1 = monotonic()
+        with self._lock:
+            while True:
+                delay = self._open_until - monotonic()
+                if delay > 0:
+                    self._lock.wait(delay)
+                elif self._probing:
+                    self._lock.wait()
+                else:
+                    # the first caller after the cooldown probes
+                    self._probing = self._half_open
+                    return monotonic() - t1
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            if self._half_open:
+                self._half_open = False
+                self._probing = False
+                self._lock.notify_all()
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing:
+                logger.warning(f"Probe request failed, pausing all requests "
+                               f"for another {self.cooldown} secs")
+                self._trip()
+            elif self.failures >= self.threshold and not self._half_open:
+                logger.warning(f"{self.failures} requests failed in a row, "
+                               f"pausing all requests for {self.cooldown} "
+                               f"secs")
+                self._trip()
+
+    def release(self):
+        """
+        Let the next waiting caller probe the half-open breaker.
+        """
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._lock.notify()
+
+
+class AdaptiveThrottle(object):
+    """
+    Paces, retries and guards the requests of a run: every attempt
+    waits for the circuit breaker and the adaptive rate limiter, and
+    failures worth retrying (see failure_kind()) are retried up to
+    <max_retries> times after a full-jitter exponential backoff of up
+    to <backoff_base> * 2 ** attempt seconds, capped at <backoff_max>.
+    Share one instance between all workers of a run.
+    """
+
+    def __init__(self, limiter: AdaptiveRateLimiter = None,
+                 breaker: CircuitBreaker = None,
+                 max_retries: int = THROTTLE["MAX_RETRIES"],
+                 backoff_base: float = THROTTLE["BACKOFF_BASE_SECS"],
+                 backoff_max: float = THROTTLE["BACKOFF_MAX_SECS"],
+                 seed: int = None):
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    def backoff(self, attempt: int) -> float:
+        """
+        :param attempt: number of the failed attempt, starting at 0
+        :return: seconds to wait before the next attempt
+        :rtype: float
+        """
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        with self._lock:
+            return self._random.uniform(0, ceiling)
+
+    def call(self, request, day: str) -> tuple:
+        """
+        :param request: callable sending the request for a day
+        :param day: date string formatted as "%Y/%m/%d"
+        :return: tuple of the response, the number of retries it took
+        and the seconds the successful attempt took
+        :rtype: tuple
+        """
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            self.limiter.wait()
+            t1 = monotonic()
+            try:
+                raw = request(day)
+            except Exception as error:
+                kind = failure_kind(error)
+                if kind is None:
+                    self.breaker.release()
+                    raise
+                self.limiter.on_failure()
+                self.breaker.on_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"Request for {day} failed ({kind}: {error}), "
+                               f"retry {attempt + 1} in {delay:.1f} secs")
+                sleep(delay)
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                continue
+            latency = monotonic() - t1
+            self.limiter.on_success(latency)
+            self.breaker.on_success()
+            return raw, attempt, latency
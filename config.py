@@ -2,6 +2,7 @@
 Configuration dicts for the NBA_v2 app
 Author: Maciej Cisowski
 """
+import os
 from enum import Enum
 
 
@@ -12,6 +13,139 @@ NBA_APP_NAME = "NBA"
 TIMEOUT_INTERVAL = 15
 TIMEOUT_SECS = 180
 
+# concurrent fetch defaults; FETCH_MAX_RPS is the ceiling of the
+# request rate across all workers
+FETCH_WORKERS = 1
+FETCH_MAX_RPS = 1.0
+
+# adaptive throttle (see app/throttle.py): the request rate starts at
+# START_FACTOR times the max rps, is multiplied by DECREASE_FACTOR on
+# a slow answer, 429, 5xx or timeout and grows by INCREASE_RPS after
+# every request answered within TARGET_LATENCY_SECS, up to the max
+# rps, which is a hard cap it never probes above. Without a max rps
+# requests are not spaced out until the first failure, which drops the
+# rate to FALLBACK_RPS. Retries go up to
+# MAX_RETRIES times with exponential, jittered backoff. After
+# BREAKER_FAILURES failures in a row all workers pause for
+# BREAKER_COOLDOWN_SECS. With ADAPTIVE off nothing is retried and
+# requests are paced by the fixed TIMEOUT_INTERVAL and TIMEOUT_SECS
+# sleeps (one worker) or by FETCH_MAX_RPS (more workers).
+THROTTLE = {
+    "ADAPTIVE": True,
+    "START_FACTOR": 0.5,
+    "FALLBACK_RPS": 0.5,
+    "MIN_RPS": 0.02,
+    "INCREASE_RPS": 0.05,
+    "DECREASE_FACTOR": 0.5,
+    "TARGET_LATENCY_SECS": 3.0,
+    "MAX_RETRIES": 5,
+    "BACKOFF_BASE_SECS": 2.0,
+    "BACKOFF_MAX_SECS": 120.0,
+    "BREAKER_FAILURES": 5,
+    "BREAKER_COOLDOWN_SECS": 300.0,
+    "REQUEST_TIMEOUT_SECS": 300
+}
+
+# incremental runs without explicit dates look back this many days
+# from yesterday for anything that was not committed yet
+INCREMENTAL_LOOKBACK_DAYS = 7
+
+# staged pipeline defaults: days buffered between stages and the
+# interval between progress reports
+PIPELINE = {
+    "QUEUE_SIZE": 8,
+    "REPORT_SECS": 30
+}
+
+# backfill defaults (see app/backfill.py): where the checkpoints and
+# chunk claims are kept, days per chunk, worker processes and the time
+# without a heartbeat (claims are touched after every fetched day)
+# after which a claim of a process on another host is taken over
+BACKFILL = {
+    "DIR": "./.nba_backfill",
+    "CHUNK_DAYS": 30,
+    "PROCESSES": 1,
+    "STALE_CLAIM_SECS": 60 * 60
+}
+
+# per-user directory for cached responses and the season calendar,
+# outside the working tree
+NBA_USER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"),
+                                                     ".cache"),
+    "nba_v2")
+
+# on-disk cache of raw responses; dates older than RECENT_DAYS never
+# expire, more recent ones are refetched after RECENT_TTL_SECS
+CACHE = {
+    "ENABLED": True,
+    "NBA_CACHE_DIR": os.path.join(NBA_USER_CACHE_DIR, "responses"),
+    "MAX_BYTES": 512 * 1024 * 1024,
+    "COMPRESS": True,
+    "RECENT_DAYS": 1,
+    "RECENT_TTL_SECS": 900
+}
+
+# season calendar (see app/schedule.py): whether it is used, where the
+# index of dates with games is kept, whether dates known to have none
+# are skipped, and how many days after the NBA Finals are known to have
+# no games (the shortest off-season so far, in 2020, lasted two months)
+SCHEDULE = {
+    "ENABLED": True,
+    "PATH": os.path.join(NBA_USER_CACHE_DIR, "calendar.json"),
+    "SKIP_EMPTY": True,
+    "OFF_SEASON_DAYS": 60
+}
+
+# per-game box scores (see app/boxscore.py): the items a batch can ask
+# for, with the BoxScoreTraditionalV2 result set each one is built
+# from, and the number of games requested at once; box score requests
+# share the response cache and the throttle of the Scoreboard requests
+BOXSCORE = {
+    "ITEMS": {
+        "BoxScorePlayerStats": "PlayerStats",
+        "BoxScoreTeamStats": "TeamStats"
+    },
+    "WORKERS": 8
+}
+
+# where Scoreboard requests go: NBA.com itself unless NBA_STATS_URL is
+# set, e.g. to the app/replay.py server; with NBA_RECORD_DIR set every
+# response fetched is also saved there as a replay fixture
+STATS = {
+    "NBA_STATS_URL": None,
+    "NBA_RECORD_DIR": None
+}
+
+# replay server defaults: fixtures served, address, added latency and
+# the share of requests answered with a 429 or left hanging
+REPLAY = {
+    "FIXTURES_DIR": "./.nba_fixtures",
+    "HOST": "127.0.0.1",
+    "PORT": 8765,
+    "LATENCY_SECS": 0.0,
+    "JITTER_SECS": 0.0,
+    "ERROR_RATE": 0.0,
+    "TIMEOUT_RATE": 0.0,
+    "HANG_SECS": 30
+}
+
+# Parquet sink defaults: root directory of the datasets, compression
+# and the string columns (by name fragment) stored dictionary encoded
+PARQUET = {
+    "ROOT": "./.nba_parquet",
+    "COMPRESSION": "snappy",
+    "DICTIONARY_COLUMNS": ("TEAM", "CONFERENCE")
+}
+
+# per-stage run metrics (see app/metrics.py), kept in the run_metrics
+# table of the monitor db; with PROM_FILE set they are also written
+# there for node-exporter's textfile collector
+METRICS = {
+    "ENABLED": True,
+    "PROM_FILE": None
+}
+
 # logger config
 LOGGING = {
     "version": 1,
@@ -62,37 +196,97 @@ class DbActions(Enum):
     FAIL = "fail"
     REPLACE = "replace"
     APPEND = "append"
+    UPSERT = "upsert"
+    DELTA = "delta"
+
+
+# bulk upload defaults: rows per multi-row INSERT, the cap on bound
+# parameters per statement on SQLite and whether to use COPY on Postgres
+BULK = {
+    "CHUNKSIZE": 1000,
+    "SQLITE_MAX_VARIABLES": 999,
+    "POSTGRES_COPY": True
+}
+
+
+# SQLAlchemy engine defaults, shared by every engine in the registry
+ENGINE = {
+    "ECHO": False,
+    "POOL_SIZE": 5,
+    "MAX_OVERFLOW": 10,
+    "POOL_PRE_PING": True,
+    "POOL_RECYCLE": 1800
+}
 
 
 # default values for the db config; overwrite with same-named env vars for secrets
 DB = {
     "NBA_DB_URL": 'sqlite://',
     "NBA_MONITOR_DB_URL": "sqlite://",
+    # "action" is how an item is written by pandas' to_sql() and by
+    # older versions; "keyed_action" takes its place on tables that
+    # have the keys of their declared schema, see write_action() in
+    # app/engine.py
     "NBA_DB_MAPPING": {
         "line_score": {
             "name": "mergedLineScore",
             "table": "line_score",
             "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
         },
         "series_standings": {
             "name": "SeriesStandings",
             "table": "series_standings",
-            "action": DbActions.APPEND
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
         },
         "west_conference_standings_by_day": {
             "name": "WestConfStandingsByDay",
             "table": "west_conference_standings_by_day",
-            "action": DbActions.REPLACE
+            "action": DbActions.REPLACE,
+            "keyed_action": DbActions.DELTA
         },
         "east_conference_standings_by_day": {
             "name": "EastConfStandingsByDay",
             "table": "east_conference_standings_by_day",
-            "action": DbActions.REPLACE
+            "action": DbActions.REPLACE,
+            "keyed_action": DbActions.DELTA
+        },
+        # history tables keep every daily snapshot of the item named
+        # in "source", under their own item name in the monitor db
+        "west_conference_standings_history": {
+            "name": "WestConfStandingsHistory",
+            "source": "WestConfStandingsByDay",
+            "table": "west_conference_standings_history",
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
+        },
+        "east_conference_standings_history": {
+            "name": "EastConfStandingsHistory",
+            "source": "EastConfStandingsByDay",
+            "table": "east_conference_standings_history",
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
         },
         "last_meeting": {
             "name": "LastMeeting",
             "table": "last_meeting",
-            "action": DbActions.APPEND
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
+        },
+        # per-game items fetched by app/boxscore.py for every GAME_ID
+        # of a day's GameHeader, see BOXSCORE
+        "boxscore_player_stats": {
+            "name": "BoxScorePlayerStats",
+            "table": "boxscore_player_stats",
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
+        },
+        "boxscore_team_stats": {
+            "name": "BoxScoreTeamStats",
+            "table": "boxscore_team_stats",
+            "action": DbActions.APPEND,
+            "keyed_action": DbActions.UPSERT
         },
         "monitor": {
             "name": "monitor",
@@ -108,5 +302,21 @@ BATCHES = {
                 DB["NBA_DB_MAPPING"]["series_standings"],
                 DB["NBA_DB_MAPPING"]["last_meeting"],
                 DB["NBA_DB_MAPPING"]["west_conference_standings_by_day"],
-                DB["NBA_DB_MAPPING"]["east_conference_standings_by_day"]]
+                DB["NBA_DB_MAPPING"]["east_conference_standings_by_day"]],
+    # default batch plus the standings history tables
+    "history": [DB["NBA_DB_MAPPING"]["line_score"],
+                DB["NBA_DB_MAPPING"]["series_standings"],
+                DB["NBA_DB_MAPPING"]["last_meeting"],
+                DB["NBA_DB_MAPPING"]["west_conference_standings_by_day"],
+                DB["NBA_DB_MAPPING"]["east_conference_standings_by_day"],
+                DB["NBA_DB_MAPPING"]["west_conference_standings_history"],
+                DB["NBA_DB_MAPPING"]["east_conference_standings_history"]],
+    # default batch plus the box scores of every game
+    "boxscore": [DB["NBA_DB_MAPPING"]["line_score"],
+                 DB["NBA_DB_MAPPING"]["series_standings"],
+                 DB["NBA_DB_MAPPING"]["last_meeting"],
+                 DB["NBA_DB_MAPPING"]["west_conference_standings_by_day"],
+                 DB["NBA_DB_MAPPING"]["east_conference_standings_by_day"],
+                 DB["NBA_DB_MAPPING"]["boxscore_player_stats"],
+                 DB["NBA_DB_MAPPING"]["boxscore_team_stats"]]
 }
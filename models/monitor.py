@@ -1,5 +1,5 @@
 # coding: utf-8
-from sqlalchemy import Column, Date, Integer, String, Boolean
+from sqlalchemy import Column, Date, Integer, String, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -17,3 +17,18 @@ class Monitor(Base):
     post_offset = Column(Integer)
     size = Column(Integer)
     success = Column(Boolean)
+
+
+class RunMetric(Base):
+    __tablename__ = 'run_metrics'
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(32), index=True)
+    stage = Column(String(16))
+    date = Column(Date, index=True)
+    item = Column(String)
+    secs = Column(Float)
+    rows = Column(Integer)
+    size_bytes = Column(Integer)
+    retries = Column(Integer)
+    rows_per_sec = Column(Float)
@@ -0,0 +1,223 @@
+# coding: utf-8
+from datetime import date, datetime
+from sqlalchemy import Column, Index, Integer, SmallInteger, Float, String, \
+    Date, DateTime
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.ext.declarative import declarative_base
+
+
+Base = declarative_base()
+metadata = Base.metadata
+
+
+class GameDateTime(TypeDecorator):
+    """
+    DateTime accepting the "2019-12-01T00:00:00" strings NBA.com sends.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+
+class StandingsDate(TypeDecorator):
+    """
+    Date accepting the "12/01/2019" strings of the standings items as
+    well as ISO formatted ones.
+    """
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            if "/" in value:
+                return datetime.strptime(value, "%m/%d/%Y").date()
+            return date.fromisoformat(value[:10])
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
+
+# LineScore columns of a single team and their types
+_TEAM_LINE = [("GAME_DATE_EST", GameDateTime), ("GAME_ID", String(10)),
+              ("TEAM_ID", Integer), ("TEAM_ABBREVIATION", String(5)),
+              ("TEAM_CITY_NAME", String(32)), ("TEAM_NAME", String(32)),
+              ("TEAM_WINS_LOSSES", String(8))] + \
+             [(f"PTS_QTR{n}", SmallInteger) for n in range(1, 5)] + \
+             [(f"PTS_OT{n}", SmallInteger) for n in range(1, 11)] + \
+             [("PTS", SmallInteger), ("FG_PCT", Float), ("FT_PCT", Float),
+              ("FG3_PCT", Float), ("AST", SmallInteger),
+              ("REB", SmallInteger), ("TOV", SmallInteger)]
+
+
+def _line_score_columns() -> dict:
+    # same layout as merge_line_score(): the away columns with
+    # GAME_SEQUENCE in second place, followed by the home columns
+    columns = {}
+    for side in ("away", "home"):
+        for name, column_type in _TEAM_LINE:
+            columns[f"{name}_{side}"] = Column(
+                column_type, primary_key=(name, side) == ("GAME_ID", "away"))
+            if (name, side) == ("GAME_DATE_EST", "away"):
+                columns["GAME_SEQUENCE"] = Column(SmallInteger)
+    return columns
+
+
+LineScore = type("LineScore", (Base,), {
+    "__tablename__": "line_score",
+    "__table_args__": (
+        Index("ix_line_score_GAME_DATE_EST_away", "GAME_DATE_EST_away"),
+        Index("ix_line_score_GAME_ID_home", "GAME_ID_home"),
+        Index("ix_line_score_TEAM_ID_away", "TEAM_ID_away"),
+        Index("ix_line_score_TEAM_ID_home", "TEAM_ID_home"),
+    ),
+    **_line_score_columns()
+})
+
+
+class SeriesStandings(Base):
+    __tablename__ = 'series_standings'
+
+    GAME_ID = Column(String(10), primary_key=True)
+    HOME_TEAM_ID = Column(Integer, index=True)
+    VISITOR_TEAM_ID = Column(Integer, index=True)
+    GAME_DATE_EST = Column(GameDateTime, index=True)
+    HOME_TEAM_WINS = Column(SmallInteger)
+    HOME_TEAM_LOSSES = Column(SmallInteger)
+    SERIES_LEADER = Column(String(32))
+
+
+class LastMeeting(Base):
+    __tablename__ = 'last_meeting'
+
+    GAME_ID = Column(String(10), primary_key=True)
+    LAST_GAME_ID = Column(String(10))
+    LAST_GAME_DATE_EST = Column(GameDateTime)
+    LAST_GAME_HOME_TEAM_ID = Column(Integer, index=True)
+    LAST_GAME_HOME_TEAM_CITY = Column(String(32))
+    LAST_GAME_HOME_TEAM_NAME = Column(String(32))
+    LAST_GAME_HOME_TEAM_ABBREVIATION = Column(String(5))
+    LAST_GAME_HOME_TEAM_POINTS = Column(SmallInteger)
+    LAST_GAME_VISITOR_TEAM_ID = Column(Integer, index=True)
+    LAST_GAME_VISITOR_TEAM_CITY = Column(String(32))
+    LAST_GAME_VISITOR_TEAM_NAME = Column(String(32))
+    LAST_GAME_VISITOR_TEAM_CITY1 = Column(String(5))
+    LAST_GAME_VISITOR_TEAM_POINTS = Column(SmallInteger)
+
+
+class _ConferenceStandings(object):
+    TEAM_ID = Column(Integer, primary_key=True)
+    LEAGUE_ID = Column(String(2))
+    SEASON_ID = Column(String(5))
+    STANDINGSDATE = Column(StandingsDate, index=True)
+    CONFERENCE = Column(String(4))
+    TEAM = Column(String(32))
+    G = Column(SmallInteger)
+    W = Column(SmallInteger)
+    L = Column(SmallInteger)
+    W_PCT = Column(Float)
+    HOME_RECORD = Column(String(8))
+    ROAD_RECORD = Column(String(8))
+    RETURNTOPLAY = Column(SmallInteger)
+
+
+class EastConferenceStandingsByDay(_ConferenceStandings, Base):
+    __tablename__ = 'east_conference_standings_by_day'
+
+
+class WestConferenceStandingsByDay(_ConferenceStandings, Base):
+    __tablename__ = 'west_conference_standings_by_day'
+
+
+class _ConferenceStandingsHistory(object):
+    # one snapshot per date; the date leads the key, so point-in-time
+    # lookups are range scans of the primary key index
+    STANDINGSDATE = Column(StandingsDate, primary_key=True)
+    TEAM_ID = Column(Integer, primary_key=True, index=True)
+    LEAGUE_ID = Column(String(2))
+    SEASON_ID = Column(String(5))
+    CONFERENCE = Column(String(4))
+    TEAM = Column(String(32))
+    G = Column(SmallInteger)
+    W = Column(SmallInteger)
+    L = Column(SmallInteger)
+    W_PCT = Column(Float)
+    HOME_RECORD = Column(String(8))
+    ROAD_RECORD = Column(String(8))
+    RETURNTOPLAY = Column(SmallInteger)
+
+
+class EastConferenceStandingsHistory(_ConferenceStandingsHistory, Base):
+    __tablename__ = 'east_conference_standings_history'
+
+
+class WestConferenceStandingsHistory(_ConferenceStandingsHistory, Base):
+    __tablename__ = 'west_conference_standings_history'
+
+
+# box score counting stats shared by the player and team rows of
+# BoxScoreTraditionalV2, see app/boxscore.py
+_BOX_SCORE_STATS = [("MIN", String(16)), ("FGM", SmallInteger),
+                    ("FGA", SmallInteger), ("FG_PCT", Float),
+                    ("FG3M", SmallInteger), ("FG3A", SmallInteger),
+                    ("FG3_PCT", Float), ("FTM", SmallInteger),
+                    ("FTA", SmallInteger), ("FT_PCT", Float),
+                    ("OREB", SmallInteger), ("DREB", SmallInteger),
+                    ("REB", SmallInteger), ("AST", SmallInteger),
+                    ("STL", SmallInteger), ("BLK", SmallInteger),
+                    ("TO", SmallInteger), ("PF", SmallInteger),
+                    ("PTS", SmallInteger), ("PLUS_MINUS", Float)]
+
+BoxScorePlayerStats = type("BoxScorePlayerStats", (Base,), {
+    "__tablename__": "boxscore_player_stats",
+    "GAME_ID": Column(String(10), primary_key=True),
+    "PLAYER_ID": Column(Integer, primary_key=True, index=True),
+    "TEAM_ID": Column(Integer, index=True),
+    "TEAM_ABBREVIATION": Column(String(5)),
+    "TEAM_CITY": Column(String(32)),
+    "PLAYER_NAME": Column(String(64)),
+    "START_POSITION": Column(String(2)),
+    "COMMENT": Column(String(64)),
+    **{name: Column(column_type) for name, column_type in _BOX_SCORE_STATS}
+})
+
+BoxScoreTeamStats = type("BoxScoreTeamStats", (Base,), {
+    "__tablename__": "boxscore_team_stats",
+    "GAME_ID": Column(String(10), primary_key=True),
+    "TEAM_ID": Column(Integer, primary_key=True, index=True),
+    "TEAM_NAME": Column(String(32)),
+    "TEAM_ABBREVIATION": Column(String(5)),
+    "TEAM_CITY": Column(String(32)),
+    **{name: Column(column_type) for name, column_type in _BOX_SCORE_STATS}
+})
+
+
+def declared_table(name: str):
+    """
+    :param name: name of a db table
+    :return: the declared SQLAlchemy Table of that name or None
+    """
+    return metadata.tables.get(name)
+
+
+def coerce_value(column_type, value):
+    """
+    Cast a value read from a DataFrame or an older, type-inferred table
+    to the Python type a declared column expects, e.g. 12.0 or "12" to
+    12 for integer columns. Dates are left to the column types.
+    :param column_type: SQLAlchemy type of the target column
+    :param value: value to cast
+    :return: the cast value, None for missing ones
+    """
+    if value is None or value != value:
+        return None
+    if isinstance(column_type, Integer):
+        return int(float(value))
+    if isinstance(column_type, Float):
+        return float(value)
+    if isinstance(column_type, String):
+        return str(value)
+    return value
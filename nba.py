@@ -6,11 +6,21 @@ Author: Maciej Cisowski
 """
 import config
 import logging.config
-from datetime import date
-from app.common import update_config_with_env_vars, get_argv
-from app.collect import fetch_scoreboard_data
-from app.data import merge_line_score
-from app.commit import batch_upload, start_engine, post_monitor_data
+from datetime import date, timedelta
+from app import metrics
+from app.common import update_config_with_env_vars, get_argv, \
+    update_stats_config, is_flag_set
+from app.collect import fetch_scoreboard_data, iter_scoreboard_data, \
+    batch_items
+from app.data import merge_line_score, stream_merge_line_score, \
+    drop_committed_items
+from app.commit import batch_upload, start_engine, post_monitor_batch, \
+    stream_upload, bulk_upload, dispose_engines, plan_incremental, \
+    committed_games
+from app.pipeline import run_pipeline
+from app.migrate import migrate_all, legacy_tables
+from app.sink import ParquetSink, sink_upload
+from app.backfill import Backfill, run_backfill
 
 
 # set up logger using config
@@ -24,37 +34,117 @@ def main():
     env_vars = update_config_with_env_vars()
     logger.debug("Getting runtime parameters...")
     args = get_argv()
-    start = False
-    end = False
-    if "NBA_STARTDATE" in args:
-        start = date.fromisoformat(args["NBA_STARTDATE"])
-    if "NBA_ENDDATE" in args:
-        end = date.fromisoformat(args["NBA_ENDDATE"])
-    logger.info("Getting data...")
-    if start and end:
-        logger.info(f"Using provided start: {start} "
-                    f"and end {end} dates.")
-        data = merge_line_score(
-            fetch_scoreboard_data(
-                start_date=start,
-                end_date=end
-            )
-        )
+    update_stats_config(args, env_vars)
+    if config.METRICS["ENABLED"]:
+        metrics.start_run()
+    batch_def = config.BATCHES[args.get("NBA_BATCH", "default")]
+    fetch_args = {
+        "workers": int(args.get("NBA_WORKERS", config.FETCH_WORKERS)),
+        "max_rps": float(args.get("NBA_MAX_RPS", config.FETCH_MAX_RPS)),
+        "items": batch_items(batch_def),
+        "skip_empty": not is_flag_set(args, "NBA_FULL_SCAN")
+    }
+    if "NBA_STARTDATE" in args and "NBA_ENDDATE" in args:
+        fetch_args["start_date"] = date.fromisoformat(args["NBA_STARTDATE"])
+        fetch_args["end_date"] = date.fromisoformat(args["NBA_ENDDATE"])
+        logger.info(f"Using provided start: {fetch_args['start_date']} "
+                    f"and end {fetch_args['end_date']} dates.")
+    elif is_flag_set(args, "NBA_INCREMENTAL"):
+        yesterday = date.today() - timedelta(days=1)
+        fetch_args["start_date"] = yesterday - timedelta(
+            days=config.INCREMENTAL_LOOKBACK_DAYS - 1)
+        fetch_args["end_date"] = yesterday
+        logger.info(f"Looking back {config.INCREMENTAL_LOOKBACK_DAYS} days "
+                    f"from yesterday.")
     else:
         logger.info("Defaulting to yesterday as start and end date.")
-        data = merge_line_score(
-            fetch_scoreboard_data()
-        )
-    logger.info("Retrieved data.")
-    logger.info(f"Pushing data to db at: {env_vars['NBA_DB_URL']}")
-    results = batch_upload(data=data,
-                           db=start_engine(env_vars["NBA_DB_URL"]),
-                           batch_def=config.BATCHES['default'])
+    mode = args.get("NBA_MODE", "batch")
+    db = start_engine(env_vars["NBA_DB_URL"])
+    monitor_db = start_engine(env_vars['NBA_MONITOR_DB_URL'])
+    output = args.get("NBA_OUTPUT", "db")
+    if is_flag_set(args, "NBA_MIGRATE"):
+        logger.info(f"Migrated tables to declared schemas: {migrate_all(db)}")
+    elif output != "parquet":
+        # never migrated without being asked to, tables without their
+        # declared keys are appended to until then
+        legacy = legacy_tables(db, batch_def)
+        if legacy:
+            logger.warning(f"Tables without their declared keys, run with "
+                           f"--NBA_MIGRATE=true to migrate them: {legacy}")
+    if output != "parquet":
+        # box scores stored by earlier runs are not requested again
+        fetch_args["known_games"] = committed_games(db, batch_def)
+    sink = ParquetSink(args.get("NBA_PARQUET_ROOT", config.PARQUET["ROOT"])) \
+        if output in ("parquet", "both") else None
+    committed = {}
+    if is_flag_set(args, "NBA_INCREMENTAL"):
+        fetch_args["days"], committed = plan_incremental(
+            monitor_db, fetch_args["start_date"], fetch_args["end_date"],
+            batch_def)
+
+    if output == "parquet":
+        logger.info(f"Writing data to Parquet files in: {sink.root}")
+        results = sink_upload(
+            data=drop_committed_items(
+                merge_line_score(fetch_scoreboard_data(**fetch_args)),
+                committed, batch_def),
+            batch_def=batch_def, sink=sink)
+    elif mode == "backfill":
+        yesterday = date.today() - timedelta(days=1)
+        backfill = Backfill(
+            fetch_args.get("start_date", yesterday),
+            fetch_args.get("end_date", yesterday),
+            chunk_days=int(args.get("NBA_BACKFILL_CHUNK_DAYS",
+                                    config.BACKFILL["CHUNK_DAYS"])),
+            root=args.get("NBA_BACKFILL_DIR", config.BACKFILL["DIR"]),
+            batch=args.get("NBA_BATCH", "default"))
+        outcome = run_backfill(
+            backfill, env_vars["NBA_DB_URL"], env_vars["NBA_MONITOR_DB_URL"],
+            batch_def, mode=args.get("NBA_BACKFILL_MODE", "batch"),
+            processes=int(args.get("NBA_BACKFILL_PROCESSES",
+                                   config.BACKFILL["PROCESSES"])),
+            workers=fetch_args["workers"], max_rps=fetch_args["max_rps"],
+            skip_empty=fetch_args["skip_empty"])
+        logger.info(f"Backfill outcome: {outcome}")
+        # every chunk posted its own monitor records
+        results = []
+    elif mode == "stream":
+        logger.info(f"Streaming data to db at: {env_vars['NBA_DB_URL']}")
+        results = stream_upload(
+            (
+                (day, drop_committed_items({day: items}, committed,
+                                           batch_def)[day])
+                for day, items in stream_merge_line_score(
+                    iter_scoreboard_data(**fetch_args))
+            ),
+            db=db,
+            batch_def=batch_def,
+            sink=sink)
+    elif mode == "pipeline":
+        logger.info(f"Running staged pipeline into db at: "
+                    f"{env_vars['NBA_DB_URL']}")
+        results, stats = run_pipeline(db=db, batch_def=batch_def,
+                                      committed=committed, sink=sink,
+                                      **fetch_args)
+    else:
+        logger.info("Getting data...")
+        data = drop_committed_items(
+            merge_line_score(fetch_scoreboard_data(**fetch_args)), committed,
+            batch_def)
+        logger.info("Retrieved data.")
+        logger.info(f"Pushing data to db at: {env_vars['NBA_DB_URL']}")
+        if mode == "bulk":
+            results = bulk_upload(data=data, db=db, batch_def=batch_def,
+                                  sink=sink)
+        else:
+            results = batch_upload(data=data, db=db, batch_def=batch_def,
+                                   sink=sink)
     logger.info(f"Pushing monitor stats to db at: {env_vars['NBA_MONITOR_DB_URL']}")
-    for result in results:
-        post_monitor_data(db=start_engine(env_vars['NBA_MONITOR_DB_URL']),
-                          data=result)
+    post_monitor_batch(db=monitor_db, data=results)
     logger.info("Finished pushing monitor stats.")
+    metrics.finish_run(monitor_db, args.get("NBA_METRICS_FILE",
+                                            config.METRICS["PROM_FILE"]))
+    dispose_engines()
     logger.info("Finished run!")
 
 
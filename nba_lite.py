@@ -0,0 +1,102 @@
+"""
+Lightweight version of the NBA_v2 app for small daily runs. It skips
+pandas altogether: the Scoreboard JSON rows are written with
+SQLAlchemy Core into the same tables nba.py fills.
+Author: Maciej Cisowski
+"""
+import config
+import logging.config
+from datetime import date, timedelta
+from functools import partial
+from app import metrics
+from app.common import update_config_with_env_vars, get_argv, \
+    update_stats_config, is_flag_set, RateLimiter
+from app.cache import default_cache
+from app.schedule import default_calendar
+from app.throttle import AdaptiveThrottle, adaptive_limiter, failure_kind
+from app.source import date_strings, cached_scoreboard_json
+from app.commit import start_engine, post_monitor_batch, dispose_engines
+from app.engine import item_source
+from app.lite import lite_scoreboard_day, lite_upload, LiteDay
+from app.migrate import migrate_batch, legacy_tables
+
+
+# set up logger using config
+logging.config.dictConfig(config.LOGGING)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logger.info(f"Running app: {config.NBA_APP_NAME} (lite)")
+    env_vars = update_config_with_env_vars()
+    args = get_argv()
+    update_stats_config(args, env_vars)
+    if config.METRICS["ENABLED"]:
+        metrics.start_run()
+    start_date = end_date = date.today() - timedelta(days=1)
+    if "NBA_STARTDATE" in args and "NBA_ENDDATE" in args:
+        start_date = date.fromisoformat(args["NBA_STARTDATE"])
+        end_date = date.fromisoformat(args["NBA_ENDDATE"])
+    logger.info(f"Using start: {start_date} and end {end_date} dates.")
+    batch_def = config.BATCHES[args.get("NBA_BATCH", "default")]
+    items = {item_source(entry) for entry in batch_def}
+    boxscores = sorted(items & set(config.BOXSCORE["ITEMS"]))
+    if boxscores:
+        # checked before any request is sent, box scores need nba.py
+        raise ValueError(f"nba_lite.py does not fetch box scores, run "
+                         f"nba.py for the items: {boxscores}")
+    cache = default_cache()
+    calendar = default_calendar()
+    days = date_strings(start_date, end_date)
+    if calendar is not None and not is_flag_set(args, "NBA_FULL_SCAN"):
+        days = calendar.days_to_fetch(days)
+    max_rps = float(args.get("NBA_MAX_RPS", config.FETCH_MAX_RPS))
+    if config.THROTTLE["ADAPTIVE"]:
+        throttle = AdaptiveThrottle(adaptive_limiter(max_rps))
+        fetch = partial(cached_scoreboard_json, cache=cache,
+                        adaptive=throttle, calendar=calendar)
+    else:
+        fetch = partial(cached_scoreboard_json, cache=cache,
+                        throttle=RateLimiter(max_rps).wait,
+                        calendar=calendar)
+
+    def fetch_day(day):
+        # a day failing for good is recorded, the rest of the range goes on
+        try:
+            return lite_scoreboard_day(fetch(day), items)
+        except Exception as error:
+            if failure_kind(error) is None:
+                raise
+            logger.error(f"Giving up on scoreboard data for {day}: {error}")
+            return LiteDay(failed=True)
+
+    try:
+        data = {day: fetch_day(day) for day in days}
+    finally:
+        if cache is not None:
+            cache.flush()
+        if calendar is not None:
+            calendar.save()
+    logger.info(f"Pushing data to db at: {env_vars['NBA_DB_URL']}")
+    db = start_engine(env_vars["NBA_DB_URL"])
+    if is_flag_set(args, "NBA_MIGRATE"):
+        logger.info(f"Migrated tables to declared schemas: "
+                    f"{migrate_batch(db, batch_def)}")
+    else:
+        legacy = legacy_tables(db, batch_def)
+        if legacy:
+            logger.warning(f"Tables without their declared keys, run with "
+                           f"--NBA_MIGRATE=true to migrate them: {legacy}")
+    results = lite_upload(data=data, db=db, batch_def=batch_def)
+    logger.info(f"Pushing monitor stats to db at: "
+                f"{env_vars['NBA_MONITOR_DB_URL']}")
+    monitor_db = start_engine(env_vars['NBA_MONITOR_DB_URL'])
+    post_monitor_batch(db=monitor_db, data=results)
+    metrics.finish_run(monitor_db, args.get("NBA_METRICS_FILE",
+                                            config.METRICS["PROM_FILE"]))
+    dispose_engines()
+    logger.info("Finished run!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Shared fixtures and helpers of the NBA_v2 benchmarks
+Author: Maciej Cisowski
+"""
+
+import os
+import json
+import pytest
+import tracemalloc
+from datetime import date, timedelta
+from itertools import count
+from sqlalchemy import create_engine
+from nba_api.stats.library.http import NBAStatsResponse
+from tests.synthetic import FakeScoreboardV2, scoreboard_payload
+
+# number of days benchmarked; sizes above NBA_BENCH_MAX_DAYS (env var)
+# are skipped, so that the regular test run stays quick
+DAYS = [1, 30, 240, 1200]
+MAX_DAYS = int(os.environ.get("NBA_BENCH_MAX_DAYS", 30))
+START_DATE = date(2016, 10, 1)
+
+# synthetic payloads per number of days, generated once per session
+_payloads = {}
+
+
+def bench_days() -> list:
+    """
+    :return: pytest params of the benchmarked sizes, in days
+    :rtype: list
+    """
+    return [pytest.param(days, id=f"{days}d", marks=pytest.mark.skipif(
+                days > MAX_DAYS, reason=f"NBA_BENCH_MAX_DAYS={MAX_DAYS}"))
+            for days in DAYS]
+
+
+def date_range(days: int) -> tuple:
+    """
+    :param days: number of days
+    :return: tuple of the first and the last date
+    :rtype: tuple
+    """
+    return START_DATE, START_DATE + timedelta(days=days - 1)
+
+
+def payloads(days: int) -> dict:
+    """
+    :param days: number of days
+    :return: dict of {date string: ScoreboardV2-shaped payload}
+    :rtype: dict
+    """
+    if days not in _payloads:
+        _payloads[days] = {
+            day.strftime("%Y/%m/%d"): scoreboard_payload(
+                day.strftime("%Y/%m/%d"))
+            for day in (START_DATE + timedelta(days=n) for n in range(days))}
+    return _payloads[days]
+
+
+def payload_rows(days: int) -> int:
+    """
+    :param days: number of days
+    :return: number of rows in all result sets of those days
+    :rtype: int
+    """
+    return sum(len(r["rowSet"]) for payload in payloads(days).values()
+               for r in payload["resultSets"])
+
+
+class PayloadEndpoint(FakeScoreboardV2):
+    """
+    FakeScoreboardV2 serving pre-generated payloads, so the fetch
+    benchmarks do not time the synthetic data generation. Response
+    bodies are serialized once per date as well.
+    """
+    payloads = {}
+    bodies = {}
+
+    def __init__(self, game_date: str = None, **kwargs):
+        self.payload = PayloadEndpoint.payloads[game_date]
+        if game_date not in PayloadEndpoint.bodies:
+            PayloadEndpoint.bodies[game_date] = json.dumps(self.payload)
+        self.nba_response = NBAStatsResponse(
+            PayloadEndpoint.bodies[game_date], 200, "scoreboardv2")
+
+
+@pytest.fixture(params=["memory", "file"])
+def new_db(request, tmp_path):
+    """
+    :return: callable making a new, empty SQLite db, in memory or in a
+    file depending on the param
+    """
+    numbers = count()
+
+    def make():
+        if request.param == "memory":
+            return create_engine("sqlite://")
+        return create_engine(f"sqlite:///{tmp_path}/bench_{next(numbers)}.db")
+    return make
+
+
+def report(benchmark, rows: int, target):
+    """
+    Add the throughput and the peak memory of a benchmark to its extra
+    info, which is saved with the results and shown by
+    pytest-benchmark compare. The memory is traced over one more call.
+    :param benchmark: pytest-benchmark fixture, already run
+    :param rows: number of rows processed per call
+    :param target: callable repeating one call of the benchmark
+    """
+    tracemalloc.start()
+    try:
+        target()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["rows"] = rows
+    benchmark.extra_info["peak_mb"] = round(peak / 2 ** 20, 2)
+    if benchmark.stats is not None:
+        benchmark.extra_info["rows_per_sec"] = round(
+            rows / benchmark.stats.stats.mean)
@@ -0,0 +1,52 @@
+"""
+Benchmarks of fetching and merging Scoreboard data in NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from app.collect import fetch_scoreboard_data, scoreboard_frames, \
+    scoreboardv2
+from app.data import merge_line_score
+from config import CACHE
+from tests.benchmarks.conftest import PayloadEndpoint, bench_days, \
+    date_range, payloads, payload_rows, report
+
+ROUNDS = 3
+
+
+@pytest.fixture()
+def endpoint(monkeypatch):
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", PayloadEndpoint)
+    return PayloadEndpoint
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_fetch_scoreboard_data(benchmark, endpoint, days):
+    endpoint.payloads = payloads(days)
+    start, end = date_range(days)
+
+    def fetch():
+        # without the calendar skipping the days the first round found
+        # empty, every round requests the same days
+        return fetch_scoreboard_data(start, end, workers=4, max_rps=None,
+                                     skip_empty=False)
+
+    out = benchmark.pedantic(fetch, rounds=ROUNDS, iterations=1)
+    assert len(out) == days
+    report(benchmark, payload_rows(days), fetch)
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_merge_line_score(benchmark, days):
+    raw = payloads(days)
+
+    def frames():
+        return ({day: scoreboard_frames(payload)
+                 for day, payload in raw.items()},), {}
+
+    out = benchmark.pedantic(merge_line_score, setup=frames, rounds=ROUNDS,
+                             iterations=1)
+    rows = sum(len(items["mergedLineScore"].index) for items in out.values())
+    assert rows > 0
+    report(benchmark, rows, lambda: merge_line_score(frames()[0][0]))
@@ -0,0 +1,94 @@
+"""
+Benchmarks of uploading Scoreboard data and monitor records in NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from pandas import concat
+from sqlalchemy import create_engine
+from app.collect import scoreboard_frames
+from app.data import merge_line_score
+from app.commit import post_data, batch_upload, post_monitor_data, \
+    post_monitor_batch
+from config import BATCHES, DbActions
+from models.monitor import Monitor
+from tests.benchmarks.conftest import bench_days, payloads, report
+
+ROUNDS = 3
+
+# merged data and the monitor records of its upload per number of
+# days, built once per session
+_merged = {}
+_monitors = {}
+
+
+def merged(days: int) -> dict:
+    if days not in _merged:
+        _merged[days] = merge_line_score({
+            day: scoreboard_frames(payload)
+            for day, payload in payloads(days).items()})
+    return _merged[days]
+
+
+def monitor_records(days: int) -> list:
+    if days not in _monitors:
+        _monitors[days] = batch_upload(data=merged(days),
+                                       db=create_engine("sqlite://"),
+                                       batch_def=BATCHES["default"])
+    # new instances every time, a session takes ownership of them
+    return [Monitor(date=m.date, item=m.item, pre_offset=m.pre_offset,
+                    post_offset=m.post_offset, size=m.size,
+                    success=m.success) for m in _monitors[days]]
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_post_data(benchmark, new_db, days):
+    frame = concat([items["mergedLineScore"]
+                    for items in merged(days).values()
+                    if not items["mergedLineScore"].empty])
+
+    def upload():
+        return post_data(db=new_db(), data=frame, table="line_score",
+                         if_exists=DbActions.APPEND)
+
+    out = benchmark.pedantic(upload, rounds=ROUNDS, iterations=1)
+    assert out["line_score"] == len(frame.index)
+    report(benchmark, len(frame.index), upload)
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_batch_upload(benchmark, new_db, days):
+    data = merged(days)
+    rows = sum(len(items[entry["name"]].index)
+               for items in data.values() for entry in BATCHES["default"]
+               if entry["name"] in items)
+
+    def upload():
+        return batch_upload(data=data, db=new_db(),
+                            batch_def=BATCHES["default"])
+
+    out = benchmark.pedantic(upload, rounds=ROUNDS, iterations=1)
+    assert all(m.success for m in out)
+    report(benchmark, rows, upload)
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_post_monitor_data(benchmark, new_db, days):
+    def upload():
+        db = new_db()
+        return [post_monitor_data(db=db, data=m)
+                for m in monitor_records(days)]
+
+    out = benchmark.pedantic(upload, rounds=ROUNDS, iterations=1)
+    assert all(out)
+    report(benchmark, len(out), upload)
+
+
+@pytest.mark.parametrize("days", bench_days())
+def test_bench_post_monitor_batch(benchmark, new_db, days):
+    def upload():
+        return post_monitor_batch(db=new_db(), data=monitor_records(days))
+
+    out = benchmark.pedantic(upload, rounds=ROUNDS, iterations=1)
+    assert out == len(_monitors[days])
+    report(benchmark, out, upload)
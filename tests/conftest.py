@@ -0,0 +1,18 @@
+"""
+Shared fixtures for the tests of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from config import CACHE, SCHEDULE
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path, tmp_path_factory):
+    # keep responses cached by tests out of the user's cache directory,
+    # and the dates they observed out of the season calendar
+    path = str(tmp_path / "nba_cache")
+    monkeypatch.setitem(CACHE, "NBA_CACHE_DIR", path)
+    calendar = tmp_path_factory.mktemp("nba_calendar") / "calendar.json"
+    monkeypatch.setitem(SCHEDULE, "PATH", str(calendar))
+    return path
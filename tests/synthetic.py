@@ -0,0 +1,262 @@
+"""
+Synthetic ScoreboardV2 and BoxScoreTraditionalV2 responses for offline
+tests of NBA_v2
+Author: Maciej Cisowski
+"""
+import json
+import random
+from datetime import datetime
+from pandas import DataFrame
+from nba_api.stats.library.http import NBAStatsResponse
+from nba_api.stats.endpoints.scoreboardv2 import ScoreboardV2
+from nba_api.stats.endpoints.boxscoretraditionalv2 import \
+    BoxScoreTraditionalV2
+
+
+# (TEAM_ID, abbreviation, city, name, conference)
+TEAMS = [
+    (1610612737, "ATL", "Atlanta", "Hawks", "East"),
+    (1610612738, "BOS", "Boston", "Celtics", "East"),
+    (1610612739, "CLE", "Cleveland", "Cavaliers", "East"),
+    (1610612740, "NOP", "New Orleans", "Pelicans", "West"),
+    (1610612741, "CHI", "Chicago", "Bulls", "East"),
+    (1610612742, "DAL", "Dallas", "Mavericks", "West"),
+    (1610612743, "DEN", "Denver", "Nuggets", "West"),
+    (1610612744, "GSW", "Golden State", "Warriors", "West"),
+    (1610612745, "HOU", "Houston", "Rockets", "West"),
+    (1610612746, "LAC", "LA", "Clippers", "West"),
+    (1610612747, "LAL", "Los Angeles", "Lakers", "West"),
+    (1610612748, "MIA", "Miami", "Heat", "East"),
+    (1610612749, "MIL", "Milwaukee", "Bucks", "East"),
+    (1610612750, "MIN", "Minnesota", "Timberwolves", "West"),
+    (1610612751, "BKN", "Brooklyn", "Nets", "East"),
+    (1610612752, "NYK", "New York", "Knicks", "East"),
+    (1610612753, "ORL", "Orlando", "Magic", "East"),
+    (1610612754, "IND", "Indiana", "Pacers", "East"),
+    (1610612755, "PHI", "Philadelphia", "76ers", "East"),
+    (1610612756, "PHX", "Phoenix", "Suns", "West"),
+    (1610612757, "POR", "Portland", "Trail Blazers", "West"),
+    (1610612758, "SAC", "Sacramento", "Kings", "West"),
+    (1610612759, "SAS", "San Antonio", "Spurs", "West"),
+    (1610612760, "OKC", "Oklahoma City", "Thunder", "West"),
+    (1610612761, "TOR", "Toronto", "Raptors", "East"),
+    (1610612762, "UTA", "Utah", "Jazz", "West"),
+    (1610612763, "MEM", "Memphis", "Grizzlies", "West"),
+    (1610612764, "WAS", "Washington", "Wizards", "East"),
+    (1610612765, "DET", "Detroit", "Pistons", "East"),
+    (1610612766, "CHA", "Charlotte", "Hornets", "East"),
+]
+
+# result sets in the order stats.nba.com returns them
+RESULT_SETS = ["GameHeader", "LineScore", "SeriesStandings", "LastMeeting",
+               "EastConfStandingsByDay", "WestConfStandingsByDay",
+               "Available", "TeamLeaders", "TicketLinks", "WinProbability"]
+
+
+def _line(game_id, est, seq, team, rng):
+    quarters = [rng.randint(18, 38) for _ in range(4)]
+    return {
+        "GAME_DATE_EST": est, "GAME_SEQUENCE": seq, "GAME_ID": game_id,
+        "TEAM_ID": team[0], "TEAM_ABBREVIATION": team[1],
+        "TEAM_CITY_NAME": team[2], "TEAM_NAME": team[3],
+        "TEAM_WINS_LOSSES": f"{rng.randint(0, 60)}-{rng.randint(0, 60)}",
+        "PTS_QTR1": quarters[0], "PTS_QTR2": quarters[1],
+        "PTS_QTR3": quarters[2], "PTS_QTR4": quarters[3],
+        "PTS": sum(quarters), "FG_PCT": round(rng.uniform(.35, .6), 3),
+        "FT_PCT": round(rng.uniform(.6, .95), 3),
+        "FG3_PCT": round(rng.uniform(.25, .5), 3),
+        "AST": rng.randint(15, 35), "REB": rng.randint(30, 60),
+        "TOV": rng.randint(8, 20)
+    }
+
+
+def _standings(conference, standings_date, rng):
+    rows = []
+    for team in [t for t in TEAMS if t[4] == conference]:
+        wins, losses = rng.randint(0, 41), rng.randint(0, 41)
+        rows.append({
+            "TEAM_ID": team[0], "LEAGUE_ID": "00", "SEASON_ID": "22019",
+            "STANDINGSDATE": standings_date, "CONFERENCE": conference,
+            "TEAM": team[2], "G": wins + losses, "W": wins, "L": losses,
+            "W_PCT": round(wins / max(wins + losses, 1), 3),
+            "HOME_RECORD": f"{wins // 2}-{losses // 2}",
+            "ROAD_RECORD": f"{wins - wins // 2}-{losses - losses // 2}"
+        })
+    return rows
+
+
+def scoreboard_payload(game_date: str, games: int = None) -> dict:
+    """
+    Build a deterministic ScoreboardV2-shaped response for a date.
+    :param game_date: date string formatted as "%Y/%m/%d"
+    :param games: number of games on that date, defaults to a value
+    derived from the date (between 0 and 12)
+    :return: dict shaped like the raw stats.nba.com JSON
+    :rtype: dict
+    """
+    day = datetime.strptime(game_date, "%Y/%m/%d")
+    rng = random.Random(day.toordinal())
+    if games is None:
+        games = rng.randint(0, 12)
+    est = day.strftime("%Y-%m-%dT00:00:00")
+    rows = {name: [] for name in RESULT_SETS}
+    teams = rng.sample(TEAMS, min(games * 2, len(TEAMS)))
+    for seq in range(1, len(teams) // 2 + 1):
+        away, home = teams[2 * seq - 2], teams[2 * seq - 1]
+        game_id = f"002{day.strftime('%y%m%d')}{seq:02d}"
+        rows["GameHeader"].append({
+            "GAME_DATE_EST": est, "GAME_SEQUENCE": seq, "GAME_ID": game_id,
+            "GAME_STATUS_ID": 3, "GAME_STATUS_TEXT": "Final",
+            "GAMECODE": f"{day.strftime('%Y%m%d')}/{away[1]}{home[1]}",
+            "HOME_TEAM_ID": home[0], "VISITOR_TEAM_ID": away[0],
+            "SEASON": str(day.year if day.month > 7 else day.year - 1),
+            "LIVE_PERIOD": 4, "LIVE_PC_TIME": "", "ARENA_NAME": f"{home[2]} Arena",
+            "WH_STATUS": 1
+        })
+        # stats.nba.com lists the visitor before the home team
+        rows["LineScore"].append(_line(game_id, est, seq, away, rng))
+        rows["LineScore"].append(_line(game_id, est, seq, home, rng))
+        rows["SeriesStandings"].append({
+            "GAME_ID": game_id, "HOME_TEAM_ID": home[0],
+            "VISITOR_TEAM_ID": away[0], "GAME_DATE_EST": est,
+            "HOME_TEAM_WINS": rng.randint(0, 2),
+            "HOME_TEAM_LOSSES": rng.randint(0, 2), "SERIES_LEADER": "Tied"
+        })
+        rows["LastMeeting"].append({
+            "GAME_ID": game_id, "LAST_GAME_ID": f"002{seq:07d}",
+            "LAST_GAME_DATE_EST": "2019-04-01T00:00:00",
+            "LAST_GAME_HOME_TEAM_ID": home[0],
+            "LAST_GAME_HOME_TEAM_CITY": home[2],
+            "LAST_GAME_HOME_TEAM_NAME": home[3],
+            "LAST_GAME_HOME_TEAM_ABBREVIATION": home[1],
+            "LAST_GAME_HOME_TEAM_POINTS": rng.randint(90, 130),
+            "LAST_GAME_VISITOR_TEAM_ID": away[0],
+            "LAST_GAME_VISITOR_TEAM_CITY": away[2],
+            "LAST_GAME_VISITOR_TEAM_NAME": away[3],
+            "LAST_GAME_VISITOR_TEAM_CITY1": away[1],
+            "LAST_GAME_VISITOR_TEAM_POINTS": rng.randint(90, 130)
+        })
+        rows["Available"].append({"GAME_ID": game_id, "PT_AVAILABLE": 1})
+    standings_date = day.strftime("%m/%d/%Y")
+    rows["EastConfStandingsByDay"] = _standings("East", standings_date, rng)
+    rows["WestConfStandingsByDay"] = _standings("West", standings_date, rng)
+
+    result_sets = []
+    for name in RESULT_SETS:
+        headers = ScoreboardV2.expected_data.get(name, [])
+        result_sets.append({
+            "name": name,
+            "headers": headers,
+            "rowSet": [[row.get(h) for h in headers] for row in rows[name]]
+        })
+    return {
+        "resource": "scoreboardV2",
+        "parameters": {"GameDate": day.strftime("%m/%d/%Y"),
+                       "LeagueID": "00", "DayOffset": "0"},
+        "resultSets": result_sets
+    }
+
+
+class FakeScoreboardV2(object):
+    """
+    Drop-in replacement for nba_api's ScoreboardV2 endpoint serving
+    synthetic payloads. Requested dates are recorded in <calls>.
+    """
+    calls = []
+
+    def __init__(self, game_date: str = None, headers: dict = None,
+                 timeout: int = None, **kwargs):
+        FakeScoreboardV2.calls.append(game_date)
+        self.payload = scoreboard_payload(game_date)
+        self.nba_response = NBAStatsResponse(json.dumps(self.payload), 200,
+                                             "scoreboardv2")
+
+    def get_request(self):
+        # the response is already there, see __init__
+        pass
+
+    def get_dict(self) -> dict:
+        return self.payload
+
+    def get_available_data(self) -> list:
+        return [r["name"] for r in self.payload["resultSets"]]
+
+    def get_data_frames(self) -> list:
+        return [DataFrame(r["rowSet"], columns=r["headers"])
+                for r in self.payload["resultSets"]]
+
+
+def _box_line(rng):
+    made = [rng.randint(0, 12), rng.randint(0, 5), rng.randint(0, 8)]
+    tried = [m + rng.randint(0, 8) for m in made]
+    return {
+        "MIN": f"{rng.randint(0, 40)}:{rng.randint(0, 59):02d}",
+        "FGM": made[0], "FGA": tried[0],
+        "FG_PCT": round(made[0] / max(tried[0], 1), 3),
+        "FG3M": made[1], "FG3A": tried[1],
+        "FG3_PCT": round(made[1] / max(tried[1], 1), 3),
+        "FTM": made[2], "FTA": tried[2],
+        "FT_PCT": round(made[2] / max(tried[2], 1), 3),
+        "OREB": rng.randint(0, 4), "DREB": rng.randint(0, 10),
+        "REB": rng.randint(0, 14), "AST": rng.randint(0, 10),
+        "STL": rng.randint(0, 3), "BLK": rng.randint(0, 3),
+        "TO": rng.randint(0, 5), "PF": rng.randint(0, 6),
+        "PTS": 2 * made[0] + made[1] + made[2],
+        "PLUS_MINUS": float(rng.randint(-20, 20))
+    }
+
+
+def boxscore_payload(game_id: str, players: int = 10) -> dict:
+    """
+    Build a deterministic BoxScoreTraditionalV2-shaped response for a
+    game.
+    :param game_id: GAME_ID of the game
+    :param players: number of players listed per team
+    :return: dict shaped like the raw stats.nba.com JSON
+    :rtype: dict
+    """
+    rng = random.Random(int(game_id))
+    rows = {"PlayerStats": [], "TeamStats": [], "TeamStarterBenchStats": []}
+    for team in rng.sample(TEAMS, 2):
+        names = {"GAME_ID": game_id, "TEAM_ID": team[0],
+                 "TEAM_ABBREVIATION": team[1], "TEAM_CITY": team[2]}
+        for n in range(players):
+            rows["PlayerStats"].append({
+                **names, **_box_line(rng),
+                "PLAYER_ID": team[0] % 10000 * 100 + n,
+                "PLAYER_NAME": f"{team[3]} Player {n}",
+                "START_POSITION": "GFFCG"[n] if n < 5 else "",
+                "COMMENT": ""
+            })
+        rows["TeamStats"].append({**names, **_box_line(rng),
+                                  "TEAM_NAME": team[3]})
+    return {
+        "resource": "boxscore",
+        "parameters": {"GameID": game_id},
+        "resultSets": [
+            {"name": name, "headers": headers,
+             "rowSet": [[row.get(h) for h in headers] for row in rows[name]]}
+            for name, headers in BoxScoreTraditionalV2.expected_data.items()]
+    }
+
+
+class FakeBoxScoreTraditionalV2(object):
+    """
+    Drop-in replacement for nba_api's BoxScoreTraditionalV2 endpoint
+    serving synthetic payloads. Requested games are recorded in <calls>.
+    """
+    calls = []
+
+    def __init__(self, game_id: str = None, headers: dict = None,
+                 timeout: int = None, **kwargs):
+        FakeBoxScoreTraditionalV2.calls.append(game_id)
+        self.payload = boxscore_payload(game_id)
+        self.nba_response = NBAStatsResponse(json.dumps(self.payload), 200,
+                                             "boxscoretraditionalv2")
+
+    def get_request(self):
+        # the response is already there, see __init__
+        pass
+
+    def get_dict(self) -> dict:
+        return self.payload
@@ -0,0 +1,216 @@
+"""
+Tests for the resumable backfills of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import os
+import json
+import socket
+import time
+import pytest
+from assertpy import assert_that
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from sqlalchemy import create_engine
+from app import backfill as backfill_module, metrics
+from app.backfill import Backfill, chunk_ranges, run_backfill, run_chunk, \
+    backfill_worker, _process_worker
+from app.commit import start_engine
+from app.collect import scoreboardv2
+from config import BATCHES, CACHE, STATS
+from app.source import date_strings
+from tests.synthetic import FakeScoreboardV2, scoreboard_payload
+
+START, END = date(2019, 12, 1), date(2019, 12, 10)
+
+
+@pytest.fixture()
+def fake_endpoint(monkeypatch):
+    FakeScoreboardV2.calls = []
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    return FakeScoreboardV2
+
+
+@pytest.fixture()
+def dbs(tmp_path):
+    return f"sqlite:///{tmp_path}/nba.db", f"sqlite:///{tmp_path}/monitor.db"
+
+
+def test_chunk_ranges_cover_the_range_without_gaps():
+    chunks = chunk_ranges(START, END, 4)
+    assert_that(chunks).is_equal_to([
+        (date(2019, 12, 1), date(2019, 12, 4)),
+        (date(2019, 12, 5), date(2019, 12, 8)),
+        (date(2019, 12, 9), date(2019, 12, 10))])
+
+
+def test_chunks_are_claimed_by_one_process_only(tmp_path):
+    backfills = [Backfill(START, END, chunk_days=1, root=str(tmp_path))
+                 for _ in range(8)]
+
+    def claim_all(backfill):
+        claimed = []
+        chunk = backfill.next_chunk()
+        while chunk is not None:
+            claimed.append(chunk)
+            chunk = backfill.next_chunk()
+        return claimed
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = [c for cs in pool.map(claim_all, backfills) for c in cs]
+    assert_that(sorted(claimed)).is_equal_to(backfills[0].chunks())
+
+
+def test_claims_of_dead_processes_are_taken_over(tmp_path):
+    backfill = Backfill(START, END, chunk_days=5, root=str(tmp_path))
+    chunk = backfill.chunks()[0]
+    with open(backfill._claim_path(chunk), "w") as f:
+        json.dump({"host": socket.gethostname(), "pid": 2 ** 22 + 1}, f)
+    assert_that(backfill.claim(chunk)).is_true()
+    assert_that(backfill.claim(chunk)).is_false()
+
+
+def test_a_claim_taken_over_first_is_not_taken_over_again(tmp_path):
+    first, second = [Backfill(START, END, chunk_days=5, root=str(tmp_path))
+                     for _ in range(2)]
+    chunk = first.chunks()[0]
+    path = first._claim_path(chunk)
+    with open(path, "w") as f:
+        json.dump({"host": "elsewhere", "pid": 1}, f)
+    os.utime(path, (time.time() - 2 * first.stale_secs,) * 2)
+    seen = os.stat(path)
+    assert_that(first.claim(chunk)).is_true()
+    # the second process found the same claim stale before the first
+    # took it over
+    assert_that(second._take_over(path, seen)).is_false()
+    with open(path) as f:
+        assert_that(json.load(f)["host"]).is_equal_to(socket.gethostname())
+    assert_that(os.listdir(os.path.join(first.dir, "claims")))\
+        .is_equal_to([os.path.basename(path)])
+
+
+def test_heartbeats_keep_claims_from_going_stale(tmp_path):
+    first, second = [Backfill(START, END, chunk_days=5, root=str(tmp_path),
+                              stale_secs=60) for _ in range(2)]
+    chunk = first.chunks()[0]
+    assert_that(first.claim(chunk)).is_true()
+    path = first._claim_path(chunk)
+    os.utime(path, (time.time() - 120,) * 2)
+    assert_that(first.heartbeat(chunk)).is_true()
+    assert_that(second.claim(chunk)).is_false()
+    os.utime(path, (time.time() - 120,) * 2)
+    assert_that(second.claim(chunk)).is_true()
+
+
+def test_chunks_beat_after_every_fetched_day(fake_endpoint, dbs):
+    beats = []
+    db, monitor_db = [start_engine(url) for url in dbs]
+    run_chunk((START, date(2019, 12, 4)), db, monitor_db, BATCHES["default"],
+              heartbeat=lambda: beats.append(1), max_rps=None)
+    assert_that(beats).is_length(4)
+
+
+def test_backfill_resumes_from_the_last_checkpoint(fake_endpoint, dbs,
+                                                   tmp_path, monkeypatch):
+    upload = backfill_module.batch_upload
+    chunks_uploaded = []
+
+    def crash_on_third_chunk(data, db, batch_def):
+        chunks_uploaded.append(min(data))
+        if len(chunks_uploaded) == 3:
+            raise RuntimeError("killed")
+        return upload(data=data, db=db, batch_def=batch_def)
+
+    monkeypatch.setattr(backfill_module, "batch_upload", crash_on_third_chunk)
+    backfill = Backfill(START, END, chunk_days=3, root=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        run_backfill(backfill, *dbs, BATCHES["default"], max_rps=None)
+    assert_that(backfill.checkpoints()).is_length(2)
+    assert_that(os.listdir(os.path.join(backfill.dir, "claims"))).is_empty()
+
+    FakeScoreboardV2.calls = []
+    monkeypatch.setattr(backfill_module, "batch_upload", upload)
+    outcome = run_backfill(Backfill(START, END, chunk_days=3,
+                                    root=str(tmp_path)),
+                           *dbs, BATCHES["default"], max_rps=None)
+    assert_that(outcome).is_equal_to({
+        "done": ["20191207_20191209", "20191210_20191210"], "failed": [],
+        "pending": 0})
+    assert_that(sorted(FakeScoreboardV2.calls))\
+        .is_equal_to([f"2019/12/{d:02d}" for d in range(7, 11)])
+    monitor = create_engine(dbs[1]).execute(
+        "select count(distinct date), min(success) from monitor").first()
+    assert_that(tuple(monitor)).is_equal_to((10, 1))
+
+
+def test_backfill_processes_skip_finished_chunks(dbs, tmp_path):
+    backfill = Backfill(START, END, chunk_days=5, root=str(tmp_path))
+    for chunk in backfill.chunks():
+        backfill.complete(chunk, [])
+    outcome = run_backfill(backfill, *dbs, BATCHES["default"], processes=2)
+    assert_that(outcome).is_equal_to({"done": [], "failed": [],
+                                      "pending": 0})
+
+
+def test_dates_loaded_by_another_batch_are_backfilled(fake_endpoint, dbs,
+                                                      tmp_path):
+    run_backfill(Backfill(START, END, chunk_days=5, root=str(tmp_path)),
+                 *dbs, BATCHES["default"], max_rps=None)
+    FakeScoreboardV2.calls = []
+    outcome = run_backfill(Backfill(START, END, chunk_days=5,
+                                    root=str(tmp_path), batch="history"),
+                           *dbs, BATCHES["history"], max_rps=None)
+    # the season calendar knows the days without games by now
+    game_days = [day for day in date_strings(START, END)
+                 if scoreboard_payload(day)["resultSets"][0]["rowSet"]]
+    assert_that(outcome["done"]).is_length(2)
+    assert_that(sorted(FakeScoreboardV2.calls)).is_equal_to(game_days)
+    monitor = create_engine(dbs[1]).execute(
+        "select count(distinct date) from monitor "
+        "where item = 'WestConfStandingsHistory' and success").first()
+    assert_that(monitor[0]).is_equal_to(len(game_days))
+
+
+def test_workers_do_not_retry_failing_chunks_forever(dbs, tmp_path,
+                                                     monkeypatch):
+    attempts = []
+
+    def failing_chunk(chunk, *args, **kwargs):
+        attempts.append(chunk)
+        return [], False
+
+    monkeypatch.setattr(backfill_module, "run_chunk", failing_chunk)
+    backfill = Backfill(START, END, chunk_days=5, root=str(tmp_path))
+    outcome = backfill_worker(backfill, *dbs, BATCHES["default"])
+    assert_that(outcome["failed"]).is_equal_to(
+        [backfill.chunk_id(c) for c in backfill.chunks()])
+    assert_that(attempts).is_equal_to(backfill.chunks())
+    assert_that(backfill.pending()).is_length(2)
+    assert_that(os.listdir(os.path.join(backfill.dir, "claims"))).is_empty()
+
+
+def test_worker_processes_apply_the_settings_of_the_run(dbs, tmp_path,
+                                                        monkeypatch):
+    seen = {}
+
+    def worker(backfill, db_url, monitor_db_url, batch_def, mode,
+               **fetch_args):
+        seen.update(url=STATS["NBA_STATS_URL"], mode=mode,
+                    run=metrics.active_run().run_id)
+        metrics.record("fetch", 0.5, day="2019/12/01")
+        return {"done": [], "failed": []}
+
+    monkeypatch.setitem(STATS, "NBA_STATS_URL", None)
+    monkeypatch.setattr(backfill_module, "backfill_worker", worker)
+    _process_worker(Backfill(START, END, root=str(tmp_path)), *dbs,
+                    BATCHES["default"], "bulk",
+                    settings={"STATS": {"NBA_STATS_URL": "http://replay"}},
+                    run_id="parent-run")
+    assert_that(seen).is_equal_to({"url": "http://replay", "mode": "bulk",
+                                   "run": "parent-run"})
+    assert_that(metrics.active_run()).is_none()
+    stored = create_engine(dbs[1]).execute(
+        "select run_id, stage from run_metrics").fetchall()
+    assert_that([tuple(r) for r in stored])\
+        .is_equal_to([("parent-run", "fetch")])
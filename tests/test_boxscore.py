@@ -0,0 +1,155 @@
+"""
+Tests for the per-game box score fan-out of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import time
+import pytest
+from datetime import date
+from assertpy import assert_that
+from app import boxscore, collect
+from app.boxscore import BoxScoreFanOut, boxscore_items, game_ids
+from app.cache import ResponseCache
+from app.collect import fetch_scoreboard_data, iter_scoreboard_data, \
+    batch_items, scoreboard_frames, scoreboardv2
+from app.commit import start_engine, batch_upload, get_db_table_offset, \
+    committed_games
+from app.data import merge_line_score
+from config import BATCHES, CACHE
+from tests.synthetic import FakeScoreboardV2, FakeBoxScoreTraditionalV2, \
+    scoreboard_payload
+
+DAY = "2019/12/09"
+# games on the synthetic DAY
+GAMES = 12
+
+
+@pytest.fixture()
+def fake_endpoints(monkeypatch):
+    FakeScoreboardV2.calls = []
+    FakeBoxScoreTraditionalV2.calls = []
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    monkeypatch.setattr(boxscore.boxscoretraditionalv2,
+                        "BoxScoreTraditionalV2", FakeBoxScoreTraditionalV2)
+    return FakeBoxScoreTraditionalV2
+
+
+@pytest.fixture()
+def items():
+    return batch_items(BATCHES["boxscore"])
+
+
+def test_only_box_score_items_are_fanned_out(items):
+    assert_that(boxscore_items(items)).is_equal_to(
+        {"BoxScorePlayerStats": "PlayerStats",
+         "BoxScoreTeamStats": "TeamStats"})
+    assert_that(boxscore_items(batch_items(BATCHES["default"]))).is_empty()
+
+
+def test_fan_out_adds_box_scores_of_every_game(fake_endpoints, items):
+    day_items = scoreboard_frames(scoreboard_payload(DAY), items)
+    fan_out = BoxScoreFanOut(boxscore_items(items))
+    fan_out.attach(DAY, day_items)
+    fan_out.close()
+    assert_that(sorted(fake_endpoints.calls))\
+        .is_equal_to(sorted(game_ids(day_items))).is_length(GAMES)
+    assert_that(day_items["BoxScorePlayerStats"].index).is_length(GAMES * 20)
+    assert_that(set(day_items["BoxScoreTeamStats"]["GAME_ID"]))\
+        .is_equal_to(set(game_ids(day_items)))
+
+
+def test_games_are_requested_once_across_overlapping_days(fake_endpoints,
+                                                          items):
+    first, again = [scoreboard_frames(scoreboard_payload(DAY), items)
+                    for _ in range(2)]
+    fan_out = BoxScoreFanOut(boxscore_items(items), workers=4)
+    fan_out.attach(DAY, first)
+    fan_out.attach(DAY, again)
+    fan_out.close()
+    assert_that(fake_endpoints.calls).is_length(GAMES)
+    assert_that(first["BoxScorePlayerStats"].index).is_length(GAMES * 20)
+    assert_that(again["BoxScorePlayerStats"].empty).is_true()
+
+
+def test_box_scores_share_the_response_cache(fake_endpoints, items,
+                                             tmp_path):
+    cache = ResponseCache(path=str(tmp_path))
+    fetch_scoreboard_data(days=[DAY], items=items, max_rps=None, cache=cache)
+    FakeBoxScoreTraditionalV2.calls = []
+    fetch_scoreboard_data(days=[DAY], items=items, max_rps=None, cache=cache)
+    assert_that(FakeBoxScoreTraditionalV2.calls).is_empty()
+
+
+def test_a_night_of_games_is_fetched_concurrently(fake_endpoints, items,
+                                                  monkeypatch):
+    request = boxscore.request_boxscore
+    calls = []
+
+    def slow_request(game_id):
+        start = time.perf_counter()
+        time.sleep(0.05)
+        calls.append((start, time.perf_counter()))
+        return request(game_id)
+
+    monkeypatch.setattr(boxscore, "request_boxscore", slow_request)
+    fetch_scoreboard_data(days=[DAY], items=items, max_rps=None)
+    assert_that(calls).is_length(GAMES)
+    # some request started while another one was still in flight
+    calls.sort()
+    assert_that(any(later[0] < earlier[1]
+                    for earlier, later in zip(calls, calls[1:]))).is_true()
+
+
+def test_known_games_of_finished_days_are_not_requested(fake_endpoints,
+                                                        items):
+    day_items = scoreboard_frames(scoreboard_payload(DAY), items)
+    known = set(game_ids(day_items)[:5])
+    with BoxScoreFanOut(boxscore_items(items), known_games=known) as fan_out:
+        fan_out.attach(DAY, day_items)
+    assert_that(fake_endpoints.calls).is_length(GAMES - 5)\
+        .does_not_contain(*known)
+
+
+def test_box_scores_committed_by_earlier_runs_are_not_requested(
+        fake_endpoints, items, tmp_path):
+    db = start_engine(f"sqlite:///{tmp_path / 'nba.db'}")
+    batch_def = BATCHES["boxscore"]
+    assert_that(committed_games(db, batch_def)).is_empty()
+    batch_upload(data=merge_line_score(fetch_scoreboard_data(
+        days=[DAY], items=items, max_rps=None)), db=db, batch_def=batch_def)
+    FakeBoxScoreTraditionalV2.calls = []
+    fetch_scoreboard_data(days=[DAY], items=items, max_rps=None,
+                          known_games=committed_games(db, batch_def))
+    assert_that(FakeBoxScoreTraditionalV2.calls).is_empty()
+
+
+def test_the_pool_is_shut_down_when_the_iteration_stops(fake_endpoints,
+                                                        items, monkeypatch):
+    closed = []
+
+    class FanOut(BoxScoreFanOut):
+        def close(self):
+            closed.append(True)
+            super().close()
+
+    monkeypatch.setattr(collect, "BoxScoreFanOut", FanOut)
+    stream = iter_scoreboard_data(days=[DAY, "2019/12/10"], items=items,
+                                  max_rps=None)
+    next(stream)
+    stream.close()
+    assert_that(closed).is_length(1)
+
+
+def test_box_scores_are_upserted_once_per_player(fake_endpoints, items,
+                                                 tmp_path):
+    db = start_engine(f"sqlite:///{tmp_path / 'nba.db'}")
+    for _ in range(2):
+        data = merge_line_score(fetch_scoreboard_data(
+            date(2019, 12, 8), date(2019, 12, 9), items=items, max_rps=None))
+        results = batch_upload(data=data, db=db,
+                               batch_def=BATCHES["boxscore"])
+        assert_that([r for r in results if not r.success]).is_empty()
+    players = sum(len(data[day]["BoxScorePlayerStats"].index) for day in data)
+    assert_that(get_db_table_offset(db, "boxscore_player_stats"))\
+        .is_equal_to(players)
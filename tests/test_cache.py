@@ -0,0 +1,85 @@
+"""
+Tests for the response cache of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import os
+import time
+import pytest
+from assertpy import assert_that
+from app.cache import ResponseCache
+from tests.synthetic import scoreboard_payload
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return ResponseCache(path=str(tmp_path), max_bytes=10 * 1024 ** 2)
+
+
+def test_cache_returns_stored_payload(cache):
+    payload = scoreboard_payload("2019/12/02")
+    cache.put("scoreboardv2/2019/12/02", payload)
+    assert_that(cache.get("scoreboardv2/2019/12/02")).is_equal_to(payload)
+
+
+def test_cache_miss_returns_none(cache):
+    assert_that(cache.get("scoreboardv2/2019/12/02")).is_none()
+
+
+def test_cache_entry_past_max_age_is_stale(cache):
+    cache.put("scoreboardv2/2019/12/02", scoreboard_payload("2019/12/02"))
+    time.sleep(0.05)
+    assert_that(cache.get("scoreboardv2/2019/12/02", max_age=0.01)).is_none()
+
+
+def test_cache_stores_identical_payloads_once(cache):
+    payload = scoreboard_payload("2019/12/02")
+    first = cache.put("a", payload)
+    second = cache.put("b", payload)
+    assert_that(first).is_equal_to(second)
+    assert_that(cache.size()).is_equal_to(
+        cache._index["a"]["size"])
+
+
+def test_cache_compression_shrinks_payloads(tmp_path):
+    payload = scoreboard_payload("2019/12/02", games=10)
+    plain = ResponseCache(path=str(tmp_path / "plain"), compress=False)
+    packed = ResponseCache(path=str(tmp_path / "packed"), compress=True)
+    plain.put("day", payload)
+    packed.put("day", payload)
+    assert_that(packed.size()).is_less_than(plain.size())
+    assert_that(packed.get("day")).is_equal_to(payload)
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    payloads = {f"2019/12/0{i}": scoreboard_payload(f"2019/12/0{i}", games=5)
+                for i in range(1, 4)}
+    cache = ResponseCache(path=str(tmp_path), compress=False)
+    cache.put("2019/12/01", payloads["2019/12/01"])
+    cache.max_bytes = cache.size() * 2
+    cache.put("2019/12/02", payloads["2019/12/02"])
+    # touch the oldest entry so the second one becomes the LRU one
+    cache.get("2019/12/01")
+    cache.put("2019/12/03", payloads["2019/12/03"])
+    assert_that(cache.get("2019/12/02")).is_none()
+    assert_that(cache.get("2019/12/01")).is_not_none()
+    assert_that(cache.size()).is_less_than_or_equal_to(cache.max_bytes)
+
+
+def test_cache_index_survives_reopening(tmp_path):
+    cache = ResponseCache(path=str(tmp_path))
+    cache.put("day", {"resultSets": []})
+    cache.flush()
+    assert_that(ResponseCache(path=str(tmp_path)).get("day"))\
+        .is_equal_to({"resultSets": []})
+    assert_that(os.listdir(str(tmp_path))).contains("index.json")
+
+
+def test_processes_sharing_the_cache_keep_each_others_entries(tmp_path):
+    first, second = [ResponseCache(path=str(tmp_path)) for _ in range(2)]
+    first.put("2019/12/02", scoreboard_payload("2019/12/02"))
+    second.put("2019/12/03", scoreboard_payload("2019/12/03"))
+    first.flush()
+    second.flush()
+    assert_that(ResponseCache(path=str(tmp_path)).entries())\
+        .contains_key("2019/12/02", "2019/12/03")
@@ -9,7 +9,11 @@ from datetime import date
 import time
 import pandas as pd
 from assertpy import assert_that
-from app.collect import fetch_scoreboard_data
+from app.collect import fetch_scoreboard_data, iter_scoreboard_data, \
+    scoreboardv2
+from app.cache import ResponseCache
+from config import CACHE
+from tests.synthetic import FakeScoreboardV2
 
 
 @pytest.fixture()
@@ -36,6 +40,14 @@ def define_test_data_for_timeouts():
             "timeout_secs": timeout_secs}
 
 
+@pytest.fixture()
+def fake_endpoint(monkeypatch):
+    FakeScoreboardV2.calls = []
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    return FakeScoreboardV2
+
+
 def test_fetch_scoreboard_data_returns_dict(define_test_dates):
     assert_that(
         fetch_scoreboard_data(
@@ -83,7 +95,8 @@ def test_fetch_scoreboard_waits_expected_seconds_for_intervals_of_requests(
     fetch_scoreboard_data(start_date=define_test_data_for_timeouts["start"],
                           end_date=define_test_data_for_timeouts["end"],
                           timeout_days=define_test_data_for_timeouts["timeout_days"],
-                          timeout_secs=define_test_data_for_timeouts["timeout_secs"])
+                          timeout_secs=define_test_data_for_timeouts["timeout_secs"],
+                          adaptive=False)
     t2 = time.time()
     assert_that(t2 - t1).is_greater_than(120)
 
@@ -93,6 +106,90 @@ def test_fetch_scoreboard_defaults_to_config_timeout_vals(
     from config import TIMEOUT_SECS
     t1 = time.time()
     fetch_scoreboard_data(start_date=define_test_data_for_timeouts["start"],
-                          end_date=define_test_data_for_timeouts["end"])
+                          end_date=define_test_data_for_timeouts["end"],
+                          adaptive=False)
     t2 = time.time()
     assert_that(t2 - t1).is_greater_than(TIMEOUT_SECS)
+
+
+def test_fetch_scoreboard_concurrently_keeps_date_order(
+        fake_endpoint, define_test_dates):
+    out = fetch_scoreboard_data(define_test_dates[0], define_test_dates[1],
+                                workers=8, max_rps=None)
+    expected = pd.date_range(define_test_dates[0], define_test_dates[1])\
+        .strftime("%Y/%m/%d").tolist()
+    assert_that(list(out.keys())).is_equal_to(expected)
+
+
+def test_fetch_scoreboard_concurrently_returns_same_data_as_sequential(
+        fake_endpoint, define_test_dates):
+    sequential = fetch_scoreboard_data(define_test_dates[0],
+                                       define_test_dates[1],
+                                       timeout_days=100, adaptive=False)
+    concurrent = fetch_scoreboard_data(define_test_dates[0],
+                                       define_test_dates[1],
+                                       workers=4, max_rps=None)
+    for day in sequential:
+        pd.testing.assert_frame_equal(sequential[day]["LineScore"],
+                                      concurrent[day]["LineScore"])
+
+
+def test_fetch_scoreboard_concurrently_respects_rate_ceiling(
+        fake_endpoint, define_test_dates):
+    t1 = time.time()
+    fetch_scoreboard_data(define_test_dates[0], date(2019, 11, 6),
+                          workers=6, max_rps=10)
+    t2 = time.time()
+    # six requests at ten per second need at least half a second
+    assert_that(t2 - t1).is_greater_than_or_equal_to(0.5)
+
+
+def test_fetch_scoreboard_rerun_is_served_from_cache(
+        fake_endpoint, define_test_dates, tmp_path):
+    cache = ResponseCache(path=str(tmp_path))
+    first = fetch_scoreboard_data(define_test_dates[0], define_test_dates[1],
+                                  workers=4, max_rps=None, cache=cache)
+    FakeScoreboardV2.calls = []
+    second = fetch_scoreboard_data(define_test_dates[0], define_test_dates[1],
+                                   workers=4, max_rps=None, cache=cache)
+    assert_that(FakeScoreboardV2.calls).is_empty()
+    pd.testing.assert_frame_equal(first[define_test_dates[2]]["LineScore"],
+                                  second[define_test_dates[2]]["LineScore"])
+
+
+def test_iter_scoreboard_data_yields_days_in_order(fake_endpoint,
+                                                   define_test_dates):
+    days = [day for day, _ in iter_scoreboard_data(define_test_dates[0],
+                                                   define_test_dates[1],
+                                                   workers=4, max_rps=None)]
+    assert_that(days).is_equal_to(sorted(days)).is_length(30)
+
+
+def test_iter_scoreboard_data_fetches_a_bounded_window_ahead(
+        fake_endpoint, define_test_dates):
+    stream = iter_scoreboard_data(define_test_dates[0], define_test_dates[1],
+                                  workers=2, max_rps=None)
+    next(stream)
+    assert_that(len(FakeScoreboardV2.calls)).is_less_than_or_equal_to(5)
+    stream.close()
+
+
+def test_scoreboard_day_builds_data_frames_on_lookup(fake_endpoint):
+    day = fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 1))[
+        "2019/12/01"]
+    assert_that(day.materialized()).is_empty()
+    assert_that(list(day)).contains("LineScore", "TicketLinks")
+    assert_that(day["LineScore"]).is_type_of(pd.DataFrame)
+    assert_that(day.materialized()).is_equal_to(["LineScore"])
+
+
+def test_fetch_scoreboard_data_keeps_only_requested_items(fake_endpoint):
+    from app.collect import batch_items
+    from config import BATCHES
+    day = fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 1),
+                                items=batch_items(BATCHES["default"]))[
+        "2019/12/01"]
+    assert_that(list(day)).contains("Available", "GameHeader", "LineScore",
+                                    "SeriesStandings", "LastMeeting")
+    assert_that(list(day)).does_not_contain("TicketLinks", "WinProbability",
+                                            "TeamLeaders")
@@ -9,10 +9,12 @@ from assertpy import assert_that
 from sqlalchemy.engine import Connection
 from datetime import date
 from app.data import merge_line_score
-from app.commit import start_engine, get_db_table_offset, post_data, batch_upload
+from app.commit import start_engine, get_db_table_offset, post_data, \
+    batch_upload, stream_upload, bulk_upload, copy_insert, insert_method
 from app.common import update_config_with_env_vars
-from app.collect import fetch_scoreboard_data
-from config import DB, BATCHES
+from app.collect import fetch_scoreboard_data, scoreboard_frames, empty_day
+from tests.synthetic import scoreboard_payload
+from config import DB, BATCHES, DbActions
 
 
 @pytest.fixture()
@@ -36,6 +38,14 @@ def get_multi_data_frames():
         fetch_scoreboard_data(start_date=start, end_date=end))
 
 
+@pytest.fixture()
+def synthetic_data_frames():
+    return merge_line_score({
+        day: scoreboard_frames(scoreboard_payload(day, games))
+        for day, games in [("2019/12/01", 6), ("2019/12/02", 0),
+                           ("2019/12/03", 11)]})
+
+
 @pytest.fixture()
 def get_db_envs():
     return update_config_with_env_vars()
@@ -196,3 +206,428 @@ def test_batch_upload_for_many_days(get_multi_data_frames,
     failures = [r["success"] for r in [result[i] for i in result]
                 if r["success"] is False]
     assert_that(failures).is_empty()
+
+
+def test_stream_upload_writes_every_day(synthetic_data_frames, get_engine):
+    result = stream_upload(iter(synthetic_data_frames.items()),
+                           db=get_engine,
+                           batch_def=BATCHES["default"])
+    failures = [r for r in result if not r.success]
+    assert_that(failures).is_empty()
+    assert_that(get_db_table_offset(
+        get_engine, DB["NBA_DB_MAPPING"]["line_score"]["table"])
+    ).is_equal_to(17)
+
+
+def test_stream_upload_writes_standings_deltas_once(synthetic_data_frames,
+                                                    get_engine, monkeypatch):
+    import app.commit
+    tables = []
+    original = app.commit.post_data
+
+    def counting_post_data(**kwargs):
+        tables.append(kwargs["table"])
+        return original(**kwargs)
+
+    monkeypatch.setattr(app.commit, "post_data", counting_post_data)
+    result = stream_upload(iter(synthetic_data_frames.items()),
+                           db=get_engine,
+                           batch_def=BATCHES["default"])
+    standings = DB["NBA_DB_MAPPING"]["west_conference_standings_by_day"]
+    assert_that(tables.count(standings["table"])).is_equal_to(1)
+    monitors = [r for r in result if r.item == standings["name"]]
+    assert_that([m for m in monitors if not m.success]).is_empty()
+    superseded = [m for m in monitors if m.pre_offset == m.post_offset]
+    assert_that(superseded).is_length(len(monitors) - 1)
+
+
+def test_bulk_upload_matches_batch_upload(synthetic_data_frames, get_engine,
+                                          tmp_path):
+    batch_engine = start_engine(f"sqlite:///{tmp_path / 'batch.db'}")
+    batch_result = batch_upload(data=synthetic_data_frames, db=batch_engine,
+                                batch_def=BATCHES["default"])
+    bulk_result = bulk_upload(data=synthetic_data_frames, db=get_engine,
+                              batch_def=BATCHES["default"], chunksize=7)
+
+    def summary(monitors):
+        return sorted((m.date, m.item, m.pre_offset, m.post_offset, m.size,
+                       m.success) for m in monitors)
+
+    assert_that(summary(bulk_result)).is_equal_to(summary(batch_result))
+    table = DB["NBA_DB_MAPPING"]["line_score"]["table"]
+    assert_that(get_engine.execute(f"SELECT * FROM {table}").fetchall())\
+        .is_equal_to(batch_engine.execute(f"SELECT * FROM {table}").fetchall())
+
+
+def test_bulk_upload_writes_each_append_table_once(synthetic_data_frames,
+                                                    get_engine, monkeypatch):
+    import app.commit
+    calls = []
+    original = app.commit.post_data
+
+    def counting_post_data(**kwargs):
+        calls.append(kwargs["table"])
+        return original(**kwargs)
+
+    monkeypatch.setattr(app.commit, "post_data", counting_post_data)
+    bulk_upload(data=synthetic_data_frames, db=get_engine,
+                batch_def=BATCHES["default"])
+    appended = [e["table"] for e in BATCHES["default"]
+                if e["action"] in (DbActions.APPEND, DbActions.UPSERT)]
+    for table in appended:
+        assert_that(calls.count(table)).is_equal_to(1)
+
+
+class FakeCopyCursor(object):
+    def __init__(self):
+        self.sql, self.content, self.rowcount = None, None, -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def copy_expert(self, sql, file):
+        self.sql, self.content = sql, file.read()
+        self.rowcount = len(self.content.splitlines())
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.cursor_ = FakeCopyCursor()
+        self.connection = self
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_copy_insert_streams_rows_as_csv():
+    class Table(object):
+        name, schema = "line_score", None
+
+    conn = FakeConnection()
+    copied = copy_insert(Table(), conn, ["index", "GAME_ID", "PTS"],
+                         iter([(0, "0021900001", 110), (1, "", None)]))
+    assert_that(copied).is_equal_to(2)
+    assert_that(conn.cursor_.sql).starts_with(
+        'COPY "line_score" ("index", "GAME_ID", "PTS") FROM STDIN')
+    assert_that(conn.cursor_.content.splitlines()).is_equal_to(
+        ["0,0021900001,110", "1,,\\N"])
+
+
+def test_insert_method_uses_copy_for_postgres_only(get_engine):
+    from sqlalchemy import create_engine
+    postgres = create_engine("postgresql://nba@localhost/nba")
+    assert_that(insert_method(postgres)).is_equal_to(copy_insert)
+    assert_that(insert_method(postgres, "multi")).is_equal_to(copy_insert)
+    assert_that(insert_method(get_engine, "multi")).is_equal_to("multi")
+    assert_that(insert_method(get_engine)).is_none()
+
+
+def test_batch_upload_counts_each_table_once_per_run(synthetic_data_frames,
+                                                      get_engine,
+                                                      monkeypatch):
+    import app.commit
+    counted = []
+    original = app.commit.get_db_table_offset
+
+    def counting_offset(db_engine, table):
+        counted.append(table)
+        return original(db_engine, table)
+
+    monkeypatch.setattr(app.commit, "get_db_table_offset", counting_offset)
+    result = batch_upload(data=synthetic_data_frames, db=get_engine,
+                          batch_def=BATCHES["default"])
+    assert_that([r for r in result if not r.success]).is_empty()
+    assert_that(sorted(counted)).is_equal_to(sorted(set(counted)))
+
+
+def test_batch_upload_offsets_match_table_counts(synthetic_data_frames,
+                                                 get_engine):
+    result = batch_upload(data=synthetic_data_frames, db=get_engine,
+                          batch_def=BATCHES["default"])
+    for entry in BATCHES["default"]:
+        last = [r for r in result if r.item == entry["name"]][-1]
+        assert_that(last.post_offset).is_equal_to(
+            get_db_table_offset(get_engine, entry["table"]))
+
+
+def test_start_engine_reuses_engine_per_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'registry.db'}"
+    assert_that(start_engine(url)).is_same_as(start_engine(url))
+    assert_that(start_engine(url).echo).is_false()
+
+
+def test_in_memory_engine_is_shared_across_threads(get_engine):
+    from threading import Thread
+    get_engine.execute("CREATE TABLE shared (id INTEGER);")
+    seen = []
+    thread = Thread(target=lambda: seen.append(
+        start_engine(DB["NBA_DB_URL"]).has_table("shared")))
+    thread.start()
+    thread.join()
+    assert_that(seen).is_equal_to([True])
+
+
+def test_dispose_engines_empties_the_registry(tmp_path):
+    from app.commit import dispose_engines
+    url = f"sqlite:///{tmp_path / 'dispose.db'}"
+    first = start_engine(url)
+    dispose_engines()
+    assert_that(start_engine(url)).is_not_same_as(first)
+
+
+@pytest.fixture()
+def monitor_records():
+    from models.monitor import Monitor
+    return [Monitor(date=date(2019, 12, d), item="LineScore", pre_offset=d,
+                    post_offset=d + 1, size=1, success=True)
+            for d in range(1, 21)]
+
+
+def test_post_monitor_batch_commits_every_record(get_engine, monitor_records):
+    from app.commit import post_monitor_batch
+    assert_that(post_monitor_batch(get_engine, monitor_records))\
+        .is_equal_to(20)
+    assert_that(get_db_table_offset(get_engine, "monitor")).is_equal_to(20)
+
+
+def test_post_monitor_batch_drops_only_failing_records(get_engine,
+                                                        monitor_records):
+    from app.commit import post_monitor_batch
+    monitor_records[7].date = "not a date"
+    assert_that(post_monitor_batch(get_engine, monitor_records))\
+        .is_equal_to(19)
+    assert_that(get_db_table_offset(get_engine, "monitor")).is_equal_to(19)
+
+
+def test_plan_incremental_skips_committed_dates(get_engine):
+    from app.commit import post_monitor_batch, plan_incremental
+    from models.monitor import Monitor
+
+    def record(day, item, success):
+        return Monitor(date=date(2019, 12, day), item=item, pre_offset=0,
+                       post_offset=1, size=1, success=success)
+
+    post_monitor_batch(get_engine, [
+        record(1, "mergedLineScore", True), record(1, "LastMeeting", True),
+        record(2, "mergedLineScore", True), record(2, "LastMeeting", False),
+        record(3, "LastMeeting", False)])
+    days, committed = plan_incremental(get_engine, date(2019, 12, 1),
+                                       date(2019, 12, 4))
+    assert_that(days).is_equal_to(["2019/12/02", "2019/12/03", "2019/12/04"])
+    assert_that(committed).is_equal_to({"2019/12/02": {"mergedLineScore"},
+                                        "2019/12/03": set()})
+
+
+def test_plan_incremental_fetches_dates_missing_items_of_the_batch(
+        get_engine):
+    from app.commit import post_monitor_batch, plan_incremental
+    from models.monitor import Monitor
+    post_monitor_batch(get_engine, [
+        Monitor(date=date(2019, 12, day), item=entry["name"], pre_offset=0,
+                post_offset=1, size=1, success=True)
+        for day in (1, 2) for entry in BATCHES["default"]])
+    days, _ = plan_incremental(get_engine, date(2019, 12, 1),
+                               date(2019, 12, 2), BATCHES["default"])
+    assert_that(days).is_empty()
+    days, committed = plan_incremental(get_engine, date(2019, 12, 1),
+                                       date(2019, 12, 2), BATCHES["history"])
+    assert_that(days).is_equal_to(["2019/12/01", "2019/12/02"])
+    assert_that(committed["2019/12/01"])\
+        .is_equal_to({e["name"] for e in BATCHES["default"]})
+
+
+def test_plan_incremental_without_monitor_table_fetches_everything(get_engine):
+    from app.commit import plan_incremental
+    days, committed = plan_incremental(get_engine, date(2019, 12, 1),
+                                       date(2019, 12, 3))
+    assert_that(days).is_length(3)
+    assert_that(committed).is_empty()
+
+
+def test_batch_upload_rerun_upserts_instead_of_duplicating(
+        synthetic_data_frames, get_engine):
+    first = batch_upload(data=synthetic_data_frames, db=get_engine,
+                         batch_def=BATCHES["default"])
+    second = batch_upload(data=synthetic_data_frames, db=get_engine,
+                          batch_def=BATCHES["default"])
+    assert_that([r for r in first + second if not r.success]).is_empty()
+    for entry in BATCHES["default"]:
+        last = [r for r in first if r.item == entry["name"]][-1]
+        assert_that(get_db_table_offset(get_engine, entry["table"]))\
+            .is_equal_to(last.post_offset)
+    upserted = [r for r in second if r.item == "mergedLineScore"]
+    assert_that([r.pre_offset == r.post_offset for r in upserted])\
+        .does_not_contain(False)
+
+
+def test_post_data_upsert_counts_inserted_and_updated_rows(
+        synthetic_data_frames, get_engine):
+    frame = synthetic_data_frames["2019/12/03"]["SeriesStandings"]
+    post_data(db=get_engine, data=frame.iloc[:4], table="series_standings",
+              if_exists=DbActions.UPSERT)
+    written = post_data(db=get_engine, data=frame,
+                        table="series_standings",
+                        if_exists=DbActions.UPSERT)["series_standings"]
+    assert_that(written).is_equal_to(len(frame.index))
+    assert_that((written.inserted, written.updated)).is_equal_to(
+        (len(frame.index) - 4, 4))
+
+
+def test_bulk_upload_rerun_keeps_offsets(synthetic_data_frames, get_engine):
+    bulk_upload(data=synthetic_data_frames, db=get_engine,
+                batch_def=BATCHES["default"])
+    result = bulk_upload(data=synthetic_data_frames, db=get_engine,
+                         batch_def=BATCHES["default"])
+    assert_that([r for r in result if not r.success]).is_empty()
+    line_score = [r for r in result if r.item == "mergedLineScore"]
+    assert_that([(r.pre_offset, r.post_offset) for r in line_score])\
+        .is_equal_to([(17, 17), (17, 17)])
+
+
+def test_upsert_by_staging_replaces_matching_rows(synthetic_data_frames,
+                                                  get_engine):
+    from app.engine import upsert_by_staging
+    from models.scoreboard import SeriesStandings
+    frame = synthetic_data_frames["2019/12/01"]["SeriesStandings"]
+    post_data(db=get_engine, data=frame, table="series_standings",
+              if_exists=DbActions.UPSERT)
+    table = SeriesStandings.__table__
+    row = dict(frame.iloc[0], SERIES_LEADER="Changed",
+               HOME_TEAM_WINS=int(frame.iloc[0]["HOME_TEAM_WINS"]),
+               HOME_TEAM_LOSSES=int(frame.iloc[0]["HOME_TEAM_LOSSES"]),
+               HOME_TEAM_ID=int(frame.iloc[0]["HOME_TEAM_ID"]),
+               VISITOR_TEAM_ID=int(frame.iloc[0]["VISITOR_TEAM_ID"]))
+    with get_engine.begin() as connection:
+        upsert_by_staging(connection, table, list(table.columns), [row])
+    assert_that(get_db_table_offset(get_engine, "series_standings"))\
+        .is_equal_to(len(frame.index))
+    assert_that(get_engine.execute(
+        "SELECT SERIES_LEADER FROM series_standings WHERE GAME_ID = ?",
+        row["GAME_ID"]).scalar()).is_equal_to("Changed")
+
+
+def test_post_data_reports_a_failed_write_as_no_rows(synthetic_data_frames,
+                                                      get_engine):
+    frame = synthetic_data_frames["2019/12/01"]["SeriesStandings"]
+    post_data(db=get_engine, data=frame, table="series_standings",
+              if_exists=DbActions.APPEND)
+    # appending the same keys again violates the primary key
+    assert_that(post_data(db=get_engine, data=frame,
+                          table="series_standings",
+                          if_exists=DbActions.APPEND))\
+        .is_equal_to({"series_standings": 0})
+
+
+@pytest.fixture()
+def legacy_tables(synthetic_data_frames, get_engine):
+    # key-less tables as pandas' to_sql() created them in older versions
+    for entry in BATCHES["default"]:
+        synthetic_data_frames["2019/12/01"][entry["name"]].to_sql(
+            entry["table"], get_engine, if_exists="append")
+    return get_engine
+
+
+def test_batch_upload_into_legacy_tables_moves_offsets(synthetic_data_frames,
+                                                       legacy_tables):
+    for _ in range(2):
+        result = batch_upload(data=synthetic_data_frames, db=legacy_tables,
+                              batch_def=BATCHES["default"])
+        assert_that([r for r in result if not r.success]).is_empty()
+        line_score = [r for r in result if r.item == "mergedLineScore"]
+        assert_that([r.post_offset > r.pre_offset for r in line_score])\
+            .does_not_contain(False)
+    for entry in BATCHES["default"]:
+        last = [r for r in result if r.item == entry["name"]][-1]
+        assert_that(get_db_table_offset(legacy_tables, entry["table"]))\
+            .is_equal_to(last.post_offset)
+
+
+def test_post_data_upsert_into_a_legacy_table_replaces_rows(
+        synthetic_data_frames, legacy_tables):
+    frame = synthetic_data_frames["2019/12/01"]["SeriesStandings"]
+    written = post_data(db=legacy_tables, data=frame,
+                        table="series_standings",
+                        if_exists=DbActions.UPSERT)["series_standings"]
+    assert_that(written).is_equal_to(len(frame.index))
+    assert_that(get_db_table_offset(legacy_tables, "series_standings"))\
+        .is_equal_to(len(frame.index))
+
+
+def test_post_data_refuses_deltas_into_a_legacy_table(synthetic_data_frames,
+                                                      legacy_tables):
+    table = "east_conference_standings_by_day"
+    frame = synthetic_data_frames["2019/12/03"]["EastConfStandingsByDay"]
+    assert_that(post_data(db=legacy_tables, data=frame, table=table,
+                          if_exists=DbActions.DELTA)).is_equal_to({table: 0})
+    assert_that(get_db_table_offset(legacy_tables, table))\
+        .is_equal_to(len(synthetic_data_frames["2019/12/01"][
+            "EastConfStandingsByDay"].index))
+
+
+def test_batch_upload_writes_only_the_last_standings_snapshot(
+        synthetic_data_frames, get_engine):
+    result = batch_upload(data=synthetic_data_frames, db=get_engine,
+                          batch_def=BATCHES["default"])
+    standings = [r for r in result if r.item == "EastConfStandingsByDay"]
+    assert_that([r.success for r in standings]).does_not_contain(False)
+    assert_that([r.pre_offset == r.post_offset for r in standings[:-1]])\
+        .does_not_contain(False)
+    last = synthetic_data_frames["2019/12/03"]["EastConfStandingsByDay"]
+    assert_that(get_engine.execute(
+        "SELECT DISTINCT STANDINGSDATE FROM east_conference_standings_by_day"
+    ).fetchall()).is_length(1)
+    assert_that(get_db_table_offset(
+        get_engine, "east_conference_standings_by_day"))\
+        .is_equal_to(len(last.index)).is_equal_to(standings[-1].post_offset)
+
+
+def test_post_data_delta_updates_only_changed_rows(synthetic_data_frames,
+                                                   get_engine):
+    frame = synthetic_data_frames["2019/12/03"]["WestConfStandingsByDay"]
+    table = "west_conference_standings_by_day"
+    post_data(db=get_engine, data=frame, table=table,
+              if_exists=DbActions.DELTA)
+    changed = frame.copy()
+    changed.loc[changed.index[0], "W"] += 1
+    written = post_data(db=get_engine, data=changed, table=table,
+                        if_exists=DbActions.DELTA)[table]
+    assert_that(written).is_equal_to(len(frame.index))
+    assert_that((written.inserted, written.updated, written.unchanged,
+                 written.deleted)).is_equal_to((0, 1, len(frame.index) - 1, 0))
+    assert_that(get_engine.execute(
+        f"SELECT W FROM {table} WHERE TEAM_ID = ?",
+        int(changed.iloc[0]["TEAM_ID"])).scalar())\
+        .is_equal_to(int(changed.iloc[0]["W"]))
+
+
+def test_post_data_delta_deletes_rows_missing_from_the_snapshot(
+        synthetic_data_frames, get_engine):
+    frame = synthetic_data_frames["2019/12/03"]["WestConfStandingsByDay"]
+    table = "west_conference_standings_by_day"
+    post_data(db=get_engine, data=frame, table=table,
+              if_exists=DbActions.DELTA)
+    written = post_data(db=get_engine, data=frame.iloc[2:], table=table,
+                        if_exists=DbActions.DELTA)[table]
+    assert_that(written.deleted).is_equal_to(2)
+    assert_that(get_db_table_offset(get_engine, table))\
+        .is_equal_to(len(frame.index) - 2)
+
+
+@pytest.mark.parametrize("upload", [batch_upload, bulk_upload])
+def test_failed_days_are_recorded_as_failed(synthetic_data_frames,
+                                            get_engine, upload):
+    from app.commit import post_monitor_batch, plan_incremental
+    synthetic_data_frames["2019/12/04"] = empty_day(failed=True)
+    results = upload(data=merge_line_score(synthetic_data_frames),
+                     db=get_engine, batch_def=BATCHES["default"])
+    failed = [r for r in results if not r.success]
+    assert_that({r.item for r in failed})\
+        .is_equal_to({e["name"] for e in BATCHES["default"]})
+    assert_that({r.date for r in failed}).is_equal_to({date(2019, 12, 4)})
+    post_monitor_batch(get_engine, results)
+    days, _ = plan_incremental(get_engine, date(2019, 12, 3),
+                               date(2019, 12, 4))
+    assert_that(days).is_equal_to(["2019/12/04"])
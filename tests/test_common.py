@@ -7,7 +7,8 @@ import pytest
 import allure
 import re
 from assertpy import assert_that
-from app.common import update_config_with_env_vars, get_argv
+import time
+from app.common import update_config_with_env_vars, get_argv, RateLimiter
 
 
 class TestCommon(object):
@@ -62,3 +63,16 @@ class TestCommon(object):
     @pytest.mark.parametrize("date_name", ["NBASTARTDATE", "NBAENDDATE"])
     def test_get_argv_has_date_items(self, date_name, sdate, edate):
         assert_that(list(get_argv().keys())).contains(date_name)
+
+
+def test_rate_limiter_spaces_out_calls():
+    limiter = RateLimiter(max_rate=20)
+    t1 = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert_that(time.monotonic() - t1).is_greater_than_or_equal_to(0.2)
+
+
+def test_rate_limiter_without_rate_does_not_wait():
+    limiter = RateLimiter()
+    assert_that(sum(limiter.wait() for _ in range(100))).is_equal_to(0)
@@ -8,7 +8,11 @@ import allure
 from datetime import date
 from assertpy import assert_that
 from app.collect import fetch_scoreboard_data
-from app.data import merge_line_score, is_empty
+from app.data import merge_line_score, is_empty, stream_merge_line_score, \
+    drop_committed_items
+from app.collect import scoreboard_frames
+from tests.synthetic import scoreboard_payload
+import pandas as pd
 from pandas import DataFrame
 
 
@@ -74,3 +78,54 @@ def test_merged_line_score_returns_line_empty_data_frame_on_no_games_day(get_tes
         )
     )[get_test_data.get('no_games_date')].get(
             'mergedLineScore')).is_empty()
+
+
+@pytest.fixture()
+def synthetic_days():
+    return [(day, scoreboard_frames(scoreboard_payload(day, games)))
+            for day, games in [("2019/12/01", 6), ("2019/12/02", 0),
+                               ("2019/12/03", 11)]]
+
+
+def test_stream_merge_line_score_yields_merged_line_score(synthetic_days):
+    for day, items in stream_merge_line_score(iter(synthetic_days)):
+        assert_that(items).contains_key("mergedLineScore")
+        assert_that(len(items["mergedLineScore"]) * 2).is_equal_to(
+            len(items["LineScore"]))
+
+
+def test_drop_committed_items_removes_only_committed(synthetic_days):
+    data = merge_line_score(dict(synthetic_days))
+    data = drop_committed_items(data, {"2019/12/01": {"mergedLineScore"}})
+    assert_that(data["2019/12/01"]).does_not_contain_key("mergedLineScore")
+    assert_that(data["2019/12/03"]).contains_key("mergedLineScore")
+
+
+def merge_by_parity(line_score):
+    # the original per-day merge, relying on away/home rows alternating
+    away = line_score[line_score.index % 2 == 0]
+    home = line_score[line_score.index % 2 != 0]
+    return pd.merge(left=away, right=home, on="GAME_SEQUENCE",
+                    suffixes=("_away", "_home"))
+
+
+def test_merge_line_score_matches_merge_by_game_sequence(synthetic_days):
+    data = merge_line_score(dict(synthetic_days))
+    for day, items in data.items():
+        if items["LineScore"].empty:
+            assert_that(items["mergedLineScore"].empty).is_true()
+            continue
+        pd.testing.assert_frame_equal(items["mergedLineScore"],
+                                      merge_by_parity(items["LineScore"]))
+
+
+def test_merge_line_score_does_not_rely_on_row_order(synthetic_days):
+    day, items = synthetic_days[0]
+    expected = merge_by_parity(items["LineScore"])
+    # put home teams first, which breaks the alternating row assumption
+    swapped = items["LineScore"].iloc[
+        [i + 1 if i % 2 == 0 else i - 1
+         for i in range(len(items["LineScore"]))]].reset_index(drop=True)
+    items["LineScore"] = swapped
+    merged = merge_line_score({day: items})[day]["mergedLineScore"]
+    pd.testing.assert_frame_equal(merged, expected)
@@ -0,0 +1,90 @@
+"""
+Tests for the pandas-free ingestion path of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from assertpy import assert_that
+from sqlalchemy import create_engine
+from app.collect import scoreboard_frames
+from app.data import merge_line_score
+from app.commit import batch_upload
+from app.lite import lite_scoreboard_day, lite_upload, RowSet, LiteDay
+from config import BATCHES
+from tests.synthetic import scoreboard_payload
+
+
+@pytest.fixture()
+def synthetic_payloads():
+    payloads = {day: scoreboard_payload(day, games)
+                for day, games in [("2019/12/01", 6), ("2019/12/02", 0),
+                                   ("2019/12/03", 11)]}
+    # one overtime game, so PTS_OT1 holds integers and gaps
+    line_score = [r for r in payloads["2019/12/03"]["resultSets"]
+                  if r["name"] == "LineScore"][0]
+    overtime = line_score["headers"].index("PTS_OT1")
+    line_score["rowSet"][0][overtime] = 12
+    line_score["rowSet"][1][overtime] = 9
+    return payloads
+
+
+def table_dump(engine, table):
+    schema = engine.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? ORDER BY name",
+        table).fetchall()
+    rows = engine.execute(f'SELECT * FROM "{table}"').fetchall()
+    return schema, rows
+
+
+def test_lite_merge_matches_merge_line_score(synthetic_payloads):
+    for day, payload in synthetic_payloads.items():
+        lite = lite_scoreboard_day(payload)["mergedLineScore"]
+        frame = merge_line_score({day: scoreboard_frames(payload)})[day][
+            "mergedLineScore"]
+        assert_that(lite.columns).is_equal_to(list(frame.columns))
+        assert_that(lite.rows).is_equal_to(
+            [tuple(r) for r in frame.astype(object)
+             .where(frame.notna(), None).itertuples(index=False)])
+
+
+def test_lite_upload_writes_the_same_tables_as_batch_upload(
+        synthetic_payloads):
+    pandas_db = create_engine("sqlite://")
+    lite_db = create_engine("sqlite://")
+    frames = merge_line_score({day: scoreboard_frames(payload)
+                               for day, payload in synthetic_payloads.items()})
+    expected = batch_upload(data=frames, db=pandas_db,
+                            batch_def=BATCHES["default"])
+    result = lite_upload(data={day: lite_scoreboard_day(payload)
+                               for day, payload in synthetic_payloads.items()},
+                         db=lite_db, batch_def=BATCHES["default"])
+    for entry in BATCHES["default"]:
+        assert_that(table_dump(lite_db, entry["table"])).is_equal_to(
+            table_dump(pandas_db, entry["table"]))
+    assert_that(sorted((m.date, m.item, m.pre_offset, m.post_offset, m.size,
+                        m.success) for m in result)).is_equal_to(
+        sorted((m.date, m.item, m.pre_offset, m.post_offset, m.size,
+                m.success) for m in expected))
+
+
+def test_lite_upload_records_failed_days(synthetic_payloads):
+    db = create_engine("sqlite://")
+    data = {day: lite_scoreboard_day(payload)
+            for day, payload in synthetic_payloads.items()}
+    data["2019/12/02"] = LiteDay(failed=True)
+    result = lite_upload(data=data, db=db, batch_def=BATCHES["default"])
+    failed = [m for m in result if not m.success]
+    assert_that(failed).is_length(len(BATCHES["default"]))
+    assert_that({str(m.date) for m in failed}).is_equal_to({"2019-12-02"})
+    assert_that({m.item for m in failed}).is_equal_to(
+        {entry["name"] for entry in BATCHES["default"]})
+
+
+def test_row_set_types_follow_pandas():
+    rows = RowSet.from_result_set({
+        "headers": ["A", "B", "C", "D"],
+        "rowSet": [[1, 1, None, "x"], [2, None, None, None]]})
+    assert_that([str(t()) if isinstance(t, type) else str(t)
+                 for t in rows.types]).is_equal_to(
+        ["BIGINT", "FLOAT", "TEXT", "TEXT"])
+    assert_that(rows.rows[0][1]).is_instance_of(float)
@@ -0,0 +1,91 @@
+"""
+Tests for the run metrics of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from assertpy import assert_that
+from datetime import date
+from sqlalchemy import create_engine
+from app import metrics
+from app.collect import fetch_scoreboard_data, scoreboardv2
+from app.data import merge_line_score
+from app.commit import batch_upload, post_monitor_batch
+from config import BATCHES, CACHE
+from tests.synthetic import FakeScoreboardV2
+
+
+@pytest.fixture()
+def run(monkeypatch):
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    collector = metrics.start_run("test-run")
+    yield collector
+    metrics.stop_run()
+
+
+def instrumented_run():
+    data = merge_line_score(fetch_scoreboard_data(
+        date(2019, 12, 1), date(2019, 12, 3), workers=2, max_rps=None))
+    results = batch_upload(data=data, db=create_engine("sqlite://"),
+                           batch_def=BATCHES["default"])
+    post_monitor_batch(db=create_engine("sqlite://"), data=results)
+    return data
+
+
+def test_record_is_a_no_op_without_a_run():
+    metrics.stop_run()
+    metrics.record("fetch", 1.0, day="2019/12/01")
+    assert_that(metrics.enabled()).is_false()
+    assert_that(metrics.stop_run()).is_none()
+
+
+def test_stages_are_recorded_per_date_and_item(run):
+    data = instrumented_run()
+    fetches = [m for m in run.records if m.stage == "fetch"]
+    assert_that(sorted(m.date for m in fetches)).is_equal_to(
+        [date(2019, 12, 1), date(2019, 12, 2), date(2019, 12, 3)])
+    assert_that([m for m in fetches if not m.size_bytes > 0]).is_empty()
+    writes = [m for m in run.records if m.stage == "write"]
+    assert_that({m.item for m in writes}).is_equal_to(
+        {e["name"] for e in BATCHES["default"]})
+    line_score = sum(m.rows for m in writes if m.item == "mergedLineScore")
+    assert_that(line_score).is_equal_to(
+        sum(len(data[d]["mergedLineScore"].index) for d in data))
+    assert_that([m.stage for m in run.records]).contains("merge", "monitor")
+    assert_that({m.run_id for m in run.records}).is_equal_to({"test-run"})
+
+
+def test_response_size_counts_bytes_not_characters():
+    from nba_api.stats.library.http import NBAStatsResponse
+    from app.source import raw_response
+    body = '{"resultSets": [{"name": "Nikola Jokić"}]}'
+    raw = raw_response(NBAStatsResponse(body, 200, "scoreboardv2"))
+    assert_that(raw.size_bytes).is_equal_to(len(body) + 1)
+
+
+def test_rows_per_sec_is_derived_from_rows_and_secs():
+    collector = metrics.RunMetrics()
+    metric = collector.record("write", 0.5, day="2019/12/01", rows=100)
+    assert_that(metric.rows_per_sec).is_equal_to(200.0)
+    assert_that(metric.date).is_equal_to(date(2019, 12, 1))
+    assert_that(collector.record("cache", 0.0).rows_per_sec).is_none()
+
+
+def test_finish_run_stores_the_records_and_writes_a_prom_file(run, tmp_path):
+    instrumented_run()
+    db = create_engine("sqlite://")
+    path = str(tmp_path / "nba.prom")
+    finished = metrics.finish_run(db, path)
+    assert_that(metrics.enabled()).is_false()
+    stored = db.execute("select count(*), count(distinct stage) "
+                        "from run_metrics where run_id = 'test-run'").first()
+    assert_that(tuple(stored)).is_equal_to((len(finished.records), 4))
+    with open(path) as f:
+        text = f.read()
+    assert_that(text).contains(
+        "# TYPE nba_stage_seconds gauge",
+        'nba_stage_rows{stage="write",item="mergedLineScore"}',
+        'nba_request_latency_seconds{quantile="0.9"}',
+        "nba_request_latency_seconds_count 3")
+    assert_that(list(tmp_path.iterdir())).is_length(1)
@@ -0,0 +1,90 @@
+"""
+Tests for the table migrations of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from assertpy import assert_that
+from pandas import read_sql
+from sqlalchemy import create_engine, inspect
+from app.collect import scoreboard_frames
+from app.data import merge_line_score
+from app.migrate import migrate_all, migrate_batch, needs_migration, \
+    legacy_tables
+from config import BATCHES
+from tests.synthetic import scoreboard_payload
+
+
+@pytest.fixture()
+def legacy_db():
+    # tables as older versions created them: pandas' inferred types,
+    # an "index" column and a day that was uploaded twice
+    db = create_engine("sqlite://")
+    data = merge_line_score({day: scoreboard_frames(scoreboard_payload(day))
+                             for day in ["2019/12/01", "2019/12/03"]})
+    for day in ["2019/12/01", "2019/12/03", "2019/12/03"]:
+        for entry in BATCHES["default"]:
+            data[day][entry["name"]].to_sql(entry["table"], db,
+                                            if_exists="append", index=True)
+    return db
+
+
+def test_migrate_all_moves_tables_to_declared_schema(legacy_db):
+    for entry in BATCHES["default"]:
+        assert_that(needs_migration(legacy_db, entry["table"])).is_true()
+    migrated = migrate_all(legacy_db)
+    inspector = inspect(legacy_db)
+    assert_that(inspector.get_pk_constraint("line_score")[
+        "constrained_columns"]).is_equal_to(["GAME_ID_away"])
+    assert_that([c["name"] for c in inspector.get_columns("line_score")])\
+        .does_not_contain("index")
+    assert_that(inspector.get_table_names()).contains("line_score_legacy")
+    games = legacy_db.execute(
+        "SELECT COUNT(DISTINCT GAME_ID_away) FROM line_score").scalar()
+    assert_that(migrated["line_score"]).is_equal_to(games)
+    assert_that(legacy_db.execute(
+        "SELECT COUNT(*) FROM line_score").scalar()).is_equal_to(games)
+    assert_that(needs_migration(legacy_db, "line_score")).is_false()
+
+
+def test_migrate_all_is_a_no_op_on_declared_tables(legacy_db):
+    migrate_all(legacy_db)
+    migrated = migrate_all(legacy_db)
+    assert_that(migrated).contains_key(
+        *[entry["table"] for entry in BATCHES["default"]])
+    assert_that(set(migrated.values())).is_equal_to({0})
+
+
+def test_rows_repeating_a_key_keep_the_last_upload(legacy_db):
+    corrected = read_sql("SELECT * FROM line_score LIMIT 1", legacy_db,
+                         index_col="index")
+    corrected["PTS_home"] = 99
+    corrected.to_sql("line_score", legacy_db, if_exists="append", index=True)
+    migrate_all(legacy_db)
+    game = corrected["GAME_ID_away"].iloc[0]
+    assert_that(legacy_db.execute(
+        f"SELECT PTS_home FROM line_score WHERE GAME_ID_away = '{game}'")
+        .scalar()).is_equal_to(99)
+
+
+def test_migrate_batch_only_moves_legacy_tables_of_the_batch(legacy_db):
+    migrate_all(legacy_db)
+    for entry in BATCHES["default"][:1]:
+        legacy_db.execute(f"DROP TABLE {entry['table']}")
+        legacy_db.execute(f"CREATE TABLE {entry['table']} (x INTEGER)")
+    assert_that(migrate_batch(legacy_db, BATCHES["default"]))\
+        .is_equal_to({BATCHES["default"][0]["table"]: 0})
+
+
+def test_legacy_tables_are_dropped_only_when_asked_to(legacy_db):
+    rows = legacy_db.execute("SELECT COUNT(*) FROM line_score").scalar()
+    assert_that(legacy_tables(legacy_db, BATCHES["default"]))\
+        .is_equal_to([entry["table"] for entry in BATCHES["default"]])
+    migrate_batch(legacy_db, BATCHES["default"][:1])
+    assert_that(legacy_db.execute(
+        "SELECT COUNT(*) FROM line_score_legacy").scalar()).is_equal_to(rows)
+    migrate_batch(legacy_db, BATCHES["default"][1:2], keep_legacy=False)
+    assert_that(inspect(legacy_db).get_table_names()).does_not_contain(
+        f"{BATCHES['default'][1]['table']}_legacy")
+    assert_that(legacy_tables(legacy_db, BATCHES["default"]))\
+        .is_equal_to([entry["table"] for entry in BATCHES["default"][2:]])
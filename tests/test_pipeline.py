@@ -0,0 +1,71 @@
+"""
+Tests for the staged pipeline of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import time
+import pytest
+from datetime import date
+from assertpy import assert_that
+from app.collect import scoreboardv2
+from app.commit import start_engine, get_db_table_offset
+from app import pipeline
+from app.pipeline import run_pipeline
+from config import BATCHES, CACHE, DB
+from tests.synthetic import FakeScoreboardV2
+
+
+@pytest.fixture()
+def fake_endpoint(monkeypatch):
+    FakeScoreboardV2.calls = []
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+
+
+@pytest.fixture()
+def file_engine(tmp_path):
+    return start_engine(f"sqlite:///{tmp_path / 'nba.db'}")
+
+
+def test_run_pipeline_uploads_every_day(fake_endpoint, file_engine):
+    results, stats = run_pipeline(db=file_engine,
+                                  batch_def=BATCHES["default"],
+                                  start_date=date(2019, 12, 1),
+                                  end_date=date(2019, 12, 10),
+                                  workers=4, max_rps=None)
+    assert_that([r for r in results if not r.success]).is_empty()
+    assert_that(stats["commit"]["items"]).is_equal_to(10)
+    assert_that(get_db_table_offset(
+        file_engine, DB["NBA_DB_MAPPING"]["line_score"]["table"])
+    ).is_greater_than(0)
+
+
+def test_run_pipeline_applies_backpressure(fake_endpoint, file_engine,
+                                           monkeypatch):
+    def slow_upload(self, day, items):
+        time.sleep(0.05)
+        return []
+
+    monkeypatch.setattr(pipeline.StreamUploader, "upload", slow_upload)
+    results, stats = run_pipeline(db=file_engine,
+                                  batch_def=BATCHES["default"],
+                                  queue_size=2,
+                                  start_date=date(2019, 12, 1),
+                                  end_date=date(2019, 12, 20),
+                                  workers=2, max_rps=None)
+    assert_that(stats["fetch"]["max_queue_depth"]).is_less_than_or_equal_to(2)
+    assert_that(stats["transform"]["max_queue_depth"])\
+        .is_less_than_or_equal_to(2)
+    assert_that(stats["commit"]["items"]).is_equal_to(20)
+
+
+def test_run_pipeline_raises_stage_errors(fake_endpoint, file_engine,
+                                          monkeypatch):
+    def broken_merge(data):
+        raise ValueError("broken")
+
+    monkeypatch.setattr(pipeline, "merge_line_score", broken_merge)
+    with pytest.raises(ValueError):
+        run_pipeline(db=file_engine, batch_def=BATCHES["default"],
+                     start_date=date(2019, 12, 1),
+                     end_date=date(2019, 12, 10))
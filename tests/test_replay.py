@@ -0,0 +1,131 @@
+"""
+Tests for the record/replay layer of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import json
+import time
+import pytest
+import pandas as pd
+from assertpy import assert_that
+from datetime import date
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+from app import boxscore
+from app.collect import fetch_scoreboard_data, scoreboardv2, batch_items
+from app.replay import ReplayServer, save_fixture, load_fixture
+from config import BATCHES, CACHE, STATS, request_header
+from tests.synthetic import FakeScoreboardV2, FakeBoxScoreTraditionalV2, \
+    scoreboard_payload
+
+DAYS = ["2019/12/01", "2019/12/02", "2019/12/03"]
+
+
+@pytest.fixture()
+def fixtures_dir(tmp_path):
+    for day in DAYS:
+        save_fixture(str(tmp_path), day, scoreboard_payload(day))
+    return str(tmp_path)
+
+
+@pytest.fixture()
+def no_cache(monkeypatch):
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+
+
+def scoreboard_url(server, day):
+    return f"{server.url}/scoreboardv2?DayOffset=0&GameDate={day}&LeagueID=00"
+
+
+def test_fetching_with_a_record_dir_saves_fixtures(monkeypatch, no_cache,
+                                                   tmp_path):
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    monkeypatch.setitem(STATS, "NBA_RECORD_DIR", str(tmp_path))
+    fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 3), workers=2,
+                          max_rps=None)
+    for day in DAYS:
+        fixture = load_fixture(str(tmp_path), day)
+        assert_that(fixture["headers"]).is_equal_to(request_header)
+        assert_that(fixture["parameters"]["GameDate"]).is_equal_to(day)
+        assert_that(fixture["response"]).is_equal_to(scoreboard_payload(day))
+
+
+def test_fetch_scoreboard_data_replays_fixtures_from_the_server(
+        monkeypatch, no_cache, fixtures_dir):
+    with ReplayServer(fixtures_dir=fixtures_dir, port=0) as server:
+        monkeypatch.setitem(STATS, "NBA_STATS_URL", server.url)
+        out = fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 3),
+                                    workers=3, max_rps=None)
+    assert_that(server.served["ok"]).is_equal_to(3)
+    for day in DAYS:
+        expected = [r for r in scoreboard_payload(day)["resultSets"]
+                    if r["name"] == "LineScore"][0]
+        pd.testing.assert_frame_equal(
+            out[day]["LineScore"],
+            pd.DataFrame(expected["rowSet"], columns=expected["headers"]))
+
+
+def test_box_score_batches_are_recorded_and_replayed(monkeypatch, no_cache,
+                                                     tmp_path):
+    day = "2019/12/09"
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    monkeypatch.setattr(boxscore.boxscoretraditionalv2,
+                        "BoxScoreTraditionalV2", FakeBoxScoreTraditionalV2)
+    monkeypatch.setitem(STATS, "NBA_RECORD_DIR", str(tmp_path))
+    items = batch_items(BATCHES["boxscore"])
+    recorded = fetch_scoreboard_data(date(2019, 12, 9), date(2019, 12, 9),
+                                     items=items, max_rps=None)[day]
+    monkeypatch.setitem(STATS, "NBA_RECORD_DIR", None)
+    games = set(recorded["BoxScoreTeamStats"]["GAME_ID"])
+    fixture = load_fixture(str(tmp_path), min(games), boxscore.ENDPOINT)
+    assert_that(fixture["parameters"]["GameID"]).is_equal_to(min(games))
+    with ReplayServer(fixtures_dir=str(tmp_path), port=0) as server:
+        monkeypatch.setitem(STATS, "NBA_STATS_URL", server.url)
+        replayed = fetch_scoreboard_data(date(2019, 12, 9), date(2019, 12, 9),
+                                         items=items, max_rps=None)[day]
+    assert_that(server.served["ok"]).is_equal_to(1 + len(games))
+    assert_that(server.served["missing"]).is_equal_to(0)
+    for item in boxscore.boxscore_items(items):
+        pd.testing.assert_frame_equal(replayed[item], recorded[item])
+
+
+def test_replay_server_adds_latency(fixtures_dir):
+    with ReplayServer(fixtures_dir=fixtures_dir, port=0, latency=0.2,
+                      jitter=0.05, seed=1) as server:
+        t1 = time.monotonic()
+        body = json.load(urlopen(scoreboard_url(server, DAYS[0])))
+        t2 = time.monotonic()
+    assert_that(body).is_equal_to(scoreboard_payload(DAYS[0]))
+    assert_that(t2 - t1).is_greater_than_or_equal_to(0.15)
+
+
+def test_replay_server_injects_429s_and_timeouts(fixtures_dir):
+    with ReplayServer(fixtures_dir=fixtures_dir, port=0,
+                      error_rate=1.0) as server:
+        with pytest.raises(HTTPError) as error:
+            urlopen(scoreboard_url(server, DAYS[0]))
+    assert_that(error.value.code).is_equal_to(429)
+    assert_that(error.value.headers["Retry-After"]).is_equal_to("1")
+    with ReplayServer(fixtures_dir=fixtures_dir, port=0, timeout_rate=1.0,
+                      hang_secs=1) as server:
+        with pytest.raises((URLError, OSError)):
+            urlopen(scoreboard_url(server, DAYS[0]), timeout=0.2)
+    assert_that(server.served["timeout"]).is_equal_to(1)
+
+
+def test_replay_server_faults_are_reproducible(fixtures_dir):
+    draws = []
+    for _ in range(2):
+        server = ReplayServer(fixtures_dir=fixtures_dir, port=0,
+                              error_rate=0.3, timeout_rate=0.2, seed=7)
+        draws.append([server.fault() for _ in range(50)])
+        server.stop()
+    assert_that(draws[0]).is_equal_to(draws[1]).contains("error", "timeout")
+
+
+def test_replay_server_answers_404_without_a_fixture(fixtures_dir):
+    with ReplayServer(fixtures_dir=fixtures_dir, port=0) as server:
+        with pytest.raises(HTTPError) as error:
+            urlopen(scoreboard_url(server, "2019/12/25"))
+    assert_that(error.value.code).is_equal_to(404)
+    assert_that(server.served["missing"]).is_equal_to(1)
@@ -0,0 +1,150 @@
+"""
+Tests for the season calendar of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import json
+import pytest
+from assertpy import assert_that
+from datetime import date
+from app.cache import ResponseCache
+from app.collect import fetch_scoreboard_data, scoreboardv2
+from app.data import is_empty
+from app.schedule import SeasonCalendar, default_calendar, game_count, \
+    finals_over
+from config import CACHE, SCHEDULE
+from tests.synthetic import FakeScoreboardV2, scoreboard_payload
+
+START, END = date(2019, 12, 1), date(2019, 12, 6)
+# synthetic dates of that range without games
+EMPTY_DAYS = ["2019/12/03", "2019/12/04"]
+
+
+@pytest.fixture()
+def calendar(tmp_path):
+    return SeasonCalendar(path=str(tmp_path / "calendar.json"))
+
+
+@pytest.fixture()
+def fake_endpoint(monkeypatch):
+    FakeScoreboardV2.calls = []
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(scoreboardv2, "ScoreboardV2", FakeScoreboardV2)
+    return FakeScoreboardV2
+
+
+def finals_payload(day: str) -> dict:
+    """
+    :param day: date string formatted as "%Y/%m/%d"
+    :return: synthetic response of a day on which the NBA Finals ended
+    :rtype: dict
+    """
+    raw = scoreboard_payload(day, games=1)
+    for result_set in raw["resultSets"]:
+        if result_set["name"] == "SeriesStandings":
+            headers, row = result_set["headers"], result_set["rowSet"][0]
+            row[headers.index("GAME_ID")] = "0041800406"
+            row[headers.index("HOME_TEAM_WINS")] = 2
+            row[headers.index("HOME_TEAM_LOSSES")] = 4
+    return raw
+
+
+def test_the_end_of_the_finals_is_recognised():
+    assert_that(finals_over(finals_payload("2019/06/13"))).is_true()
+    assert_that(finals_over(scoreboard_payload("2019/06/13", games=1)))\
+        .is_false()
+
+
+def test_off_season_dates_have_no_games(calendar):
+    calendar.observe("2019/06/13", finals_payload("2019/06/13"),
+                     checked=date(2019, 6, 14))
+    assert_that(calendar.has_games("2019/06/13")).is_true()
+    assert_that(calendar.has_games("2019/07/15")).is_false()
+    assert_that(calendar.has_games("2019/12/25")).is_none()
+    assert_that(calendar.days_to_fetch(["2019/07/15", "2019/12/25"]))\
+        .is_equal_to(["2019/12/25"])
+
+
+def test_off_seasons_end_at_the_next_date_with_games(calendar):
+    calendar.observe("2019/06/13", finals_payload("2019/06/13"),
+                     checked=date(2019, 6, 14))
+    calendar.observe("2019/07/20", scoreboard_payload("2019/07/20", games=2),
+                     checked=date(2019, 7, 21))
+    assert_that(calendar.off_seasons()).is_equal_to(
+        [(date(2019, 6, 14), date(2019, 7, 19))])
+    assert_that(calendar.has_games("2019/07/25")).is_none()
+
+
+def test_off_seasons_are_learned_from_the_cache(calendar, tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache"))
+    cache.put("scoreboardv2/2019/06/13", finals_payload("2019/06/13"))
+    calendar.learn_from_cache(cache)
+    assert_that(calendar.has_games("2019/07/15")).is_false()
+
+
+def test_observed_dates_are_known(calendar):
+    for day in ["2019/12/02", "2019/12/03"]:
+        calendar.observe(day, scoreboard_payload(day),
+                         checked=date(2020, 1, 1))
+    assert_that(game_count(scoreboard_payload("2019/12/02"))).is_equal_to(7)
+    assert_that(calendar.has_games("2019/12/02")).is_true()
+    assert_that(calendar.has_games("2019/12/03")).is_false()
+
+
+def test_empty_dates_checked_before_they_were_over_are_unknown(calendar):
+    calendar.observe("2019/12/03", scoreboard_payload("2019/12/03"),
+                     checked=date(2019, 11, 20))
+    assert_that(calendar.has_games("2019/12/03")).is_none()
+    calendar.observe("2019/12/03", scoreboard_payload("2019/12/03", games=2),
+                     checked=date(2019, 12, 2))
+    assert_that(calendar.has_games("2019/12/03")).is_true()
+
+
+def test_save_merges_with_other_processes(calendar):
+    other = SeasonCalendar(path=calendar.path)
+    calendar.observe("2019/12/02", scoreboard_payload("2019/12/02"))
+    other.observe("2019/12/03", scoreboard_payload("2019/12/03"))
+    calendar.save()
+    other.save()
+    with open(calendar.path) as f:
+        assert_that(sorted(json.load(f)))\
+            .is_equal_to(["2019-12-02", "2019-12-03"])
+    assert_that(SeasonCalendar(path=calendar.path).seasons())\
+        .is_equal_to({"2019-20": {"game_days": 1, "empty_days": 1}})
+
+
+def test_calendar_learns_from_the_cache(calendar, tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache"))
+    for day in EMPTY_DAYS:
+        cache.put(f"scoreboardv2/{day}", scoreboard_payload(day))
+    assert_that(calendar.learn_from_cache(cache)).is_equal_to(2)
+    assert_that(calendar.days_to_fetch(EMPTY_DAYS)).is_empty()
+
+
+def test_calendar_does_not_depend_on_the_cache(monkeypatch):
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    assert_that(default_calendar()).is_not_none()
+    monkeypatch.setitem(SCHEDULE, "ENABLED", False)
+    assert_that(default_calendar()).is_none()
+
+
+def test_collector_skips_dates_known_to_have_no_games(fake_endpoint,
+                                                      calendar):
+    first = fetch_scoreboard_data(START, END, max_rps=None, calendar=calendar)
+    assert_that(first).is_length(6)
+    FakeScoreboardV2.calls = []
+    second = fetch_scoreboard_data(START, END, max_rps=None,
+                                   calendar=calendar)
+    assert_that(FakeScoreboardV2.calls).is_length(4)\
+        .does_not_contain(*EMPTY_DAYS)
+    assert_that(list(second)).is_equal_to(list(first))
+    assert_that([day for day in second if is_empty(second, day)])\
+        .is_equal_to(EMPTY_DAYS)
+
+
+def test_full_scan_requests_every_date(fake_endpoint, calendar):
+    fetch_scoreboard_data(START, END, max_rps=None, calendar=calendar)
+    FakeScoreboardV2.calls = []
+    fetch_scoreboard_data(START, END, max_rps=None, calendar=calendar,
+                          skip_empty=False)
+    assert_that(FakeScoreboardV2.calls).is_length(6).contains(*EMPTY_DAYS)
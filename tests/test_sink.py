@@ -0,0 +1,83 @@
+"""
+Tests for the Parquet sink of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import os
+import pytest
+import pyarrow as pa
+from assertpy import assert_that
+from datetime import date
+from sqlalchemy import create_engine
+from app.collect import scoreboard_frames
+from app.data import merge_line_score
+from app.commit import batch_upload, bulk_upload
+from app.sink import ParquetSink, sink_upload, season_of
+from config import BATCHES
+from tests.synthetic import scoreboard_payload
+
+
+@pytest.fixture()
+def frames():
+    return merge_line_score({
+        day: scoreboard_frames(scoreboard_payload(day, games))
+        for day, games in [("2019/06/10", 2), ("2019/12/01", 6),
+                           ("2019/12/02", 0), ("2019/12/03", 11)]})
+
+
+@pytest.fixture()
+def sink(tmp_path):
+    return ParquetSink(root=str(tmp_path))
+
+
+def test_season_of_rolls_over_in_august():
+    assert_that(season_of(date(2019, 6, 10))).is_equal_to("2018-19")
+    assert_that(season_of(date(2019, 12, 1))).is_equal_to("2019-20")
+    assert_that(season_of(date(2099, 10, 1))).is_equal_to("2099-00")
+
+
+def test_sink_upload_partitions_by_season_and_date(frames, sink):
+    result = sink_upload(data=frames, batch_def=BATCHES["default"], sink=sink)
+    assert_that([r for r in result if not r.success]).is_empty()
+    assert_that(sorted(os.listdir(os.path.join(sink.root, "line_score"))))\
+        .is_equal_to(["season=2018-19", "season=2019-20"])
+    assert_that(sorted(os.listdir(os.path.join(
+        sink.root, "line_score", "season=2019-20")))).is_equal_to(
+        ["date=2019-12-01", "date=2019-12-03"])
+    season = sink.read("line_score", season="2019-20")
+    assert_that(season.num_rows).is_equal_to(17)
+    assert_that(sink.read("line_score").num_rows).is_equal_to(19)
+
+
+def test_sink_keeps_declared_types_and_encodes_team_columns(frames, sink):
+    sink_upload(data=frames, batch_def=BATCHES["default"], sink=sink)
+    schema = sink.read("line_score").schema
+    assert_that(pa.types.is_dictionary(
+        schema.field("TEAM_ABBREVIATION_home").type)).is_true()
+    assert_that(str(schema.field("PTS_away").type)).is_equal_to("int16")
+    assert_that(str(schema.field("GAME_DATE_EST_away").type))\
+        .is_equal_to("timestamp[ms]")
+    standings = sink.read("east_conference_standings_by_day",
+                          columns=["STANDINGSDATE", "TEAM_ID", "W"])
+    assert_that(str(standings.schema.field("STANDINGSDATE").type))\
+        .is_equal_to("date32[day]")
+    assert_that(standings.num_rows).is_equal_to(60)
+
+
+def test_sink_rewrites_a_date_instead_of_duplicating_it(frames, sink):
+    sink_upload(data=frames, batch_def=BATCHES["default"], sink=sink)
+    sink_upload(data=frames, batch_def=BATCHES["default"], sink=sink)
+    assert_that(sink.read("line_score").num_rows).is_equal_to(19)
+
+
+def test_batch_and_bulk_upload_write_the_sink_as_extra_output(frames,
+                                                              tmp_path):
+    for upload in (batch_upload, bulk_upload):
+        sink = ParquetSink(root=str(tmp_path / upload.__name__))
+        result = upload(data=frames, db=create_engine("sqlite://"),
+                        batch_def=BATCHES["default"], sink=sink)
+        assert_that([r for r in result if not r.success]).is_empty()
+        for entry in BATCHES["default"]:
+            assert_that(sink.read(entry["table"]).num_rows).is_equal_to(
+                sum(len(frames[day][entry["name"]].index) for day in frames
+                    if entry["name"] in frames[day]))
@@ -0,0 +1,95 @@
+"""
+Tests for the standings history of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+from assertpy import assert_that
+from datetime import date
+from sqlalchemy import create_engine
+from app.collect import scoreboard_frames
+from app.data import merge_line_score, drop_committed_items
+from app.commit import batch_upload, bulk_upload, get_db_table_offset
+from app.lite import lite_scoreboard_day, lite_upload
+from app.standings import standings_as_of, snapshot_date
+from config import BATCHES
+from tests.synthetic import scoreboard_payload
+
+DAYS = [("2019/12/01", 6), ("2019/12/02", 0), ("2019/12/03", 11)]
+
+
+@pytest.fixture()
+def payloads():
+    return {day: scoreboard_payload(day, games) for day, games in DAYS}
+
+
+@pytest.fixture()
+def frames(payloads):
+    return merge_line_score({day: scoreboard_frames(payload)
+                             for day, payload in payloads.items()})
+
+
+@pytest.fixture()
+def db():
+    return create_engine("sqlite://")
+
+
+def test_history_batch_keeps_every_snapshot(frames, db):
+    result = batch_upload(data=frames, db=db, batch_def=BATCHES["history"])
+    assert_that([r for r in result if not r.success]).is_empty()
+    assert_that(db.execute(
+        "SELECT DISTINCT STANDINGSDATE FROM east_conference_standings_history"
+        " ORDER BY 1").fetchall()).is_equal_to(
+        [("2019-12-01",), ("2019-12-02",), ("2019-12-03",)])
+    assert_that(get_db_table_offset(db, "east_conference_standings_by_day"))\
+        .is_equal_to(15)
+    history = [r for r in result if r.item == "EastConfStandingsHistory"]
+    assert_that([(r.pre_offset, r.post_offset) for r in history])\
+        .is_equal_to([(0, 15), (15, 30), (30, 45)])
+
+
+def test_history_rerun_does_not_duplicate_snapshots(frames, db):
+    batch_upload(data=frames, db=db, batch_def=BATCHES["history"])
+    result = bulk_upload(data=frames, db=db, batch_def=BATCHES["history"])
+    assert_that([r for r in result if not r.success]).is_empty()
+    assert_that(get_db_table_offset(db, "west_conference_standings_history"))\
+        .is_equal_to(45)
+    history = [r for r in result if r.item == "WestConfStandingsHistory"]
+    assert_that([r.pre_offset == r.post_offset == 45 for r in history])\
+        .does_not_contain(False)
+
+
+def test_lite_history_matches_batch_history(payloads, frames, db):
+    lite_db = create_engine("sqlite://")
+    batch_upload(data=frames, db=db, batch_def=BATCHES["history"])
+    lite_upload(data={day: lite_scoreboard_day(payload)
+                      for day, payload in payloads.items()},
+                db=lite_db, batch_def=BATCHES["history"])
+    query = "SELECT * FROM west_conference_standings_history ORDER BY 1, 2"
+    assert_that(lite_db.execute(query).fetchall()).is_equal_to(
+        db.execute(query).fetchall())
+
+
+def test_standings_as_of_reads_the_last_snapshot_before_a_date(frames, db):
+    batch_upload(data=frames, db=db, batch_def=BATCHES["history"])
+    table = "east_conference_standings_history"
+    assert_that(snapshot_date(db, table, date(2019, 11, 30))).is_none()
+    assert_that(snapshot_date(db, table, date(2019, 12, 2)))\
+        .is_equal_to(date(2019, 12, 2))
+    assert_that(snapshot_date(db, table)).is_equal_to(date(2019, 12, 3))
+    standings = standings_as_of(db, table, date(2019, 12, 1))
+    expected = frames["2019/12/01"]["EastConfStandingsByDay"]
+    assert_that(sorted((r.TEAM_ID, r.W) for r in standings)).is_equal_to(
+        sorted(zip(expected["TEAM_ID"], expected["W"])))
+    assert_that([r.W_PCT for r in standings])\
+        .is_equal_to(sorted(expected["W_PCT"], reverse=True))
+    assert_that(standings_as_of(db, table, date(2019, 11, 30))).is_empty()
+
+
+def test_drop_committed_items_keeps_items_with_pending_targets(frames):
+    committed = {"2019/12/01": {"EastConfStandingsByDay",
+                                "WestConfStandingsByDay",
+                                "WestConfStandingsHistory"}}
+    data = drop_committed_items(frames, committed, BATCHES["history"])
+    assert_that(data["2019/12/01"]).contains_key("EastConfStandingsByDay")\
+        .does_not_contain_key("WestConfStandingsByDay")
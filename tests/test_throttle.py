@@ -0,0 +1,244 @@
+"""
+Tests for the adaptive throttle of NBA_v2
+Author: Maciej Cisowski
+"""
+
+import pytest
+import requests
+import threading
+from assertpy import assert_that
+import time
+from datetime import date
+from functools import partial
+from app import collect, metrics
+from app.collect import fetch_scoreboard_data
+from app.replay import ReplayServer, save_fixture
+from app.source import endpoint_response
+from app.throttle import AdaptiveRateLimiter, AdaptiveThrottle, \
+    CircuitBreaker, ResponseError, failure_kind, adaptive_limiter
+from nba_api.stats.library.http import NBAStatsResponse
+from config import CACHE, STATS, THROTTLE
+from tests.synthetic import scoreboard_payload
+
+
+def flaky(failures: list):
+    """
+    :param failures: exceptions to raise, one per call, before answering
+    :return: request callable
+    """
+    calls = []
+
+    def request(day):
+        calls.append(day)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return {"day": day}
+    request.calls = calls
+    return request
+
+
+def test_failure_kind_only_retries_transient_failures():
+    assert_that(failure_kind(ResponseError(429))).is_equal_to("throttled")
+    assert_that(failure_kind(ResponseError(503))).is_equal_to("server")
+    assert_that(failure_kind(requests.exceptions.ReadTimeout()))\
+        .is_equal_to("timeout")
+    assert_that(failure_kind(requests.exceptions.ConnectionError()))\
+        .is_equal_to("connection")
+    assert_that(failure_kind(ValueError("Expecting value"))).\
+        is_equal_to("malformed")
+    assert_that(failure_kind(ResponseError(404))).is_none()
+    assert_that(failure_kind(TypeError())).is_none()
+
+
+def test_failure_kind_reads_the_status_of_http_errors():
+    response = requests.Response()
+    for status, kind in [(429, "throttled"), (502, "server"), (404, None)]:
+        response.status_code = status
+        error = requests.exceptions.HTTPError(response=response)
+        assert_that(failure_kind(error)).is_equal_to(kind)
+
+
+class ThrottledEndpoint(object):
+    """
+    nba-api endpoint answered with the HTML page of a throttled request.
+    """
+
+    def get_request(self):
+        self.nba_response = NBAStatsResponse("<html>Too Many Requests</html>",
+                                             429, "https://stats.nba.com")
+        self.nba_response.get_dict()
+
+
+def test_unparsable_error_pages_raise_their_status():
+    with pytest.raises(ResponseError) as error:
+        endpoint_response(ThrottledEndpoint())
+    assert_that(failure_kind(error.value)).is_equal_to("throttled")
+
+
+def test_rate_increases_additively_and_decreases_multiplicatively():
+    limiter = AdaptiveRateLimiter(rate=1.0, max_rate=1.2, min_rate=0.2,
+                                  increase=0.1, decrease=0.5,
+                                  target_latency=1.0)
+    assert_that(limiter.on_success(0.1)).is_close_to(1.1, 1e-9)
+    assert_that(limiter.on_success(0.1)).is_close_to(1.2, 1e-9)
+    assert_that(limiter.on_success(0.1)).is_close_to(1.2, 1e-9)
+    assert_that(limiter.on_success(5.0)).is_close_to(0.6, 1e-9)
+    assert_that(limiter.on_failure()).is_close_to(0.3, 1e-9)
+    assert_that(limiter.on_failure()).is_close_to(0.2, 1e-9)
+    assert_that(limiter.interval).is_close_to(5.0, 1e-9)
+
+
+def test_unlimited_rate_falls_back_on_the_first_failure():
+    limiter = AdaptiveRateLimiter(decrease=0.5, fallback_rate=2.0)
+    assert_that(limiter.on_success(0.1)).is_none()
+    assert_that(limiter.wait()).is_equal_to(0)
+    assert_that(limiter.on_failure()).is_equal_to(1.0)
+
+
+def test_rate_recovers_after_a_429_up_to_the_cap(monkeypatch):
+    monkeypatch.setitem(THROTTLE, "START_FACTOR", 0.5)
+    throttle = AdaptiveThrottle(adaptive_limiter(100.0), CircuitBreaker(),
+                                backoff_base=0.01, seed=1)
+    limiter = throttle.limiter
+    limiter.increase = 10.0
+    assert_that(limiter.max_rate).is_greater_than(limiter.rate)
+    throttle.call(flaky([ResponseError(429)]), "2019/12/01")
+    assert_that(limiter.rate).is_less_than(50.0)
+    for _ in range(10):
+        throttle.call(flaky([]), "2019/12/01")
+    assert_that(limiter.rate).is_equal_to(100.0)
+
+
+def test_circuit_breaker_pauses_after_failures_in_a_row():
+    breaker = CircuitBreaker(threshold=3, cooldown=0.2)
+    breaker.on_failure()
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    breaker.on_failure()
+    assert_that(breaker.is_open).is_false()
+    breaker.on_failure()
+    assert_that(breaker.is_open).is_true()
+    assert_that(breaker.trips).is_equal_to(1)
+    assert_that(breaker.wait()).is_greater_than_or_equal_to(0.15)
+    assert_that(breaker.is_open).is_false()
+
+
+def test_half_open_breaker_lets_a_single_probe_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.on_failure()
+    passed = []
+
+    def worker(n):
+        breaker.wait()
+        passed.append(n)
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(3)]
+    for thread in workers:
+        thread.start()
+    time.sleep(0.3)
+    assert_that(passed).is_length(1)
+    breaker.on_failure()
+    time.sleep(0.3)
+    assert_that(passed).is_length(2)
+    assert_that(breaker.trips).is_equal_to(2)
+    breaker.on_success()
+    for thread in workers:
+        thread.join(timeout=1)
+    assert_that(passed).is_length(3)
+
+
+def test_released_probe_hands_over_to_the_next_caller():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.01)
+    breaker.on_failure()
+    breaker.wait()
+    waiter = threading.Thread(target=breaker.wait)
+    waiter.start()
+    waiter.join(timeout=0.1)
+    assert_that(waiter.is_alive()).is_true()
+    breaker.release()
+    waiter.join(timeout=1)
+    assert_that(waiter.is_alive()).is_false()
+
+
+def test_final_failures_count_towards_the_breaker():
+    throttle = AdaptiveThrottle(breaker=CircuitBreaker(threshold=2,
+                                                       cooldown=0.01),
+                                max_retries=1, backoff_base=0.01)
+    with pytest.raises(ResponseError):
+        throttle.call(flaky([ResponseError(503)] * 2), "2019/12/01")
+    assert_that(throttle.breaker.trips).is_equal_to(1)
+
+
+def test_throttle_retries_transient_failures_in_place():
+    throttle = AdaptiveThrottle(AdaptiveRateLimiter(), CircuitBreaker(),
+                                backoff_base=0.01, seed=1)
+    request = flaky([ResponseError(429), requests.exceptions.ReadTimeout()])
+    raw, retries, _ = throttle.call(request, "2019/12/01")
+    assert_that(raw).is_equal_to({"day": "2019/12/01"})
+    assert_that(retries).is_equal_to(2)
+    assert_that(request.calls).is_length(3)
+    assert_that(throttle.limiter.rate).is_not_none()
+
+
+def test_throttle_gives_up_on_permanent_failures_and_after_max_retries():
+    throttle = AdaptiveThrottle(max_retries=2, backoff_base=0.01)
+    request = flaky([ResponseError(404)])
+    with pytest.raises(ResponseError):
+        throttle.call(request, "2019/12/01")
+    assert_that(request.calls).is_length(1)
+    request = flaky([ResponseError(503)] * 3)
+    with pytest.raises(ResponseError):
+        throttle.call(request, "2019/12/01")
+    assert_that(request.calls).is_length(3)
+
+
+def test_backoff_is_jittered_and_capped():
+    throttle = AdaptiveThrottle(backoff_base=1.0, backoff_max=4.0, seed=3)
+    delays = [throttle.backoff(attempt) for attempt in range(8)]
+    assert_that(max(delays)).is_less_than_or_equal_to(4.0)
+    assert_that(len(set(delays))).is_equal_to(8)
+
+
+def test_fetch_retries_429s_from_the_server_without_restarting(
+        monkeypatch, tmp_path):
+    days = ["2019/12/01", "2019/12/02", "2019/12/03", "2019/12/04"]
+    for day in days:
+        save_fixture(str(tmp_path), day, scoreboard_payload(day))
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(collect, "AdaptiveThrottle",
+                        partial(AdaptiveThrottle, backoff_base=0.01,
+                                breaker=CircuitBreaker(cooldown=0.05)))
+    run = metrics.start_run()
+    try:
+        with ReplayServer(fixtures_dir=str(tmp_path), port=0,
+                          error_rate=0.4, seed=5) as server:
+            monkeypatch.setitem(STATS, "NBA_STATS_URL", server.url)
+            out = fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 4),
+                                        workers=2, max_rps=50)
+    finally:
+        metrics.stop_run()
+    assert_that(list(out)).is_equal_to(days)
+    assert_that(server.served["ok"]).is_equal_to(4)
+    assert_that(server.served["error"]).is_greater_than(0)
+    assert_that(sum(m.retries for m in run.records if m.stage == "fetch"))\
+        .is_equal_to(server.served["error"])
+
+
+def test_a_day_failing_for_good_does_not_abort_the_range(monkeypatch):
+    monkeypatch.setitem(CACHE, "ENABLED", False)
+    monkeypatch.setattr(collect, "AdaptiveThrottle",
+                        partial(AdaptiveThrottle, max_retries=1,
+                                backoff_base=0.01))
+
+    def request(day):
+        if day == "2019/12/02":
+            raise ResponseError(503)
+        return scoreboard_payload(day)
+    monkeypatch.setattr(collect, "request_endpoint", request)
+    out = fetch_scoreboard_data(date(2019, 12, 1), date(2019, 12, 3),
+                                workers=2, max_rps=None)
+    assert_that(list(out)).is_equal_to(["2019/12/01", "2019/12/02",
+                                        "2019/12/03"])
+    assert_that([out[day].failed for day in out])\
+        .is_equal_to([False, True, False])
+    assert_that(out["2019/12/02"]["GameHeader"].empty).is_true()